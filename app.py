@@ -1,71 +1,834 @@
 
-import webview
+import argparse
+import functools
 import os
+import signal
 import sys
 import threading
 import http.server
 import socketserver
 import json
+import base64
+import email.utils
+import io
+import itertools
+import sqlite3
 import logging
-import bleach
+import re
+import time
+# Cold-start timings are measured from here, before the project modules load
+IMPORT_STARTED = time.perf_counter()
+from contextlib import contextmanager
+from datetime import date, timedelta
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from database_manager import DatabaseManager
+from urllib.parse import urlsplit, parse_qs
+from database_manager import (COLLECTION_TABLES, SYNC_TABLES, DatabaseService, calendar_event_to_dict, note_to_dict,
+                              task_to_dict)
+from event_stream import EventBroker
+from json_importer import migrate_json_store
+from maintenance import MaintenanceService
+from metrics import metrics
+from sanitizer import NoteSanitizer
+from serialization import dumps, iter_json_array, iter_ndjson
+from static_files import (ENCODING_SUFFIXES, PRECOMPRESS_EXTENSIONS, StaticFileCache, StreamCompressor, accepted_encodings,
+                          brotli, compress, encoded_etag, find_precompressed)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Number of worker threads serving HTTP requests; override with NEOFOCUS_SERVER_WORKERS
+DEFAULT_SERVER_WORKERS = 8
+# The GUI takes the first free port from DEFAULT_PORT upwards; headless mode binds exactly what it is given
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8000
+GUI_PORT_ATTEMPTS = 10
+
+def get_base_path():
+    """Directory holding the bundled files: sys._MEIPASS in a PyInstaller build, else app.py's"""
+    if getattr(sys, 'frozen', False):
+        return sys._MEIPASS
+    return os.path.dirname(os.path.abspath(__file__))
+
+def get_data_dir():
+    """Absolute directory of the database.
+
+    A frozen build unpacks into a temporary sys._MEIPASS that is deleted on
+    exit, so its data lives next to the executable instead.
+    """
+    if getattr(sys, 'frozen', False):
+        return os.path.join(os.path.dirname(os.path.abspath(sys.executable)), 'data')
+    return os.path.join(get_base_path(), 'data')
+
+DEFAULT_DB_PATH = os.path.join(get_data_dir(), 'neofocus.db')
+# Seconds the splash screen waits for the database before saying why it is still waiting
+STARTUP_TIMEOUT = 30
+
+class ThreadPoolHTTPServer(socketserver.TCPServer):
+    """TCPServer that hands each accepted connection to a bounded thread pool"""
+    allow_reuse_address = True
+    # The webview requests dozens of chunks at once on first load; the default
+    # backlog of 5 makes the kernel drop SYNs and clients retry after ~1s.
+    request_queue_size = 128
+
+    def __init__(self, server_address, handler_class, max_workers=DEFAULT_SERVER_WORKERS):
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='neofocus-http')
+        # Connections handed off by their handler (event streams) stay open after it returns
+        self._detached = set()
+        self._detached_lock = threading.Lock()
+        super().__init__(server_address, handler_class)
+
+    def detach_request(self, request):
+        """Leave request open when its handler finishes; the caller now owns the socket"""
+        with self._detached_lock:
+            self._detached.add(request)
+
+    def shutdown_request(self, request):
+        with self._detached_lock:
+            if request in self._detached:
+                self._detached.discard(request)
+                return
+        super().shutdown_request(request)
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self._process_request_worker, request, client_address)
+
+    def _process_request_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=True)
+
+def get_server_workers():
+    try:
+        workers = int(os.environ.get('NEOFOCUS_SERVER_WORKERS', DEFAULT_SERVER_WORKERS))
+    except ValueError:
+        logger.warning("Invalid NEOFOCUS_SERVER_WORKERS value, using default")
+        return DEFAULT_SERVER_WORKERS
+    return max(1, workers)
+
+# Shared by all request threads so repeated autosaves of the same body hit its cache
+note_sanitizer = NoteSanitizer()
+# Hot files from the out/ export, shared by all request threads
+static_cache = StaticFileCache()
+
+# Page size used when a cursor is given without a limit, and the largest page served
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+# Longest from/to window /api/calendar-events expands repeating events over
+MAX_OCCURRENCE_WINDOW_DAYS = 366
+# /api/analytics ranges: a number of days ending today, or 'all'
+DEFAULT_ANALYTICS_RANGE = '30d'
+MAX_ANALYTICS_RANGE_DAYS = 3660
+# /api/notes/<id>/revisions lists a note's history; .../revisions/<n> rebuilds one version
+NOTE_REVISIONS_PATH = re.compile(r'^/api/notes/([^/]+)/revisions(?:/(\d+))?$')
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+def decode_cursor(token, size):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("Invalid cursor")
+    return values
+
+# Largest number of operations accepted by one /api/batch request
+MAX_BATCH_OPERATIONS = 10000
+
+# (entity, op) -> (DatabaseManager bulk method, fields required in data)
+BATCH_OPERATIONS = {
+    ('notes', 'create'): ('bulk_add_notes', ('id', 'title', 'createdAt', 'updatedAt')),
+    ('notes', 'update'): ('bulk_update_notes', ('title', 'updatedAt')),
+    ('notes', 'delete'): ('bulk_delete_notes', ()),
+    ('tasks', 'create'): ('bulk_add_tasks', ('title',)),
+    ('tasks', 'update'): ('bulk_update_tasks', ('title',)),
+    ('tasks', 'delete'): ('bulk_delete_tasks', ()),
+    ('calendar-events', 'create'): ('bulk_add_calendar_events', ('title', 'date')),
+    ('calendar-events', 'update'): ('bulk_update_calendar_events', ('title', 'date')),
+    ('calendar-events', 'delete'): ('bulk_delete_calendar_events', ()),
+}
+
+class BatchError(Exception):
+    def __init__(self, index, message):
+        super().__init__(message)
+        self.index = index
+
+def _prepare_batch_item(index, item):
+    """Validate one batch operation and return (entity, op, payload)"""
+    if not isinstance(item, dict):
+        raise BatchError(index, "operation must be an object")
+    entity, op = item.get('entity'), item.get('op')
+    if (entity, op) not in BATCH_OPERATIONS:
+        raise BatchError(index, f"unsupported operation {op!r} on {entity!r}")
+    _, required = BATCH_OPERATIONS[(entity, op)]
+    if op != 'create' and item.get('id') is None:
+        raise BatchError(index, "id is required")
+    if op == 'delete':
+        return entity, op, item['id']
+
+    data = item.get('data')
+    if not isinstance(data, dict):
+        raise BatchError(index, "data must be an object")
+    data = dict(data)
+    if op == 'update':
+        data['id'] = item['id']
+    missing = [field for field in required if data.get(field) is None]
+    if missing:
+        raise BatchError(index, f"missing fields: {', '.join(missing)}")
+    if entity == 'notes':
+        data['content'] = note_sanitizer.clean(data.get('content', ''))
+        data.setdefault('tags', [])
+    return entity, op, data
+
+def apply_batch(db_manager, operations):
+    """Apply create/update/delete operations atomically and return per-item results.
+
+    Consecutive operations of the same kind run as one executemany call; the
+    whole batch shares a single transaction, so any failure rolls back all of it.
+    Updates and deletes of rows that do not exist are skipped as not_found.
+    """
+    prepared = [_prepare_batch_item(index, item) for index, item in enumerate(operations)]
+
+    runs = []
+    for index, (entity, op, payload) in enumerate(prepared):
+        if runs and runs[-1][0] == (entity, op):
+            runs[-1][1].append(index)
+            runs[-1][2].append(payload)
+        else:
+            runs.append(((entity, op), [index], [payload]))
+
+    results = [None] * len(prepared)
+    with db_manager.transaction():
+        for (entity, op), indexes, payloads in runs:
+            method = getattr(db_manager, BATCH_OPERATIONS[(entity, op)][0])
+            try:
+                created = method(payloads)
+            except sqlite3.Error as e:
+                raise BatchError(indexes[0], str(e))
+            # Updates and deletes return the ids that had a row; the rest are reported per item
+            found = {str(item_id) for item_id in created or ()} if op != 'create' else None
+            for position, index in enumerate(indexes):
+                if op == 'delete':
+                    item_id = payloads[position]
+                elif entity != 'notes' and op == 'create':
+                    item_id = created[position]
+                else:
+                    item_id = payloads[position]['id']
+                status = 'ok' if found is None or str(item_id) in found else 'not_found'
+                results[index] = {'index': index, 'status': status, 'id': item_id}
+    return results
+
+# JSON bodies smaller than this go out uncompressed; they fit in a packet or two anyway
+COMPRESS_MIN_BYTES = 1400
+# Fast settings for per-request compression; static assets are precompressed at maximum
+BROTLI_QUALITY = 4
+GZIP_LEVEL = 6
+# Idle keep-alive connections are closed after this many seconds so they
+# don't hold a pool worker indefinitely
+KEEP_ALIVE_TIMEOUT = 5
+
+# Lists longer than this are encoded and sent in chunks instead of as one body
+STREAM_MIN_ROWS = 500
+# Requested with ?format=ndjson or an Accept header naming it
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+
+def preferred_encoding(accept_encoding):
+    accepted = accepted_encodings(accept_encoding)
+    if 'br' in accepted and brotli is not None:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+def compression_level(encoding):
+    return BROTLI_QUALITY if encoding == 'br' else GZIP_LEVEL
+
+def compress_body(body, accept_encoding):
+    """Return (body, encoding), compressing body if it is large and the client accepts it"""
+    if len(body) < COMPRESS_MIN_BYTES:
+        return body, None
+    encoding = preferred_encoding(accept_encoding)
+    if encoding is None:
+        return body, None
+    with metrics.time('neofocus_compress_duration_seconds', encoding=encoding):
+        return compress(body, encoding, compression_level(encoding)), encoding
+
+# Written to on shutdown with a JSON summary of /api/metrics, if set
+METRICS_LOG_ENV = 'NEOFOCUS_METRICS_LOG'
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+class CountingWriter:
+    """Wraps a handler's wfile and counts the bytes written through it"""
+
+    def __init__(self, wfile):
+        self.wfile = wfile
+        self.bytes_written = 0
+
+    def write(self, data):
+        self.bytes_written += len(data)
+        return self.wfile.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.wfile, name)
+
+# Content-hashed Next.js build output never changes under the same URL
+IMMUTABLE_PATH_PREFIX = '/_next/static/'
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+def etag_matches(if_none_match, etag):
+    """Whether an If-None-Match header value matches etag (weak comparison, RFC 9110)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    candidates = [value.strip() for value in if_none_match.split(',')]
+    return etag in [value[2:] if value.startswith('W/') else value for value in candidates]
+
+def analytics_window(range_value, today=None):
+    """(from, to) ISO dates of an analytics range such as '7d' (today and the 6 days before) or 'all'"""
+    if range_value == 'all':
+        return None, None
+    days = range_value[:-1] if range_value.endswith('d') else ''
+    if not days.isdigit() or not 1 <= int(days) <= MAX_ANALYTICS_RANGE_DAYS:
+        raise ValueError(f"range must be 'all' or a number of days from 1d to {MAX_ANALYTICS_RANGE_DAYS}d")
+    today = today or date.today()
+    return (today - timedelta(days=int(days) - 1)).isoformat(), today.isoformat()
+
+class ListQuery:
+    """Paging and filter parameters parsed from a list endpoint's query string"""
+
+    def __init__(self, query_string, cursor_size):
+        self.params = {key: values[-1] for key, values in parse_qs(query_string).items()}
+        self.cursor = decode_cursor(self.params['cursor'], cursor_size) if 'cursor' in self.params else None
+        limit = self.params.get('limit')
+        if limit is None:
+            self.limit = DEFAULT_PAGE_SIZE if self.cursor is not None else None
+        else:
+            try:
+                self.limit = int(limit)
+            except ValueError:
+                raise ValueError("limit must be an integer")
+            if self.limit < 1:
+                raise ValueError("limit must be positive")
+            self.limit = min(self.limit, MAX_PAGE_SIZE)
+
+    def get(self, name):
+        return self.params.get(name)
+
+    def get_bool(self, name):
+        value = self.params.get(name)
+        if value is None:
+            return None
+        if value.lower() in ('1', 'true', 'yes'):
+            return True
+        if value.lower() in ('0', 'false', 'no'):
+            return False
+        raise ValueError(f"{name} must be true or false")
+
+    def date_window(self, max_days):
+        """(from, to) if both are given, checked to be ISO dates at most max_days apart, else None"""
+        date_from, date_to = self.params.get('from'), self.params.get('to')
+        if date_from is None or date_to is None:
+            return None
+        try:
+            days = (date.fromisoformat(date_to) - date.fromisoformat(date_from)).days
+        except ValueError:
+            raise ValueError("from and to must be dates in YYYY-MM-DD format")
+        if days < 0:
+            raise ValueError("from must not be after to")
+        if days >= max_days:
+            raise ValueError(f"from and to may be at most {max_days} days apart")
+        return date_from, date_to
+
+    @property
+    def fetch_limit(self):
+        # One extra row tells us whether another page follows
+        return self.limit + 1 if self.limit is not None else None
+
+    def page(self, rows, cursor_key):
+        """Trim rows to the page size and return (rows, next_cursor)"""
+        if self.limit is None or len(rows) <= self.limit:
+            return rows, None
+        rows = rows[:self.limit]
+        return rows, encode_cursor(cursor_key(rows[-1]))
+
 class ApiRequestHandler(http.server.SimpleHTTPRequestHandler):
-    db_manager = DatabaseManager('data/neofocus.db')
+    # Persistent connections, so the webview's repeated fetches reuse one socket
+    protocol_version = 'HTTP/1.1'
+    timeout = KEEP_ALIVE_TIMEOUT
+    # Headers and body are separate writes; with Nagle on, the body of a
+    # keep-alive response waits ~40 ms for the client's delayed ACK
+    disable_nagle_algorithm = True
+    # Number of values in each list endpoint's pagination cursor
+    list_cursor_sizes = {'/api/notes': 2, '/api/tasks': 1, '/api/calendar-events': 2}
+    # Tables each cacheable GET endpoint reads; their versions make up its ETag
+    etag_tables = {
+        '/api/notes': ('notes',),
+        '/api/notes/tags': ('notes',),
+        '/api/notes/search': ('notes',),
+        '/api/tasks': ('tasks',),
+        '/api/calendar-events': ('calendar_events',),
+        '/api/sync': SYNC_TABLES,
+        '/api/data': ('notes', 'store_settings', *COLLECTION_TABLES.values()),
+    }
+    # Other API paths are reported under a shared label to keep metric series bounded
+    metric_routes = frozenset(etag_tables) | {'/api/analytics', '/api/events', '/api/flush', '/api/health', '/api/stats', '/api/metrics', '/api/save', '/api/batch'}
+    # Set by make_handler: the app's DatabaseService, event broker and startup timings
+    database = None
+    event_broker = None
+    startup = None
+    # Validator for the current response, sent with 200 and 304 responses
+    etag = None
+    status_code = None
+    request_started = None
+
+    @property
+    def db_manager(self):
+        # Opens the database on first use, or waits while it is being opened
+        return self.database.get()
+
+    def setup(self):
+        super().setup()
+        self.wfile = CountingWriter(self.wfile)
+
+    def handle_one_request(self):
+        # One handler serves every request on a keep-alive connection, so
+        # per-response state starts over here
+        self.etag = self.status_code = self.request_started = self.command = None
+        bytes_before = self.wfile.bytes_written
+        try:
+            super().handle_one_request()
+        finally:
+            if self.request_started is not None and self.command:
+                metrics.observe_request(self._route_label(), self.command, self.status_code,
+                                        time.perf_counter() - self.request_started, self.wfile.bytes_written - bytes_before)
+
+    def parse_request(self):
+        # Timed from here rather than from the read, which includes keep-alive idle time
+        self.request_started = time.perf_counter()
+        return super().parse_request()
+
+    def _route_label(self):
+        path = urlsplit(self.path).path
+        if path in self.metric_routes:
+            return path
+        if NOTE_REVISIONS_PATH.match(path):
+            return '/api/notes/{id}/revisions'
+        if path.startswith('/api/notes/'):
+            return '/api/notes/{id}'
+        return '/api/other' if path.startswith('/api/') else 'static'
+
+    def send_response(self, code, message=None):
+        self.status_code = code
+        super().send_response(code, message)
+
+    def end_headers(self):
+        if self.etag and self.status_code in (200, 304):
+            self.send_header('ETag', self.etag)
+            if urlsplit(self.path).path.startswith(IMMUTABLE_PATH_PREFIX):
+                self.send_header('Cache-Control', IMMUTABLE_CACHE_CONTROL)
+            else:
+                # Cache, but revalidate every time; unchanged responses come back as 304
+                self.send_header('Cache-Control', 'no-cache')
+        super().end_headers()
+
+    def send_head(self):
+        """Serve a file from the export, preferring a precompressed .br/.gz sibling.
+
+        Directory redirects, listings and 404s are left to SimpleHTTPRequestHandler.
+        """
+        path = self.translate_path(self.path)
+        if os.path.isdir(path) and urlsplit(self.path).path.endswith('/'):
+            for index in ('index.html', 'index.htm'):
+                if os.path.isfile(os.path.join(path, index)):
+                    path = os.path.join(path, index)
+                    break
+        if not os.path.isfile(path):
+            return super().send_head()
+        try:
+            stat = os.stat(path)
+            encoding, served_path, served_stat = find_precompressed(path, stat, self.headers.get('Accept-Encoding'))
+            self.etag = encoded_etag(f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"', encoding)
+            vary = os.path.splitext(path)[1].lower() in PRECOMPRESS_EXTENSIONS
+            if self._not_modified(stat):
+                self.send_response(304)
+                if vary:
+                    self.send_header('Vary', 'Accept-Encoding')
+                self.end_headers()
+                return None
 
-    def _send_response(self, status_code, data=None, content_type='application/json'):
+            data, hot = static_cache.get(served_path, served_stat)
+            if data is None:
+                body = open(served_path, 'rb')
+                length = os.fstat(body.fileno()).st_size
+                if hot:
+                    with body:
+                        data = body.read()
+                    static_cache.put(served_path, served_stat, data)
+            if data is not None:
+                body, length = io.BytesIO(data), len(data)
+        except OSError:
+            self.send_error(404, "File not found")
+            return None
+
+        self.send_response(200)
+        self.send_header('Content-type', self.guess_type(path))
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        if vary:
+            self.send_header('Vary', 'Accept-Encoding')
+        self.send_header('Content-Length', str(length))
+        self.send_header('Last-Modified', self.date_time_string(stat.st_mtime))
+        self.end_headers()
+        return body
+
+    def _not_modified(self, stat):
+        # If-None-Match takes precedence over If-Modified-Since (RFC 9110)
+        if 'If-None-Match' in self.headers:
+            return etag_matches(self.headers['If-None-Match'], self.etag)
+        since = self.headers.get('If-Modified-Since')
+        if not since:
+            return False
+        try:
+            since_time = email.utils.parsedate_to_datetime(since)
+        except (TypeError, IndexError, OverflowError, ValueError):
+            return False
+        return since_time.tzinfo is not None and int(stat.st_mtime) <= since_time.timestamp()
+
+    def copyfile(self, source, outputfile):
+        if isinstance(source, io.BufferedReader) and outputfile is self.wfile:
+            # Cache misses go straight from the page cache to the socket
+            # (os.sendfile where available; socket.sendfile falls back to send)
+            self.wfile.bytes_written += self.connection.sendfile(source)
+        else:
+            super().copyfile(source, outputfile)
+
+    def _send_response(self, status_code, data=None, content_type='application/json', headers=None):
+        body = None
+        if data is not None:
+            with metrics.time('neofocus_serialize_duration_seconds', route=self._route_label()):
+                body = dumps(data)
+        self._send_bytes(status_code, body, content_type, headers)
+
+    def _send_bytes(self, status_code, body, content_type='application/json', headers=None):
+        has_body = body is not None
+        body, encoding = compress_body(body or b'', self.headers.get('Accept-Encoding'))
         self.send_response(status_code)
+        if status_code != 304:
+            self.send_header('Content-type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+        if has_body or status_code == 304:
+            self.send_header('Vary', 'Accept-Encoding')
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+            self.etag = encoded_etag(self.etag, encoding) if self.etag else None
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if body and self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _not_modified_etag(self):
+        """The variant of self.etag the client already has, if any"""
+        if_none_match = self.headers.get('If-None-Match')
+        for encoding in (None, *ENCODING_SUFFIXES):
+            if etag_matches(if_none_match, encoded_etag(self.etag, encoding)):
+                return encoded_etag(self.etag, encoding)
+        return None
+
+    def _send_chunked(self, chunks, content_type='application/json', headers=None):
+        """Send a 200 response whose body is produced piece by piece.
+
+        HTTP/1.0 clients can't take chunked transfer coding, so they get the
+        pieces joined into one body instead.
+        """
+        if self.request_version == 'HTTP/1.0':
+            body, encoding = compress_body(b''.join(chunks), self.headers.get('Accept-Encoding'))
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+        else:
+            encoding = preferred_encoding(self.headers.get('Accept-Encoding'))
+            self.send_response(200)
+            self.send_header('Transfer-Encoding', 'chunked')
         self.send_header('Content-type', content_type)
+        self.send_header('Vary', 'Accept-Encoding')
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+            self.etag = encoded_etag(self.etag, encoding) if self.etag else None
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command == 'HEAD':
+            return
+        if self.request_version == 'HTTP/1.0':
+            self.wfile.write(body)
+            return
+
+        compressor = StreamCompressor(encoding, compression_level(encoding)) if encoding else None
+        try:
+            for chunk in chunks:
+                if compressor:
+                    chunk = compressor.compress(chunk)
+                if chunk:
+                    self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+            if compressor:
+                tail = compressor.flush()
+                if tail:
+                    self.wfile.write(b'%x\r\n%s\r\n' % (len(tail), tail))
+            self.wfile.write(b'0\r\n\r\n')
+        except Exception as e:
+            # Headers are gone already; dropping the connection without the
+            # final chunk tells the client the body is incomplete
+            logger.error(f"Error streaming {self.path}: {e}")
+            self.close_connection = True
+
+    def _send_rows(self, rows, to_dict, ndjson=False, headers=None):
+        """Send rows as a JSON array (or NDJSON), streaming them when there are many.
+
+        Short results are sent as one body with a Content-Length; past
+        STREAM_MIN_ROWS the rest of rows is consumed lazily while sending.
+        """
+        rows = iter(rows)
+        first = list(itertools.islice(rows, STREAM_MIN_ROWS))
+        encode = iter_ndjson if ndjson else iter_json_array
+        content_type = NDJSON_CONTENT_TYPE if ndjson else 'application/json'
+        if len(first) < STREAM_MIN_ROWS:
+            self._send_bytes(200, b''.join(encode(map(to_dict, first))), content_type, headers)
+        else:
+            self._send_chunked(encode(map(to_dict, itertools.chain(first, rows))), content_type, headers)
+
+    def _send_page(self, query, rows, cursor_key, to_dict):
+        rows, next_cursor = query.page(rows, cursor_key)
+        # The body stays a plain array; the continuation token travels in a header
+        headers = {'X-Next-Cursor': next_cursor} if next_cursor else None
+        ndjson = query.get('format') == 'ndjson' or NDJSON_CONTENT_TYPE in (self.headers.get('Accept') or '')
+        self._send_rows(rows, to_dict, ndjson, headers)
+
+    def _send_health(self):
+        """200 once the database is open, 503 while it is opening, importing or if it failed"""
+        database = self.database
+        if database is None or database.is_open:
+            body = {'status': 'ready'}
+        elif database.error is not None:
+            body = {'status': 'error', 'error': str(database.error)}
+        elif database.importing:
+            body = {'status': 'importing'}
+        else:
+            body = {'status': 'starting'}
+        if self.startup is not None:
+            body['startup'] = self.startup.to_dict()
+        self._send_response(200 if body['status'] == 'ready' else 503, body)
+
+    def _send_database_unavailable(self, error):
+        """503 for a request that needs the database when it cannot be opened"""
+        database = self.database
+        if database is not None and database.error is not None:
+            error = database.error
+        self._send_response(503, {'status': 'error', 'error': str(error)})
+
+    def _start_event_stream(self):
+        """Send event-stream headers, then hand the connection to the event broker.
+
+        The broker thread writes every later event, so this worker is free
+        again as soon as the headers are out.
+        """
+        detach = getattr(self.server, 'detach_request', None)
+        if self.event_broker is None or detach is None:
+            self._send_response(503, {'error': 'Change events are not available'})
+            return
+        last_event_id = self.headers.get('Last-Event-ID') or parse_qs(urlsplit(self.path).query).get('lastEventId', [None])[-1]
+        try:
+            last_event_id = int(last_event_id) if last_event_id else None
+        except ValueError:
+            last_event_id = None
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-store')
+        self.send_header('Connection', 'close')
         self.end_headers()
-        if data:
-            self.wfile.write(json.dumps(data).encode())
+        self.wfile.flush()
+        self.close_connection = True
+        detach(self.request)
+        self.event_broker.attach(self.request, last_event_id)
 
     def do_GET(self):
-        if self.path == '/api/notes':
+        url = urlsplit(self.path)
+        if url.path in self.list_cursor_sizes:
             try:
-                notes_data = self.db_manager.get_notes()
-                notes = [
-                    {
-                        "id": n[0], "title": n[1], "content": n[2], "tags": n[3].split(',') if n[3] else [],
-                        "category": n[4], "createdAt": n[5], "updatedAt": n[6]
-                    }
-                    for n in notes_data
-                ]
-                self._send_response(200, notes)
+                query = ListQuery(url.query, self.list_cursor_sizes[url.path])
+                # Paging through stored rows keeps plain date filtering
+                window = None
+                if url.path == '/api/calendar-events' and query.limit is None:
+                    window = query.date_window(MAX_OCCURRENCE_WINDOW_DAYS)
+            except ValueError as e:
+                self._send_response(400, {'error': str(e)})
+                return
+        if url.path in self.etag_tables:
+            # Versions are bumped after commit, so a validator taken before the
+            # query can only be older than the data, never newer
+            try:
+                self.etag = self.db_manager.get_etag(self.etag_tables[url.path])
+            except Exception as e:
+                logger.error(f"Error getting validator for {url.path}: {e}")
+                self._send_database_unavailable(e)
+                return
+            cached_etag = self._not_modified_etag()
+            if cached_etag:
+                self.etag = cached_etag
+                self._send_response(304)
+                return
+        if url.path == '/api/notes':
+            try:
+                # Without a limit the whole collection is streamed straight from the cursor
+                notes_data = self.db_manager.get_notes(
+                    limit=query.fetch_limit, after=query.cursor, category=query.get('category'),
+                    updated_from=query.get('from'), updated_to=query.get('to'), tag=query.get('tag'),
+                    stream=query.limit is None)
+                self._send_page(query, notes_data, lambda n: [n[6], n[0]], note_to_dict)
             except Exception as e:
                 logger.error(f"Error getting notes: {e}")
                 self._send_response(500)
-        elif self.path == '/api/tasks':
+        elif url.path == '/api/data':
+            try:
+                self._send_response(200, self.db_manager.get_all_data())
+            except Exception as e:
+                logger.error(f"Error reading data: {e}")
+                self._send_response(500, {'error': 'Failed to read data'})
+        elif url.path == '/api/sync':
+            params = parse_qs(url.query)
             try:
-                tasks = self.db_manager.get_tasks()
-                self._send_response(200, tasks)
+                since = int(params.get('since', ['0'])[-1])
+            except ValueError:
+                self._send_response(400, {'error': 'since must be an integer version'})
+                return
+            try:
+                version, changes = self.db_manager.get_changes(since)
+                delta = {'version': version}
+                for table, key, to_dict in (('notes', 'notes', note_to_dict), ('tasks', 'tasks', task_to_dict),
+                                            ('calendar_events', 'calendarEvents', calendar_event_to_dict)):
+                    delta[key] = {'upserted': [to_dict(row) for row in changes[table]['upserted']],
+                                  'deleted': changes[table]['deleted']}
+                self._send_response(200, delta)
+            except Exception as e:
+                logger.error(f"Error getting changes since {since}: {e}")
+                self._send_response(500)
+        elif url.path == '/api/metrics':
+            self._send_bytes(200, metrics.render_prometheus().encode(), PROMETHEUS_CONTENT_TYPE)
+        elif url.path == '/api/health':
+            self._send_health()
+        elif url.path == '/api/events':
+            self._start_event_stream()
+        elif url.path == '/api/analytics':
+            try:
+                window = analytics_window(parse_qs(url.query).get('range', [DEFAULT_ANALYTICS_RANGE])[-1])
+            except ValueError as e:
+                self._send_response(400, {'error': str(e)})
+                return
+            try:
+                analytics = self.db_manager.get_analytics(*window)
+                self._send_response(200, dict(analytics, range={'from': window[0], 'to': window[1]}))
+            except Exception as e:
+                logger.error(f"Error getting analytics: {e}")
+                self._send_response(500)
+        elif url.path == '/api/stats':
+            self._send_response(200, {'sanitizer': note_sanitizer.stats(), 'staticCache': static_cache.stats()})
+        elif url.path == '/api/notes/tags':
+            try:
+                self._send_response(200, self.db_manager.get_tag_counts())
+            except Exception as e:
+                logger.error(f"Error getting tag counts: {e}")
+                self._send_response(500)
+        elif url.path == '/api/notes/search':
+            params = parse_qs(url.query)
+            try:
+                limit = min(int(params.get('limit', ['20'])[-1]), MAX_PAGE_SIZE)
+            except ValueError:
+                self._send_response(400, {'error': 'limit must be an integer'})
+                return
+            try:
+                results = self.db_manager.search_notes(params.get('q', [''])[-1], limit=max(1, limit))
+                self._send_response(200, results)
+            except Exception as e:
+                logger.error(f"Error searching notes: {e}")
+                self._send_response(500)
+        elif url.path == '/api/tasks':
+            try:
+                tasks = self.db_manager.get_tasks(
+                    limit=query.fetch_limit, after=query.cursor[0] if query.cursor else None,
+                    category=query.get('category'), completed=query.get_bool('completed'), stream=query.limit is None)
+                self._send_page(query, tasks, lambda t: [t[0]], task_to_dict)
+            except ValueError as e:
+                self._send_response(400, {'error': str(e)})
             except Exception as e:
                 logger.error(f"Error getting tasks: {e}")
                 self._send_response(500)
-        elif self.path == '/api/calendar-events':
+        elif url.path == '/api/calendar-events' and window is not None:
             try:
-                events = self.db_manager.get_calendar_events()
-                self._send_response(200, events)
+                # A calendar view: repeating events are expanded into their occurrences
+                self._send_response(200, self.db_manager.get_calendar_occurrences(*window, category=query.get('category')))
+            except Exception as e:
+                logger.error(f"Error getting calendar occurrences: {e}")
+                self._send_response(500)
+        elif url.path == '/api/calendar-events':
+            try:
+                events = self.db_manager.get_calendar_events(
+                    limit=query.fetch_limit, after=query.cursor, category=query.get('category'),
+                    date_from=query.get('from'), date_to=query.get('to'), stream=query.limit is None)
+                self._send_page(query, events, lambda e: [e[2], e[0]], calendar_event_to_dict)
             except Exception as e:
                 logger.error(f"Error getting calendar events: {e}")
                 self._send_response(500)
+        elif NOTE_REVISIONS_PATH.match(url.path):
+            note_id, revision = NOTE_REVISIONS_PATH.match(url.path).groups()
+            try:
+                if revision is None:
+                    self._send_response(200, self.db_manager.get_note_revisions(note_id))
+                    return
+                note = self.db_manager.get_note_revision(note_id, int(revision))
+                if note is None:
+                    self._send_response(404, {'error': 'Revision not found'})
+                else:
+                    self._send_response(200, note)
+            except Exception as e:
+                logger.error(f"Error getting revisions of note {note_id}: {e}")
+                self._send_response(500)
         else:
             super().do_GET()
 
+    def _read_json_body(self):
+        """The parsed request body ({} if empty), or None after answering 400.
+
+        The body is always read, even for requests that are then rejected, so
+        the next request on a keep-alive connection starts where it should.
+        """
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        try:
+            return json.loads(body.decode('utf-8')) if body else {}
+        except ValueError:
+            self._send_response(400, {'error': 'Invalid JSON'})
+            return None
+
     def do_POST(self):
-        content_length = int(self.headers['Content-Length'])
-        post_data = self.rfile.read(content_length)
-        data = json.loads(post_data.decode('utf-8'))
+        data = self._read_json_body()
+        if data is None:
+            return
 
         if self.path == '/api/notes':
             try:
                 # Sanitize content before saving
-                data['content'] = bleach.clean(data.get('content', ''), tags=bleach.sanitizer.ALLOWED_TAGS + ['p', 'h1', 'h2', 'h3', 'strong', 'em', 'u', 's', 'ul', 'ol', 'li', 'blockquote', 'pre', 'a', 'br'], attributes={'a': ['href']})
+                data['content'] = note_sanitizer.clean(data.get('content', ''))
                 self.db_manager.add_note(data)
                 self._send_response(201, {'id': data['id']})
             except Exception as e:
@@ -78,6 +841,34 @@ class ApiRequestHandler(http.server.SimpleHTTPRequestHandler):
             except Exception as e:
                 logger.error(f"Error adding task: {e}")
                 self._send_response(500)
+        elif self.path == '/api/save':
+            if not isinstance(data, dict):
+                self._send_response(400, {'error': 'Invalid data format'})
+                return
+            try:
+                for note in data.get('notes') or []:
+                    if isinstance(note, dict):
+                        note['content'] = note_sanitizer.clean(note.get('content') or '')
+                self.db_manager.save_all_data(data)
+                self._send_response(200, {'success': True})
+            except Exception as e:
+                logger.error(f"Error saving data: {e}")
+                self._send_response(500, {'error': 'Failed to save data'})
+        elif self.path == '/api/batch':
+            operations = data.get('operations') if isinstance(data, dict) else data
+            if not isinstance(operations, list):
+                self._send_response(400, {'error': 'expected a list of operations'})
+                return
+            if len(operations) > MAX_BATCH_OPERATIONS:
+                self._send_response(413, {'error': f"at most {MAX_BATCH_OPERATIONS} operations per batch"})
+                return
+            try:
+                self._send_response(200, {'results': apply_batch(self.db_manager, operations)})
+            except BatchError as e:
+                self._send_response(400, {'error': str(e), 'index': e.index})
+            except Exception as e:
+                logger.error(f"Error applying batch: {e}")
+                self._send_response(500)
         elif self.path == '/api/calendar-events':
             try:
                 event_id = self.db_manager.add_calendar_event(data['title'], data['date'], data.get('time'), data.get('category'), data.get('recurring'))
@@ -85,30 +876,42 @@ class ApiRequestHandler(http.server.SimpleHTTPRequestHandler):
             except Exception as e:
                 logger.error(f"Error adding calendar event: {e}")
                 self._send_response(500)
+        elif self.path == '/api/flush':
+            try:
+                flushed = self.db_manager.flush_note_updates(durable=True)
+                self._send_response(200, {'flushed': flushed})
+            except Exception as e:
+                logger.error(f"Error flushing queued note updates: {e}")
+                self._send_response(500)
         else:
-            super().do_POST()
+            self._send_response(404, {'error': 'Not found'})
 
     def do_PUT(self):
+        data = self._read_json_body()
+        if data is None:
+            return
         if self.path.startswith('/api/notes/'):
             note_id = self.path.split('/')[-1]
-            content_length = int(self.headers['Content-Length'])
-            put_data = self.rfile.read(content_length)
-            data = json.loads(put_data.decode('utf-8'))
+            if not isinstance(data, dict):
+                self._send_response(400, {'error': 'Invalid data format'})
+                return
             data['id'] = note_id
             
             try:
-                # Sanitize content before updating
-                data['content'] = bleach.clean(data.get('content', ''), tags=bleach.sanitizer.ALLOWED_TAGS + ['p', 'h1', 'h2', 'h3', 'strong', 'em', 'u', 's', 'ul', 'ol', 'li', 'blockquote', 'pre', 'a', 'br'], attributes={'a': ['href']})
-                self.db_manager.update_note(data)
+                # Autosave bursts are coalesced; only the last version is sanitized and written
+                self.db_manager.queue_note_update(data, sanitize=note_sanitizer.clean)
                 self._send_response(200, {'status': 'success'})
+            except ValueError as e:
+                self._send_response(400, {'error': str(e)})
             except Exception as e:
                 logger.error(f"Error updating note {note_id}: {e}")
                 self._send_response(500)
         else:
-            self.send_response(404)
-            self.end_headers()
+            self._send_response(404, {'error': 'Not found'})
             
     def do_DELETE(self):
+        # Any body is ignored, but must be consumed to keep the connection usable
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
         if self.path.startswith('/api/notes/'):
             note_id = self.path.split('/')[-1]
             try:
@@ -118,23 +921,106 @@ class ApiRequestHandler(http.server.SimpleHTTPRequestHandler):
                 logger.error(f"Error deleting note {note_id}: {e}")
                 self._send_response(500)
         else:
-            self.send_response(404)
-            self.end_headers()
+            self._send_response(404, {'error': 'Not found'})
+
+class StartupTimer:
+    """Cold-start phase durations and milestones, in milliseconds since import"""
+
+    def __init__(self, started=IMPORT_STARTED):
+        self.started = started
+        self.phases = {}
+        self.milestones = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases[name] = round((time.perf_counter() - start) * 1000, 1)
+
+    def mark(self, name):
+        """Record a milestone once; returns False if it was already recorded"""
+        with self._lock:
+            if name in self.milestones:
+                return False
+            self.milestones[name] = round((time.perf_counter() - self.started) * 1000, 1)
+            return True
+
+    def to_dict(self):
+        with self._lock:
+            return {'phasesMs': dict(self.phases), 'milestonesMs': dict(self.milestones)}
+
+    def summary(self):
+        with self._lock:
+            parts = [f"{name} {ms:.0f} ms" for name, ms in self.phases.items()]
+            parts += [f"{name} at {ms:.0f} ms" for name, ms in self.milestones.items()]
+        return ', '.join(parts)
+
+
+def make_handler(database, directory, startup=None, event_broker=None):
+    """ApiRequestHandler bound to a DatabaseService and a static files directory.
+
+    Requests that need the database wait for it to finish opening; the
+    health endpoint answers immediately.
+    """
+    handler_class = type('NeoFocusRequestHandler', (ApiRequestHandler,), {
+        'database': database, 'startup': startup, 'event_broker': event_broker})
+    return functools.partial(handler_class, directory=directory)
 
 class NeoFocusApp:
-    def __init__(self):
+    def __init__(self, server_workers=None, db_path=DEFAULT_DB_PATH):
         self.window = None
         self.app_path = self._get_app_path()
         self.server = None
         self.server_thread = None
-        self.db_manager = DatabaseManager('data/neofocus.db')
+        self.server_workers = server_workers or get_server_workers()
+        self.startup = StartupTimer()
+        # The only DatabaseManager of the process, opened by start_database()
+        # alongside the server or on first use
+        self.database = DatabaseService(os.path.abspath(db_path), on_open=self._on_database_open)
+        self.event_broker = EventBroker(self.database)
+        # Backups, vacuum and statistics, in data/backups next to the database
+        self.maintenance = MaintenanceService(self.database)
         logger.info("NEO FOCUS App initialized successfully")
 
+    @property
+    def db_manager(self):
+        return self.database.get()
+
+    def _on_database_open(self, db_manager):
+        # Bring over data saved by the old whole-file JSON store, once
+        try:
+            json_store = os.path.join(os.path.dirname(db_manager.db_path), 'neofocus-data.json')
+            with self.startup.phase('json_import'):
+                migrate_json_store(db_manager, json_store, sanitize=note_sanitizer.clean)
+        except Exception as e:
+            logger.error(f"Error importing JSON data store: {e}")
+
+    def start_database(self):
+        """Open the database on a background thread; returns the thread"""
+        def open_database():
+            try:
+                with self.startup.phase('database'):
+                    self.database.get()
+            except Exception as e:
+                logger.error(f"Error opening database: {e}")
+                return
+            self.maintenance.start()
+            self._check_ready()
+        thread = threading.Thread(target=open_database, name='neofocus-db-open', daemon=True)
+        thread.start()
+        return thread
+
+    def _check_ready(self):
+        """Log the startup timings once both the server and the database are up"""
+        if self.server is not None and self.database.is_open and self.startup.mark('ready'):
+            logger.info(f"Startup complete: {self.startup.summary()}")
+
     def _get_app_path(self):
-        if getattr(sys, 'frozen', False):
-            base_path = sys._MEIPASS
-        else:
-            base_path = os.path.dirname(os.path.abspath(__file__))
+        base_path = get_base_path()
         
         out_path = os.path.join(base_path, 'out')
         if os.path.exists(out_path):
@@ -146,35 +1032,99 @@ class NeoFocusApp:
             
         return None
 
-    def start_local_server(self):
+    def start_local_server(self, host=DEFAULT_HOST, port=None):
+        """Start serving in a background thread and return the server's URL.
+
+        Without a port the first free one from DEFAULT_PORT is used; an
+        explicit port (0 for any free one) is bound as given.
+        """
         if not self.app_path:
             return None
         
-        port = 8000
-        while port < 8010:
+        ports = range(DEFAULT_PORT, DEFAULT_PORT + GUI_PORT_ATTEMPTS) if port is None else [port]
+        for port in ports:
             try:
-                os.chdir(self.app_path)
+                with self.startup.phase('server'):
+                    handler = make_handler(self.database, self.app_path, self.startup, self.event_broker)
+                    self.server = ThreadPoolHTTPServer((host, port), handler, max_workers=self.server_workers)
+                    
+                    self.server_thread = threading.Thread(target=self.server.serve_forever)
+                    self.server_thread.daemon = True
+                    self.server_thread.start()
                 
-                handler = ApiRequestHandler
-                self.server = socketserver.TCPServer(("127.0.0.1", port), handler)
-                self.server.allow_reuse_address = True
-                
-                self.server_thread = threading.Thread(target=self.server.serve_forever)
-                self.server_thread.daemon = True
-                self.server_thread.start()
-                
-                return f"http://127.0.0.1:{port}"
-            except OSError:
-                port += 1
+                port = self.server.server_address[1]
+                logger.info(f"Serving on http://{host}:{port} with {self.server_workers} worker threads")
+                self._check_ready()
+                return f"http://{host}:{port}"
+            except OSError as e:
+                logger.warning(f"Could not listen on {host}:{port}: {e}")
                 continue
         
         return None
 
+    def stop(self):
+        """Stop the server, close the database and write the metrics log if configured"""
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        self.event_broker.close()
+        self.maintenance.close()
+        if self.database.is_open:
+            try:
+                flushed = self.database.get().flush_note_updates(durable=True)
+                if flushed:
+                    logger.info(f"Wrote {flushed} queued note updates")
+            except Exception as e:
+                logger.error(f"Error flushing queued note updates: {e}")
+        self.database.close()
+        metrics_log = os.environ.get(METRICS_LOG_ENV)
+        if metrics_log:
+            try:
+                metrics.dump_json(metrics_log)
+                logger.info(f"Wrote metrics to {metrics_log}")
+            except OSError as e:
+                logger.error(f"Error writing metrics to {metrics_log}: {e}")
+
+    def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT, stop_event=None):
+        """Run only the API and static server, without a window, until stopped.
+
+        SIGINT and SIGTERM (when called from the main thread) or setting
+        stop_event shut the server down cleanly. Returns False if the server
+        could not start.
+        """
+        if not self.app_path:
+            logger.error("Application files not found. Please ensure the 'out' directory exists.")
+            return False
+        stop_event = stop_event or threading.Event()
+        if threading.current_thread() is threading.main_thread():
+            def request_stop(signum, frame):
+                logger.info(f"Received {signal.Signals(signum).name}, shutting down")
+                stop_event.set()
+            for name in ('SIGINT', 'SIGTERM', 'SIGBREAK'):
+                if hasattr(signal, name):
+                    signal.signal(getattr(signal, name), request_stop)
+
+        self.start_database()
+        if not self.start_local_server(host, port):
+            logger.error(f"Failed to start the server on {host}:{port}")
+            self.stop()
+            return False
+        try:
+            # Wake up periodically so signal handlers run promptly on every platform
+            while not stop_event.wait(0.5):
+                pass
+        finally:
+            self.stop()
+        return True
+
     def create_window(self):
         if not self.app_path:
             self._show_error("Application files not found. Please ensure the 'out' directory exists.")
             return
         
+        # The database opens while the server binds and the window is created
+        self.start_database()
         server_url = self.start_local_server()
         if not server_url:
             self._show_error("Failed to start local server for serving application files.")
@@ -198,27 +1148,43 @@ class NeoFocusApp:
             'url': splash_url,
         }
         
+        import webview
         try:
-            self.window = webview.create_window(**window_config)
+            with self.startup.phase('window'):
+                self.window = webview.create_window(**window_config)
+            
+            def page_loaded():
+                # The splash screen fires this too; only the main page counts
+                if 'window_switched' in self.startup.milestones and self.startup.mark('main_page_loaded'):
+                    logger.info(f"Main page loaded: {self.startup.summary()}")
+            
+            self.window.events.loaded += page_loaded
             
+            # Run by pywebview on its own thread once the GUI loop is up
             def load_main_app():
-                import time
-                time.sleep(2)
-                if self.window:
+                if not self.database.ready.wait(STARTUP_TIMEOUT):
+                    # Slow, not failed: the first start imports the old JSON
+                    # store, which can take minutes. Say so and keep waiting.
+                    if self.database.importing:
+                        message = "Importing the data saved by an earlier version. This only happens once."
+                    else:
+                        message = "The database is taking longer than usual to open."
+                    self.window.load_html(self._waiting_html(message))
+                    self.database.ready.wait()
+                if self.database.error is not None:
+                    self.window.load_html(self._error_html(f"Failed to open the database: {self.database.error}"))
+                else:
+                    self.startup.mark('window_switched')
                     self.window.load_url(server_url)
             
-            threading.Thread(target=load_main_app, daemon=True).start()
-            
-            webview.start(debug=True, private_mode=False)
+            webview.start(load_main_app, debug=True, private_mode=False)
         except Exception as e:
             self._show_error(f"Failed to create window: {str(e)}")
         finally:
-            if self.server:
-                self.server.shutdown()
-                self.server.server_close()
+            self.stop()
 
-    def _show_error(self, message):
-        error_html = f'''
+    def _error_html(self, message):
+        return f'''
         <html>
         <head>
             <title>NEO FOCUS - Error</title>
@@ -275,10 +1241,45 @@ class NeoFocusApp:
         </body>
         </html>
         '''
-        
+
+    def _waiting_html(self, message):
+        return f'''
+        <html>
+        <head>
+            <title>NEO FOCUS</title>
+            <style>
+                body {{
+                    font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
+                    background: linear-gradient(135deg, #1E1B4B 0%, #312E81 100%);
+                    color: white;
+                    display: flex;
+                    justify-content: center;
+                    align-items: center;
+                    height: 100vh;
+                    margin: 0;
+                    text-align: center;
+                }}
+                .app-name {{
+                    color: #a78bfa;
+                    font-weight: bold;
+                    font-size: 2rem;
+                }}
+            </style>
+        </head>
+        <body>
+            <div>
+                <p class="app-name">NEO FOCUS</p>
+                <p>{message}</p>
+            </div>
+        </body>
+        </html>
+        '''
+
+    def _show_error(self, message):
+        import webview
         self.window = webview.create_window(
             'NEO FOCUS - Error',
-            html=error_html,
+            html=self._error_html(message),
             width=600,
             height=400,
             resizable=False,
@@ -286,9 +1287,22 @@ class NeoFocusApp:
         )
         webview.start()
 
-def main():
-    app = NeoFocusApp()
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="NEO FOCUS desktop app, or its backend alone with 'serve'/--headless")
+    parser.add_argument('command', nargs='?', choices=('gui', 'serve'), default='gui',
+                        help="'serve' runs only the API and static server, without pywebview")
+    parser.add_argument('--headless', action='store_true', help="same as the 'serve' command")
+    parser.add_argument('--host', default=DEFAULT_HOST, help='address to listen on in headless mode')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='port to listen on in headless mode (0 for any)')
+    parser.add_argument('--db', default=DEFAULT_DB_PATH, help='path to the SQLite database')
+    parser.add_argument('--workers', type=int, help='HTTP worker threads (default: NEOFOCUS_SERVER_WORKERS or 8)')
+    args = parser.parse_args(argv)
+
+    app = NeoFocusApp(server_workers=args.workers, db_path=args.db)
+    if args.headless or args.command == 'serve':
+        return 0 if app.serve(args.host, args.port) else 1
     app.create_window()
+    return 0
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
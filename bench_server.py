@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Benchmark the local API/static server under parallel load.
+
+Runs the same mixed workload (static chunks from out/ plus /api/notes) against
+the single-threaded socketserver.TCPServer and the thread-pool server used by
+NeoFocusApp, and reports requests/sec and latency percentiles for each.
+
+    python bench_server.py --requests 2000 --concurrency 16 --workers 8
+"""
+
+import argparse
+import functools
+import os
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def percentile(values, pct):
+    """Return the pct-th percentile of an already sorted list"""
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+def load_app_module():
+    """Import app.py from the repository root"""
+    sys.path.insert(0, REPO_ROOT)
+    import app
+    return app
+
+
+def seed_notes(db_manager, count):
+    """Insert synthetic notes so /api/notes does real work"""
+    body = '<p>' + 'Lorem ipsum dolor sit amet. ' * 40 + '</p>'
+    for i in range(count):
+        timestamp = f"2025-01-01T00:00:{i % 60:02d}.000Z"
+        db_manager.add_note({
+            'id': f"bench-{i}", 'title': f"Note {i}", 'content': body, 'tags': ['bench'],
+            'category': 'general', 'createdAt': timestamp, 'updatedAt': timestamp,
+        })
+
+
+def collect_static_paths(static_root, limit=20):
+    """Pick the JS/CSS chunks the webview would fetch on first load"""
+    paths = []
+    chunk_root = os.path.join(static_root, '_next', 'static')
+    for dirpath, _, filenames in os.walk(chunk_root):
+        for name in filenames:
+            if name.endswith(('.js', '.css')):
+                rel = os.path.relpath(os.path.join(dirpath, name), static_root)
+                paths.append('/' + rel.replace(os.sep, '/'))
+    paths.sort()
+    return paths[:limit] or ['/index.html']
+
+
+def run_load(base_url, paths, total_requests, concurrency):
+    """Fire total_requests GETs across paths and return (elapsed, latencies, errors)"""
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def fetch(i):
+        nonlocal errors
+        url = base_url + paths[i % len(paths)]
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(url, timeout=30) as response:
+                response.read()
+        except Exception:
+            with lock:
+                errors += 1
+            return
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(fetch, range(total_requests)))
+    return time.perf_counter() - start, sorted(latencies), errors
+
+
+def bench_server(name, server_factory, handler, paths, args):
+    server = server_factory(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        run_load(base_url, paths, min(50, args.requests), args.concurrency)  # warm-up
+        elapsed, latencies, errors = run_load(base_url, paths, args.requests, args.concurrency)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    rps = len(latencies) / elapsed if elapsed else 0.0
+    print(f"{name:<12} {rps:>10.1f} req/s   "
+          f"p50 {percentile(latencies, 50) * 1000:>8.2f} ms   "
+          f"p99 {percentile(latencies, 99) * 1000:>8.2f} ms   "
+          f"errors {errors}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=1000, help='requests per server mode')
+    parser.add_argument('--concurrency', type=int, default=16, help='parallel client connections')
+    parser.add_argument('--workers', type=int, default=8, help='thread pool size for the pooled server')
+    parser.add_argument('--notes', type=int, default=500, help='synthetic notes to seed')
+    parser.add_argument('--static-dir', default=os.path.join(REPO_ROOT, 'out'), help='Next.js export to serve')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        app = load_app_module()
+        database = app.DatabaseService(os.path.join(work_dir, 'neofocus.db'))
+        seed_notes(database.get(), args.notes)
+
+        static_paths = collect_static_paths(args.static_dir)
+        # One API call for every four static fetches, roughly a cold page load
+        paths = []
+        for i, path in enumerate(static_paths):
+            paths.append(path)
+            if i % 4 == 3:
+                paths.append('/api/notes')
+        if '/api/notes' not in paths:
+            paths.append('/api/notes')
+
+        class QuietHandler(app.ApiRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+        QuietHandler.database = database
+        handler = functools.partial(QuietHandler, directory=args.static_dir)
+        print(f"{args.requests} requests, concurrency {args.concurrency}, "
+              f"{len(static_paths)} static paths + /api/notes ({args.notes} notes)")
+        bench_server('single', socketserver.TCPServer, handler, paths, args)
+        pooled = functools.partial(app.ThreadPoolHTTPServer, max_workers=args.workers)
+        bench_server(f"pool[{args.workers}]", pooled, handler, paths, args)
+        database.close()
+
+
+if __name__ == '__main__':
+    main()
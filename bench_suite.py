@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Reproducible benchmarks for the API server and DatabaseManager.
+
+For each database size, seeds a scratch database with synthetic notes, tasks
+and calendar events (fixed random seed), then measures:
+
+  - bulk insert throughput while seeding, and single-row insert latency
+  - latency and throughput of each API route, served headless by
+    ThreadPoolHTTPServer + ApiRequestHandler over keep-alive connections
+  - note sanitization cost, uncached and cached
+
+Results are written as JSON (--output) so runs from different commits can be
+compared with --compare; a human-readable summary goes to stderr.
+
+    python bench_suite.py --sizes 1000,10000,100000 --output bench.json
+    python bench_suite.py --sizes 1000,10000,100000 --compare bench.json
+"""
+
+import argparse
+import functools
+import http.client
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bench_server import REPO_ROOT, load_app_module, percentile
+
+WORDS = ('focus', 'plan', 'review', 'draft', 'meeting', 'report', 'idea', 'habit', 'goal', 'sprint',
+         'budget', 'design', 'research', 'launch', 'travel', 'reading', 'journal', 'workout', 'quarterly', 'notes')
+TAGS = ('work', 'personal', 'ideas', 'urgent', 'reading', 'health', 'finance', 'travel')
+CATEGORIES = ('general', 'work', 'personal', 'study')
+SEED_BATCH_ROWS = 10000
+
+
+def log(message):
+    print(message, file=sys.stderr, flush=True)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def synthetic_html(rng, paragraphs):
+    return ''.join(f"<p>{' '.join(rng.choice(WORDS) for _ in range(40))} <strong>{rng.choice(WORDS)}</strong></p>"
+                   for _ in range(paragraphs))
+
+
+def timestamp(index):
+    """Distinct, increasing ISO timestamps, one second apart"""
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(1735689600 + index)) + '.000Z'
+
+
+def seed_database(db_manager, size, rng):
+    """Insert size notes, tasks and events in bulk and return insert-throughput results"""
+    results = []
+    generators = {
+        'notes': (db_manager.bulk_add_notes, lambda i: {
+            'id': f"note-{i}", 'title': f"{rng.choice(WORDS).title()} {rng.choice(WORDS)} {i}",
+            'content': synthetic_html(rng, rng.randint(1, 4)), 'tags': rng.sample(TAGS, rng.randint(0, 3)),
+            'category': rng.choice(CATEGORIES), 'createdAt': timestamp(i), 'updatedAt': timestamp(i),
+        }),
+        'tasks': (db_manager.bulk_add_tasks, lambda i: {
+            'title': f"{rng.choice(WORDS)} task {i}", 'completed': rng.random() < 0.3, 'category': rng.choice(CATEGORIES),
+        }),
+        'calendar_events': (db_manager.bulk_add_calendar_events, lambda i: {
+            'title': f"{rng.choice(WORDS)} event {i}", 'date': timestamp(i * 300)[:10], 'time': '09:00',
+            'category': rng.choice(CATEGORIES),
+            # One event in twenty repeats, so calendar windows expand a few series
+            'recurring': ('daily', 'weekly', 'monthly')[i // 20 % 3] if i % 20 == 0 else None,
+        }),
+    }
+    for table, (bulk_add, make_row) in generators.items():
+        elapsed = 0.0
+        for start in range(0, size, SEED_BATCH_ROWS):
+            rows = [make_row(i) for i in range(start, min(size, start + SEED_BATCH_ROWS))]
+            began = time.perf_counter()
+            bulk_add(rows)
+            elapsed += time.perf_counter() - began
+        results.append(result('bulk_insert', table, size, size / elapsed if elapsed else 0.0, 'rows/s', 'higher',
+                              seconds=round(elapsed, 4)))
+        log(f"  seeded {size} {table} at {size / elapsed:,.0f} rows/s")
+    return results
+
+
+def bench_single_inserts(db_manager, size, rng, count):
+    latencies = []
+    for i in range(count):
+        note = {'id': f"single-{i}", 'title': 'Single insert', 'content': synthetic_html(rng, 1), 'tags': ['work'],
+                'category': 'general', 'createdAt': timestamp(size + i), 'updatedAt': timestamp(size + i)}
+        began = time.perf_counter()
+        db_manager.add_note(note)
+        latencies.append(time.perf_counter() - began)
+    latencies.sort()
+    return result('single_insert', 'add_note', size, percentile(latencies, 50) * 1000, 'ms', 'lower',
+                  p99_ms=round(percentile(latencies, 99) * 1000, 4))
+
+
+def bench_sanitizer(sanitizer_class, rng, count):
+    """Cost of sanitizing note bodies of a few sizes, first with unique bodies then repeated ones"""
+    results = []
+    for paragraphs in (1, 10, 100):
+        bodies = [synthetic_html(rng, paragraphs) + '<script>alert(1)</script>' for _ in range(count)]
+        sanitizer = sanitizer_class()
+        for mode in ('uncached', 'cached'):
+            began = time.perf_counter()
+            for body in bodies:
+                sanitizer.clean(body)
+            per_note = (time.perf_counter() - began) / count
+            results.append(result('sanitize', f"{mode} {paragraphs} paragraphs", None, per_note * 1000, 'ms', 'lower'))
+    return results
+
+
+def route_paths(size, db_manager, full_list_max):
+    version = db_manager.get_version()
+    paths = [
+        '/api/notes?limit=100',
+        '/api/notes?limit=100&tag=work',
+        '/api/notes?limit=100&category=work',
+        '/api/notes/search?q=quarterly%20plan',
+        '/api/notes/tags',
+        '/api/tasks?limit=100&completed=false',
+        f"/api/calendar-events?from={timestamp(0)[:10]}&to={timestamp(30 * 86400)[:10]}&limit=500",
+        f"/api/calendar-events?from={timestamp(0)[:10]}&to={timestamp(30 * 86400)[:10]}",
+        f"/api/sync?since={max(0, version - 100)}",
+    ]
+    if size <= full_list_max:
+        paths += ['/api/notes', '/api/tasks', '/api/data']
+    return paths
+
+
+def bench_route(port, path, requests, concurrency, accept_encoding):
+    """Issue requests GETs for path over concurrency keep-alive connections"""
+    latencies = []
+    errors = 0
+    body_bytes = 0
+    lock = threading.Lock()
+    per_worker = [requests // concurrency + (1 if i < requests % concurrency else 0) for i in range(concurrency)]
+
+    def worker(count):
+        nonlocal errors, body_bytes
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        local = []
+        try:
+            for _ in range(count):
+                began = time.perf_counter()
+                try:
+                    connection.request('GET', path, headers={'Accept-Encoding': accept_encoding})
+                    response = connection.getresponse()
+                    body = response.read()
+                    ok = response.status == 200
+                except (OSError, http.client.HTTPException):
+                    connection.close()
+                    ok, body = False, b''
+                elapsed = time.perf_counter() - began
+                with lock:
+                    if ok:
+                        local.append(elapsed)
+                        body_bytes += len(body)
+                    else:
+                        errors += 1
+        finally:
+            connection.close()
+            with lock:
+                latencies.extend(local)
+
+    began = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, per_worker))
+    elapsed = time.perf_counter() - began
+    latencies.sort()
+    return latencies, errors, body_bytes, elapsed
+
+
+def bench_routes(app, database, size, args):
+    class BenchHandler(app.ApiRequestHandler):
+        def log_message(self, format, *log_args):
+            pass
+
+    BenchHandler.database = database
+    db_manager = database.get()
+    handler = functools.partial(BenchHandler, directory=args.static_dir)
+    server = app.ThreadPoolHTTPServer(('127.0.0.1', 0), handler, max_workers=args.workers)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+    results = []
+    try:
+        for path in route_paths(size, db_manager, args.full_list_max):
+            bench_route(port, path, min(10, args.requests), 1, args.accept_encoding)  # warm-up
+            latencies, errors, body_bytes, elapsed = bench_route(port, path, args.requests, args.concurrency,
+                                                                 args.accept_encoding)
+            served = len(latencies)
+            results.append(result(
+                'route', f"GET {path.split('?')[0] if path.startswith('/api/sync') else path}", size,
+                percentile(latencies, 50) * 1000, 'ms', 'lower',
+                p90_ms=round(percentile(latencies, 90) * 1000, 4), p99_ms=round(percentile(latencies, 99) * 1000, 4),
+                mean_ms=round(sum(latencies) / served * 1000, 4) if served else 0.0,
+                rps=round(served / elapsed, 2) if elapsed else 0.0, errors=errors,
+                bytes_per_response=body_bytes // served if served else 0,
+            ))
+            log(f"  {path:<60} p50 {results[-1]['value']:>9.3f} ms  p99 {results[-1]['p99_ms']:>9.3f} ms  "
+                f"{results[-1]['rps']:>9.1f} req/s  errors {errors}")
+    finally:
+        server.shutdown()
+        server.server_close()
+    return results
+
+
+def result(group, name, size, value, unit, better, **extra):
+    """One measurement; value is the headline number compared across runs"""
+    return dict({'group': group, 'name': name, 'size': size, 'value': round(value, 4), 'unit': unit, 'better': better},
+                **extra)
+
+
+def compare(baseline, current, threshold):
+    """Print changes against a baseline run and return the regressions beyond threshold"""
+    previous = {(r['group'], r['name'], r['size']): r for r in baseline['results']}
+    regressions = []
+    log(f"\nCompared with {baseline['meta'].get('commit') or 'baseline'}:")
+    for entry in current['results']:
+        before = previous.get((entry['group'], entry['name'], entry['size']))
+        if not before or not before['value'] or not entry['value']:
+            continue
+        ratio = entry['value'] / before['value']
+        # Express every change so that > 1 means worse
+        worse = ratio if entry['better'] == 'lower' else 1 / ratio
+        marker = 'REGRESSION' if worse > threshold else ''
+        log(f"  {entry['group']:<13} {entry['name']:<45} {entry['size'] or '-':>8}  "
+            f"{before['value']:>11.3f} -> {entry['value']:>11.3f} {entry['unit']:<6} {marker}")
+        if worse > threshold:
+            regressions.append(entry)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1000,10000,100000',
+                        help='comma-separated row counts per table, e.g. 1000,10000,100000,1000000')
+    parser.add_argument('--requests', type=int, default=200, help='requests per route and size')
+    parser.add_argument('--concurrency', type=int, default=8, help='parallel keep-alive client connections')
+    parser.add_argument('--workers', type=int, default=8, help='server thread pool size')
+    parser.add_argument('--accept-encoding', default='gzip, br', help='Accept-Encoding sent by the client')
+    parser.add_argument('--full-list-max', type=int, default=100000,
+                        help='largest size at which unpaginated list routes are benchmarked')
+    parser.add_argument('--single-inserts', type=int, default=200, help='add_note calls timed one by one')
+    parser.add_argument('--sanitize-notes', type=int, default=50, help='note bodies sanitized per body size')
+    parser.add_argument('--seed', type=int, default=1234, help='random seed for the synthetic data')
+    parser.add_argument('--static-dir', default=os.path.join(REPO_ROOT, 'out'), help='Next.js export to serve')
+    parser.add_argument('--output', help='write JSON results here instead of stdout')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='with --compare, exit 1 if any result is worse by more than this factor')
+    args = parser.parse_args(argv)
+    sizes = [int(size) for size in args.sizes.split(',') if size.strip()]
+
+    report = {
+        'meta': {
+            'commit': git_commit(), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'python': platform.python_version(), 'sqlite': sqlite3.sqlite_version, 'platform': platform.platform(),
+            'cpus': os.cpu_count(), 'args': vars(args),
+        },
+        'results': [],
+    }
+    with tempfile.TemporaryDirectory() as work_dir:
+        app = load_app_module()
+        from database_manager import DatabaseService
+        from sanitizer import NoteSanitizer
+
+        log("Sanitizer")
+        report['results'] += bench_sanitizer(NoteSanitizer, random.Random(args.seed), args.sanitize_notes)
+        for size in sizes:
+            log(f"Size {size}")
+            rng = random.Random(args.seed)
+            database = DatabaseService(os.path.join(work_dir, f"bench-{size}.db"))
+            try:
+                report['results'] += seed_database(database.get(), size, rng)
+                report['results'] += bench_routes(app, database, size, args)
+                report['results'].append(bench_single_inserts(database.get(), size, rng, args.single_inserts))
+            finally:
+                database.close()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+        log(f"Wrote {len(report['results'])} results to {args.output}")
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if compare(baseline, report, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
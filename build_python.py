@@ -69,6 +69,16 @@ def build_nextjs():
     print("✅ Next.js build completed")
     return True
 
+def precompress_static_files():
+    """Write .br/.gz siblings for the exported assets so the app can serve them as is"""
+    print("🗜️  Precompressing static files in 'out'...")
+    from static_files import brotli, precompress_directory
+    if brotli is None:
+        print("⚠️ brotli is not installed; writing gzip files only")
+    written = precompress_directory('out')
+    print(f"✅ Wrote {written} precompressed files")
+    return True
+
 def install_python_deps():
     """Install Python dependencies"""
     print("📦 Installing Python dependencies...")
@@ -95,6 +105,14 @@ a = Analysis(
         ('out', 'out'),
         ('neo-focus.ico', '.'),
         ('database_manager.py', '.'),
+        ('sanitizer.py', '.'),
+        ('json_importer.py', '.'),
+        ('static_files.py', '.'),
+        ('serialization.py', '.'),
+        ('metrics.py', '.'),
+        ('event_stream.py', '.'),
+        ('revisions.py', '.'),
+        ('maintenance.py', '.'),
     ],
     hiddenimports=[
         'webview',
@@ -103,6 +121,7 @@ a = Analysis(
         'webview.platforms.winforms.forms',
         'webview.platforms.winforms.controls',
         'sqlite3',
+        'bleach',
         'threading',
         'pathlib',
     ],
@@ -240,6 +259,9 @@ def main():
     else:
         if not install_python_deps():
             return False
+
+    # Step 2b: Precompress the export (after pip so brotli is available)
+    precompress_static_files()
     
     # Step 3: Create PyInstaller spec
     create_pyinstaller_spec()
@@ -1,119 +1,1726 @@
 
+import argparse
+import functools
+import itertools
+import html
+import json
+import logging
+import os
+import re
 import sqlite3
-from datetime import datetime
+import threading
+import time
+from contextlib import contextmanager
+from collections import OrderedDict
+from datetime import date, datetime, timedelta, timezone
+from html.parser import HTMLParser
+
+from metrics import instrument_methods
+from revisions import SNAPSHOT_INTERVAL, apply_delta, decode_snapshot, encode_delta, encode_snapshot, revisions_to_keep
+from serialization import RowMapper
+
+logger = logging.getLogger(__name__)
+
+# Page cache per connection in KiB (negative values are KiB for PRAGMA cache_size)
+CACHE_SIZE_KB = 8192
+# How long a connection waits on a locked database before raising
+BUSY_TIMEOUT_MS = 5000
+
+# Bumped whenever create_tables gains a data migration (stored in PRAGMA user_version)
+SCHEMA_VERSION = 4
+
+# Tables whose rows are tracked in the changes log for delta sync
+SYNC_TABLES = ('notes', 'tasks', 'calendar_events')
+# Most ids bound in one IN (...) query, under SQLite's default variable limit
+MAX_QUERY_IDS = 500
+# Rows pulled per fetchmany call by the iter_* methods
+FETCH_BATCH_ROWS = 256
+
+# Largest value SQLite can bind as an integer
+MAX_SQLITE_INTEGER = 2 ** 63 - 1
+
+# A note's history is compacted each time this many revisions have been added to it
+REVISION_COMPACT_EVERY = 100
+
+# How long queued note updates wait for more edits before they are written together
+NOTE_WRITE_DELAY_SECONDS = 0.5
+
+# Values of calendar_events.recurring that repeat an event (matched case-insensitively)
+RECURRENCE_RULES = ('daily', 'weekly', 'monthly')
+# (event, window) expansions kept in memory by get_calendar_occurrences
+RECURRENCE_CACHE_ENTRIES = 4096
+
+# Collections of the frontend's data model (DatabaseData in types/index.ts) stored
+# as JSON documents, in the order the frontend keeps them. Notes are not listed:
+# they live in the notes table. The values are table names.
+COLLECTION_TABLES = {
+    'events': 'store_events',
+    'tasks': 'store_tasks',
+    'habits': 'store_habits',
+    'goals': 'store_goals',
+    'journals': 'store_journals',
+    'reminders': 'store_reminders',
+    'achievements': 'store_achievements',
+    'focusSessions': 'store_focus_sessions',
+}
+
+DEFAULT_SETTINGS = {
+    'name': 'User',
+    'theme': 'dark',
+    'notifications': True,
+    'autoSave': True,
+    'focusDuration': 25,
+    'breakDuration': 5,
+    'longBreakDuration': 15,
+    'sessionsBeforeLongBreak': 4,
+}
+
+# API shape of each table's rows, in the column order the get_* methods return
+note_to_dict = RowMapper(('id', 'title', 'content', 'tags', 'category', 'createdAt', 'updatedAt'), json_columns=('tags',))
+task_to_dict = RowMapper(('id', 'title', 'completed', 'category', 'startTime', 'endTime'), bool_columns=('completed',))
+calendar_event_to_dict = RowMapper(('id', 'title', 'date', 'time', 'category', 'recurring'))
+ROW_MAPPERS = {'notes': note_to_dict, 'tasks': task_to_dict, 'calendar_events': calendar_event_to_dict}
+
+TASKS_SELECT = f"SELECT {task_to_dict.select_list} FROM tasks"
+CALENDAR_EVENTS_SELECT = f"SELECT {calendar_event_to_dict.select_list} FROM calendar_events"
+NOTES_SELECT = '''
+    SELECT id, title, content,
+           (SELECT json_group_array(tag) FROM note_tags WHERE note_id = notes.id) AS tags,
+           category, createdAt, updatedAt
+    FROM notes
+'''
+
+# Control characters used to mark snippet matches before HTML-escaping them
+SNIPPET_OPEN, SNIPPET_CLOSE = '\x02', '\x03'
+
+class _TextExtractor(HTMLParser):
+    BLOCK_TAGS = {'p', 'div', 'br', 'li', 'ul', 'ol', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'blockquote', 'pre', 'tr', 'td'}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.BLOCK_TAGS:
+            self.parts.append(' ')
+
+    def handle_endtag(self, tag):
+        if tag in self.BLOCK_TAGS:
+            self.parts.append(' ')
+
+    def handle_data(self, data):
+        self.parts.append(data)
+
+def strip_html(content):
+    """Plain text of a note body for the search index"""
+    if not content:
+        return ''
+    extractor = _TextExtractor()
+    extractor.feed(content)
+    extractor.close()
+    return ' '.join(''.join(extractor.parts).split())
+
+def encode_document(item):
+    return json.dumps(item, separators=(',', ':'), ensure_ascii=False)
+
+def legacy_tags(value):
+    """Tags of the first desktop schema: a JSON array, or comma-separated text"""
+    if not value:
+        return []
+    try:
+        tags = json.loads(value)
+    except ValueError:
+        tags = value.split(',')
+    return normalize_tags(tags if isinstance(tags, list) else [tags])
+
+def legacy_timestamp(value):
+    """A CURRENT_TIMESTAMP value ('YYYY-MM-DD HH:MM:SS', UTC) in the frontend's ISO format"""
+    if not value:
+        return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+    value = str(value).replace(' ', 'T')
+    return value if value.endswith('Z') else value[:19] + '.000Z'
+
+def normalize_tags(tags):
+    """Trimmed, non-empty tags with duplicates removed, in their original order"""
+    seen = []
+    for tag in tags or []:
+        tag = str(tag).strip()
+        if tag and tag not in seen:
+            seen.append(tag)
+    return seen
+
+def build_match_query(text):
+    """Turn free text into an FTS5 query: every word must match, the last one as a prefix"""
+    terms = re.findall(r'\w+', text)
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+def parse_recurrence(recurring):
+    """The rule in a free-text recurring value, or None if the event does not repeat"""
+    rule = (recurring or '').strip().lower()
+    return rule if rule in RECURRENCE_RULES else None
+
+def expand_recurrence(start, rule, window_start, window_end):
+    """Dates a rule starting on start falls on within [window_start, window_end].
+
+    Monthly events keep their day of the month and skip months without it.
+    """
+    first = max(start, window_start)
+    if rule == 'monthly':
+        occurrences = []
+        year, month = first.year, first.month
+        while (year, month) <= (window_end.year, window_end.month):
+            try:
+                day = date(year, month, start.day)
+            except ValueError:
+                day = None
+            if day is not None and first <= day <= window_end:
+                occurrences.append(day)
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        return occurrences
+    step = 1 if rule == 'daily' else 7
+    # Round up to the first day on the rule's cycle
+    day = start + timedelta(days=-(-(first - start).days // step) * step)
+    occurrences = []
+    while day <= window_end:
+        occurrences.append(day)
+        day += timedelta(days=step)
+    return occurrences
+
+def document_day(*values):
+    """The YYYY-MM-DD prefix of the first value that is an ISO date or timestamp"""
+    for value in values:
+        if isinstance(value, str) and re.match(r'\d{4}-\d{2}-\d{2}', value):
+            return value[:10]
+    return None
+
+def task_rollup(task):
+    """((day, category, priority), (total, completed)) a frontend task adds to analytics_task_days"""
+    day = document_day(task.get('dueDate'), task.get('createdAt'))
+    if day is None:
+        return None
+    return (day, str(task.get('category') or ''), str(task.get('priority') or '')), (1, 1 if task.get('completed') else 0)
+
+def schedule_task_rollup(task):
+    """The same for a row of the tasks table, which has no priority"""
+    day = document_day(task.get('startTime'))
+    if day is None:
+        return None
+    return (day, str(task.get('category') or ''), ''), (1, 1 if task.get('completed') else 0)
+
+def focus_rollup(session):
+    """((day,), (sessions, completed, minutes)) a focus session adds to analytics_focus_days"""
+    day = document_day(session.get('startTime'), session.get('createdAt'))
+    if day is None:
+        return None
+    duration = session.get('duration')
+    minutes = duration if isinstance(duration, (int, float)) and not isinstance(duration, bool) else 0
+    return (day,), (1, 1 if session.get('status') == 'completed' else 0, minutes)
+
+# Table -> (rollup table, key columns, summed columns, function giving a document's contribution,
+# SQL expression giving a row's document as JSON text)
+ROLLUPS = {
+    'store_tasks': ('analytics_task_days', ('day', 'category', 'priority'), ('total', 'completed'), task_rollup, 'data'),
+    'store_focus_sessions': ('analytics_focus_days', ('day',), ('sessions', 'completed', 'minutes'), focus_rollup, 'data'),
+    # Tasks added through /api/tasks and /api/batch count alongside the frontend's
+    'tasks': ('analytics_task_days', ('day', 'category', 'priority'), ('total', 'completed'), schedule_task_rollup,
+              "json_object('completed', completed, 'category', category, 'startTime', startTime)"),
+}
+
+def flushes_note_updates(method):
+    """Write queued note updates before a method that reads or writes notes runs"""
+    @functools.wraps(method)
+    def flushing(self, *args, **kwargs):
+        if self._queued_notes or self._flushing:
+            self.flush_note_updates()
+        return method(self, *args, **kwargs)
+    return flushing
 
 class DatabaseManager:
     def __init__(self, db_path):
-        self.db_path = db_path
-        self.conn = sqlite3.connect(self.db_path)
+        # Connections are opened lazily on whichever thread needs one, so a
+        # relative path must not depend on the working directory at that time.
+        self.db_path = os.path.abspath(db_path)
+        # Each server thread gets its own connection. In WAL mode readers never
+        # block on a writer, and writers are serialized on write_lock so they
+        # queue in Python instead of spinning on SQLITE_BUSY.
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self.write_lock = threading.RLock()
+        # Bumped after every commit that wrote to a table; HTTP validators are
+        # built from these, so they are known before any query runs. The tag
+        # keeps validators from an earlier run from matching this one.
+        self.table_versions = {}
+        self.instance_tag = os.urandom(4).hex()
+        self._versions_lock = threading.Lock()
+        self._commit_listeners = []
+        # note id -> (latest queued note, sanitize function, sequence number), written by flush_note_updates
+        self._queued_notes = {}
+        # Sequence numbers order queued and direct note writes; note id -> the
+        # number of the version stored last, so a slower flush of an older
+        # version never overwrites it
+        self._note_sequence = itertools.count(1)
+        self._stored_sequences = {}
+        # Flushes that have taken entries off the queue and not yet written them
+        self._flushing = 0
+        # One flusher thread writes the queue once the oldest entry is due, so
+        # autosave bursts reuse its connection instead of opening their own
+        self._queue_lock = threading.Condition()
+        self._flush_due = None
+        self._flusher = None
+        self._closing = False
+        # (event id, window start, window end) -> occurrence dates, and the keys per event id
+        self._recurrence_cache = OrderedDict()
+        self._recurrence_keys = {}
+        self._recurrence_lock = threading.Lock()
         self.create_tables()
 
+    @property
+    def conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+        # Only takes effect in a new database (it must precede the WAL switch,
+        # which writes the header); older files are converted by vacuum()
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        # NORMAL is durable across application crashes in WAL mode; only an OS
+        # crash or power loss can roll back the last commits.
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB}")
+        conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA foreign_keys=ON")
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """Run a block of writes on this thread's connection as one transaction.
+
+        Transactions nest: only the outermost block commits, and an exception
+        anywhere rolls back everything written since it began.
+        """
+        with self.write_lock:
+            conn = self.conn
+            depth = getattr(self._local, 'depth', 0)
+            self._local.depth = depth + 1
+            if depth == 0:
+                self._local.touched = set()
+                # Queued note updates flushed inside this transaction, re-queued if it rolls back
+                self._local.flushed_notes = {}
+                # sqlite3 only begins a transaction implicitly before DML, which
+                # would leave DDL such as the schema upgrades committing on its own
+                if not conn.in_transaction:
+                    conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn.cursor()
+                if depth == 0:
+                    conn.commit()
+                    self._bump_versions(self._local.touched)
+                    for listener in list(self._commit_listeners):
+                        listener(self._local.touched)
+            except Exception:
+                if depth == 0:
+                    conn.rollback()
+                    self._requeue_notes(self._local.flushed_notes)
+                raise
+            finally:
+                self._local.depth = depth
+
+    def add_commit_listener(self, listener):
+        """Call listener(tables) on the writing thread after each commit, with the set of tables it wrote"""
+        self._commit_listeners.append(listener)
+
+    def remove_commit_listener(self, listener):
+        if listener in self._commit_listeners:
+            self._commit_listeners.remove(listener)
+
+    def _touch(self, *tables):
+        """Mark tables as written by the current transaction"""
+        self._local.touched.update(tables)
+
+    def _bump_versions(self, tables):
+        with self._versions_lock:
+            for table in tables:
+                self.table_versions[table] = self.table_versions.get(table, 0) + 1
+
+    def get_etag(self, tables):
+        """Strong validator for a response built only from the given tables"""
+        if (self._queued_notes or self._flushing) and 'notes' in tables:
+            self.flush_note_updates()
+        with self._versions_lock:
+            versions = [self.table_versions.get(table, 0) for table in tables]
+        return '"{}-{}"'.format(self.instance_tag, '.'.join(str(version) for version in versions))
+
+    def close(self):
+        if self._queued_notes or self._flushing:
+            self.flush_note_updates(durable=True)
+        with self._queue_lock:
+            self._closing = True
+            flusher, self._flusher = self._flusher, None
+            self._queue_lock.notify_all()
+        if flusher is not None and flusher is not threading.current_thread():
+            flusher.join(5)
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
     def create_tables(self):
-        cursor = self.conn.cursor()
+        with self.transaction() as cursor:
+            legacy = self._rename_legacy_tables(cursor)
+            # Task rollups from before the priority key; _migrate rebuilds them
+            cursor.execute("SELECT 1 FROM pragma_table_info('analytics_task_days') WHERE name = 'priority'")
+            if cursor.fetchone() is None:
+                cursor.execute("DROP TABLE IF EXISTS analytics_task_days")
 
-        # Tasks table for daily schedule
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS tasks (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                title TEXT NOT NULL,
-                completed BOOLEAN NOT NULL,
-                category TEXT,
-                startTime TEXT,
-                endTime TEXT
-            )
-        ''')
+            # Tasks table for daily schedule
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS tasks (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    title TEXT NOT NULL,
+                    completed BOOLEAN NOT NULL,
+                    category TEXT,
+                    startTime TEXT,
+                    endTime TEXT
+                )
+            ''')
 
-        # Calendar events table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS calendar_events (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                title TEXT NOT NULL,
-                date TEXT NOT NULL,
-                time TEXT,
-                category TEXT,
-                recurring TEXT
-            )
-        ''')
+            # Calendar events table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS calendar_events (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    title TEXT NOT NULL,
+                    date TEXT NOT NULL,
+                    time TEXT,
+                    category TEXT,
+                    recurring TEXT
+                )
+            ''')
 
-        # Notes table for notebook
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS notes (
-                id TEXT PRIMARY KEY,
-                title TEXT NOT NULL,
-                content TEXT,
-                tags TEXT,
-                category TEXT,
-                createdAt TEXT NOT NULL,
-                updatedAt TEXT NOT NULL
-            )
-        ''')
+            # Notes table for notebook
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS notes (
+                    id TEXT PRIMARY KEY,
+                    title TEXT NOT NULL,
+                    content TEXT,
+                    tags TEXT,
+                    category TEXT,
+                    createdAt TEXT NOT NULL,
+                    updatedAt TEXT NOT NULL
+                )
+            ''')
 
-        self.conn.commit()
+            # Indexes backing the keyset-paginated, filtered list queries
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_notes_updated ON notes (updatedAt, id)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_notes_category_updated ON notes (category, updatedAt, id)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_tasks_category ON tasks (category)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_tasks_completed ON tasks (completed)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_calendar_events_date ON calendar_events (date)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_calendar_events_category_date ON calendar_events (category, date)")
+            # Repeating events are looked up by start date regardless of the window
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_calendar_events_recurring ON calendar_events (date) WHERE recurring IS NOT NULL")
 
-    def add_task(self, title, category, startTime, endTime):
-        cursor = self.conn.cursor()
-        cursor.execute("INSERT INTO tasks (title, completed, category, startTime, endTime) VALUES (?, ?, ?, ?, ?)",
-                       (title, False, category, startTime, endTime))
-        self.conn.commit()
-        return cursor.lastrowid
+            # Note tags, one row per (note, tag); replaces the comma-joined notes.tags column
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS note_tags (
+                    note_id TEXT NOT NULL REFERENCES notes (id) ON DELETE CASCADE,
+                    tag TEXT NOT NULL,
+                    PRIMARY KEY (note_id, tag)
+                ) WITHOUT ROWID
+            ''')
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_note_tags_tag ON note_tags (tag, note_id)")
+
+            # Latest change per row, numbered by a database-wide version that
+            # increases on every write. Deletes stay behind as tombstones so
+            # /api/sync can report them.
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS changes (
+                    entity TEXT NOT NULL,
+                    entity_id TEXT NOT NULL,
+                    op TEXT NOT NULL,
+                    version INTEGER NOT NULL,
+                    PRIMARY KEY (entity, entity_id)
+                ) WITHOUT ROWID
+            ''')
+            cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_changes_version ON changes (version)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_changes_entity_version ON changes (entity, version)")
+
+            # Frontend collections, one JSON document per row
+            for table in COLLECTION_TABLES.values():
+                cursor.execute(f'''
+                    CREATE TABLE IF NOT EXISTS {table} (
+                        id TEXT PRIMARY KEY,
+                        position INTEGER NOT NULL,
+                        data TEXT NOT NULL
+                    )
+                ''')
+                cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_position ON {table} (position)")
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS store_settings (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                )
+            ''')
+
+            # Note history: a snapshot of the title and content every
+            # SNAPSHOT_INTERVAL revisions, and compressed deltas from the previous
+            # stored revision (base) in between. See revisions.py.
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS note_revisions (
+                    note_id TEXT NOT NULL,
+                    revision INTEGER NOT NULL,
+                    base INTEGER,
+                    title TEXT NOT NULL,
+                    data BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    updatedAt TEXT NOT NULL,
+                    savedAt REAL NOT NULL,
+                    PRIMARY KEY (note_id, revision)
+                ) WITHOUT ROWID
+            ''')
+
+            # Daily aggregates of tasks and focus sessions for /api/analytics,
+            # kept up to date by every write to their source table (see ROLLUPS)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS analytics_task_days (
+                    day TEXT NOT NULL,
+                    category TEXT NOT NULL,
+                    priority TEXT NOT NULL,
+                    total INTEGER NOT NULL,
+                    completed INTEGER NOT NULL,
+                    PRIMARY KEY (day, category, priority)
+                ) WITHOUT ROWID
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS analytics_focus_days (
+                    day TEXT PRIMARY KEY,
+                    sessions INTEGER NOT NULL,
+                    completed INTEGER NOT NULL,
+                    minutes REAL NOT NULL
+                ) WITHOUT ROWID
+            ''')
+
+            # Internal bookkeeping (one-off migrations, maintenance timestamps)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                )
+            ''')
+
+            self._copy_legacy_tables(cursor, legacy)
+            self._migrate(cursor)
+
+            # Full-text index over notes, keyed by notes.rowid. Note bodies are
+            # indexed as plain text, which SQL triggers cannot produce from HTML,
+            # so add_note/update_note/delete_note maintain it explicitly.
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'notes_fts'")
+            fts_exists = cursor.fetchone() is not None
+            cursor.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5(
+                    title, body, tags,
+                    tokenize = 'unicode61 remove_diacritics 2'
+                )
+            ''')
+            if not fts_exists:
+                self._rebuild_search_index(cursor)
+
+    def _rename_legacy_tables(self, cursor):
+        """Move notes/tasks tables from the first desktop schema out of the way; returns the tables moved"""
+        renamed = []
+        for table, column in (('notes', 'created_at'), ('tasks', 'due_date')):
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (f"legacy_{table}",))
+            if cursor.fetchone() is not None:
+                # Left behind by an upgrade that was interrupted before this one
+                renamed.append(table)
+                continue
+            cursor.execute(f"SELECT 1 FROM pragma_table_info('{table}') WHERE name = ?", (column,))
+            if cursor.fetchone() is not None:
+                cursor.execute(f"ALTER TABLE {table} RENAME TO legacy_{table}")
+                renamed.append(table)
+        return renamed
+
+    def _copy_legacy_tables(self, cursor, renamed):
+        """Copy rows from tables moved by _rename_legacy_tables into the current schema, then drop them"""
+        if 'notes' in renamed:
+            cursor.execute("SELECT id, title, content, category, tags, created_at, updated_at FROM legacy_notes")
+            rows = [(str(note_id), title, content, category, ','.join(legacy_tags(tags)) or None,
+                     legacy_timestamp(created_at), legacy_timestamp(updated_at or created_at))
+                    for note_id, title, content, category, tags, created_at, updated_at in cursor.fetchall()]
+            cursor.executemany('''
+                INSERT OR IGNORE INTO notes (id, title, content, category, tags, createdAt, updatedAt) VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+            cursor.execute("DROP TABLE legacy_notes")
+        if 'tasks' in renamed:
+            cursor.execute('''
+                INSERT OR IGNORE INTO tasks (id, title, completed, category, startTime, endTime)
+                SELECT id, title, status = 'completed', category, due_date, NULL FROM legacy_tasks
+            ''')
+            cursor.execute("DROP TABLE legacy_tasks")
+
+    def _migrate(self, cursor):
+        cursor.execute("PRAGMA user_version")
+        version = cursor.fetchone()[0]
+        if version < 1:
+            # Move comma-joined tags into note_tags
+            cursor.execute("SELECT id, tags FROM notes WHERE tags IS NOT NULL AND tags != ''")
+            rows = [(note_id, tag) for note_id, tags in cursor.fetchall() for tag in normalize_tags(tags.split(','))]
+            cursor.executemany("INSERT OR IGNORE INTO note_tags (note_id, tag) VALUES (?, ?)", rows)
+            cursor.execute("UPDATE notes SET tags = NULL WHERE tags IS NOT NULL")
+        if version < 2:
+            # Rows written before change tracking existed are reported by a full sync
+            for table in SYNC_TABLES:
+                cursor.execute(f"SELECT id FROM {table} ORDER BY rowid")
+                for (entity_id,) in cursor.fetchall():
+                    self._record_change(cursor, table, entity_id, 'upsert')
+        if version < 4:
+            # Collections stored before the analytics rollups existed, and task
+            # rollups from before priorities and the tasks table were counted
+            self._rebuild_rollups(cursor)
+        if version < SCHEMA_VERSION:
+            cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    @contextmanager
+    def read_snapshot(self):
+        """Run several reads against one consistent view of the database"""
+        conn = self.conn
+        conn.execute("BEGIN")
+        try:
+            yield conn.cursor()
+        finally:
+            conn.rollback()
+
+    def _record_change(self, cursor, entity, entity_id, op):
+        self._record_changes(cursor, entity, [entity_id], op)
+
+    def _record_changes(self, cursor, entity, entity_ids, op):
+        if entity_ids:
+            self._touch(entity)
+        cursor.executemany('''
+            INSERT INTO changes (entity, entity_id, op, version)
+            VALUES (?, ?, ?, (SELECT COALESCE(MAX(version), 0) + 1 FROM changes))
+            ON CONFLICT (entity, entity_id) DO UPDATE SET op = excluded.op, version = excluded.version
+        ''', [(entity, str(entity_id), op) for entity_id in entity_ids])
 
-    def get_tasks(self):
+    def _inserted_ids(self, cursor, table, count):
+        # AUTOINCREMENT hands out consecutive ids, and write_lock keeps other
+        # writers out, so the last count ids are the rows just inserted.
+        cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,))
+        last = cursor.fetchone()[0]
+        return list(range(last - count + 1, last + 1))
+
+    def get_version(self, cursor=None):
+        """Version of the most recent write, 0 for an empty database"""
+        cursor = cursor or self.conn.cursor()
+        cursor.execute("SELECT COALESCE(MAX(version), 0) FROM changes")
+        return cursor.fetchone()[0]
+
+    @flushes_note_updates
+    def get_changes(self, since):
+        """Everything written after version since, as (version, {table: {'upserted': rows, 'deleted': ids}}).
+
+        Upserted rows have the same shape as the matching get_* method. Only the
+        latest state of each row is returned, however many times it changed.
+        """
+        with self.read_snapshot() as cursor:
+            version = self.get_version(cursor)
+            cursor.execute("SELECT entity, entity_id, op FROM changes WHERE version > ? ORDER BY version", (since,))
+            changed = {table: {'upserted': [], 'deleted': []} for table in SYNC_TABLES}
+            for entity, entity_id, op in cursor.fetchall():
+                if entity in changed:
+                    changed[entity]['upserted' if op == 'upsert' else 'deleted'].append(entity_id)
+            for table, ids in changed.items():
+                if table != 'notes':
+                    ids['deleted'] = [int(entity_id) for entity_id in ids['deleted']]
+                ids['upserted'] = self._fetch_by_ids(cursor, table, ids['upserted'])
+        return version, changed
+
+    def _existing_ids(self, cursor, table, ids):
+        found = set()
+        for start in range(0, len(ids), MAX_QUERY_IDS):
+            chunk = ids[start:start + MAX_QUERY_IDS]
+            placeholders = ', '.join('?' * len(chunk))
+            cursor.execute(f"SELECT id FROM {table} WHERE id IN ({placeholders})", chunk)
+            found.update(row[0] for row in cursor.fetchall())
+        return found
+
+    def _found_ids(self, cursor, table, ids):
+        """The ids that have a row in table, as strings, so ids sent as text match integer keys"""
+        return {str(found_id) for found_id in self._existing_ids(cursor, table, ids)}
+
+    def _fetch_by_ids(self, cursor, table, ids):
+        select = {'notes': NOTES_SELECT, 'tasks': TASKS_SELECT, 'calendar_events': CALENDAR_EVENTS_SELECT}[table]
+        rows = []
+        for start in range(0, len(ids), MAX_QUERY_IDS):
+            chunk = ids[start:start + MAX_QUERY_IDS]
+            placeholders = ', '.join('?' * len(chunk))
+            cursor.execute(f"{select} WHERE id IN ({placeholders})", chunk)
+            rows.extend(cursor.fetchall())
+        return rows
+
+    def _select(self, sql, clauses, params, order_by, limit=None, stream=False):
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += f" ORDER BY {order_by}"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params = list(params) + [limit]
         cursor = self.conn.cursor()
-        cursor.execute("SELECT * FROM tasks")
+        cursor.execute(sql, params)
+        if stream:
+            # The query has already run, so errors surface here rather than mid-iteration
+            return self._iter_cursor(cursor)
         return cursor.fetchall()
 
+    def _iter_cursor(self, cursor):
+        # A single SELECT reads one snapshot in WAL mode, however slowly it is consumed
+        try:
+            while True:
+                rows = cursor.fetchmany(FETCH_BATCH_ROWS)
+                if not rows:
+                    return
+                yield from rows
+        finally:
+            cursor.close()
+
+    def add_task(self, title, category, startTime, endTime):
+        return self.bulk_add_tasks([{'title': title, 'category': category, 'startTime': startTime, 'endTime': endTime}])[0]
+
+    def bulk_add_tasks(self, tasks):
+        """Insert many tasks in one transaction and return their ids in order"""
+        if not tasks:
+            return []
+        with self.transaction() as cursor:
+            cursor.executemany("INSERT INTO tasks (title, completed, category, startTime, endTime) VALUES (?, ?, ?, ?, ?)",
+                               [(t['title'], bool(t.get('completed', False)), t.get('category'), t.get('startTime'), t.get('endTime'))
+                                for t in tasks])
+            ids = self._inserted_ids(cursor, 'tasks', len(tasks))
+            self._update_rollups(cursor, 'tasks', [], self._fetch_documents(cursor, 'tasks', ids))
+            self._record_changes(cursor, 'tasks', ids, 'upsert')
+            return ids
+
+    def get_tasks(self, limit=None, after=None, category=None, completed=None, stream=False):
+        """Tasks ordered by id; after is the id of the last task of the previous page"""
+        clauses, params = [], []
+        if category is not None:
+            clauses.append("category = ?")
+            params.append(category)
+        if completed is not None:
+            clauses.append("completed = ?")
+            params.append(bool(completed))
+        if after is not None:
+            clauses.append("id > ?")
+            params.append(after)
+        return self._select(TASKS_SELECT, clauses, params, "id", limit, stream)
+
+    def iter_tasks(self, **filters):
+        """Like get_tasks, but yields rows as they are fetched instead of returning a list"""
+        return self.get_tasks(stream=True, **filters)
+
+
     def update_task(self, task_id, title, completed, category, startTime, endTime):
-        cursor = self.conn.cursor()
-        cursor.execute("UPDATE tasks SET title=?, completed=?, category=?, startTime=?, endTime=? WHERE id=?",
-                       (title, completed, category, startTime, endTime, task_id))
-        self.conn.commit()
+        self.bulk_update_tasks([{'id': task_id, 'title': title, 'completed': completed, 'category': category,
+                                 'startTime': startTime, 'endTime': endTime}])
+
+    def bulk_update_tasks(self, tasks):
+        """Update many tasks and return the ids that exist; the others are skipped"""
+        if not tasks:
+            return []
+        with self.transaction() as cursor:
+            found = self._found_ids(cursor, 'tasks', [t['id'] for t in tasks])
+            tasks = [t for t in tasks if str(t['id']) in found]
+            previous = self._fetch_documents(cursor, 'tasks', list(found))
+            cursor.executemany("UPDATE tasks SET title=?, completed=?, category=?, startTime=?, endTime=? WHERE id=?",
+                               [(t['title'], bool(t.get('completed', False)), t.get('category'), t.get('startTime'), t.get('endTime'), t['id'])
+                                for t in tasks])
+            self._update_rollups(cursor, 'tasks', previous, self._fetch_documents(cursor, 'tasks', list(found)))
+            self._record_changes(cursor, 'tasks', [t['id'] for t in tasks], 'upsert')
+        return [t['id'] for t in tasks]
 
     def delete_task(self, task_id):
-        cursor = self.conn.cursor()
-        cursor.execute("DELETE FROM tasks WHERE id=?", (task_id,))
-        self.conn.commit()
+        self.bulk_delete_tasks([task_id])
+
+    def bulk_delete_tasks(self, task_ids):
+        """Delete many tasks and return the ids that existed"""
+        if not task_ids:
+            return []
+        with self.transaction() as cursor:
+            found = self._found_ids(cursor, 'tasks', task_ids)
+            task_ids = [task_id for task_id in task_ids if str(task_id) in found]
+            self._update_rollups(cursor, 'tasks', self._fetch_documents(cursor, 'tasks', list(found)), [])
+            cursor.executemany("DELETE FROM tasks WHERE id=?", [(task_id,) for task_id in task_ids])
+            self._record_changes(cursor, 'tasks', task_ids, 'delete')
+        return task_ids
 
     def add_calendar_event(self, title, date, time, category, recurring):
-        cursor = self.conn.cursor()
-        cursor.execute("INSERT INTO calendar_events (title, date, time, category, recurring) VALUES (?, ?, ?, ?, ?)",
-                       (title, date, time, category, recurring))
-        self.conn.commit()
-        return cursor.lastrowid
+        return self.bulk_add_calendar_events([{'title': title, 'date': date, 'time': time, 'category': category, 'recurring': recurring}])[0]
+
+    def bulk_add_calendar_events(self, events):
+        """Insert many calendar events in one transaction and return their ids in order"""
+        if not events:
+            return []
+        with self.transaction() as cursor:
+            cursor.executemany("INSERT INTO calendar_events (title, date, time, category, recurring) VALUES (?, ?, ?, ?, ?)",
+                               [(e['title'], e['date'], e.get('time'), e.get('category'), e.get('recurring')) for e in events])
+            ids = self._inserted_ids(cursor, 'calendar_events', len(events))
+            self._record_changes(cursor, 'calendar_events', ids, 'upsert')
+            return ids
+
+    def get_calendar_events(self, limit=None, after=None, category=None, date_from=None, date_to=None, stream=False):
+        """Events ordered by date; after is the (date, id) of the last event of the previous page"""
+        clauses, params = [], []
+        if category is not None:
+            clauses.append("category = ?")
+            params.append(category)
+        if date_from is not None:
+            clauses.append("date >= ?")
+            params.append(date_from)
+        if date_to is not None:
+            clauses.append("date <= ?")
+            params.append(date_to)
+        if after is not None:
+            clauses.append("(date, id) > (?, ?)")
+            params.extend(after)
+        return self._select(CALENDAR_EVENTS_SELECT, clauses, params, "date, id", limit, stream)
+
+    def iter_calendar_events(self, **filters):
+        """Like get_calendar_events, but yields rows as they are fetched"""
+        return self.get_calendar_events(stream=True, **filters)
+
+    def get_calendar_occurrences(self, date_from, date_to, category=None):
+        """Every occurrence of an event between two ISO dates (inclusive), ordered by date, time and id.
+
+        Repeating events are expanded into one dict per day they fall on, with
+        date set to that day and seriesDate to the stored start date. Only
+        events dated inside the window and repeating events starting before
+        its end are read, so the cost follows the size of the window.
+        """
+        window_start, window_end = date.fromisoformat(date_from), date.fromisoformat(date_to)
+        category_clause = " AND category = ?" if category is not None else ""
+        category_params = [category] if category is not None else []
+        with self.read_snapshot() as cursor:
+            dated = cursor.execute(f"{CALENDAR_EVENTS_SELECT} WHERE date >= ? AND date <= ?{category_clause}",
+                                   [date_from, date_to] + category_params).fetchall()
+            repeating = cursor.execute(f"{CALENDAR_EVENTS_SELECT} WHERE recurring IS NOT NULL AND date <= ?{category_clause}",
+                                       [date_to] + category_params).fetchall()
+        occurrences = []
+        for row in dated:
+            if parse_recurrence(row[5]) is None:
+                occurrences.append(dict(calendar_event_to_dict(row), seriesDate=row[2]))
+        for row in repeating:
+            rule = parse_recurrence(row[5])
+            if rule is None:
+                continue
+            for day in self._expand_cached(row, rule, window_start, window_end):
+                occurrences.append(dict(calendar_event_to_dict(row), date=day, seriesDate=row[2]))
+        occurrences.sort(key=lambda e: (e['date'], e['time'] or '', e['id']))
+        return occurrences
+
+    def _expand_cached(self, row, rule, window_start, window_end):
+        # The stored date and rule are part of the key, so a row changed
+        # behind the update methods' back can never hit a stale entry
+        key = (row[0], row[2], rule, window_start, window_end)
+        with self._recurrence_lock:
+            days = self._recurrence_cache.get(key)
+            if days is not None:
+                self._recurrence_cache.move_to_end(key)
+                return days
+        try:
+            start = date.fromisoformat(row[2])
+        except (TypeError, ValueError):
+            return ()
+        days = tuple(day.isoformat() for day in expand_recurrence(start, rule, window_start, window_end))
+        with self._recurrence_lock:
+            self._recurrence_cache[key] = days
+            self._recurrence_keys.setdefault(row[0], set()).add(key)
+            while len(self._recurrence_cache) > RECURRENCE_CACHE_ENTRIES:
+                evicted, _ = self._recurrence_cache.popitem(last=False)
+                keys = self._recurrence_keys.get(evicted[0])
+                if keys is not None:
+                    keys.discard(evicted)
+                    if not keys:
+                        del self._recurrence_keys[evicted[0]]
+        return days
+
+    def _invalidate_recurrences(self, event_ids):
+        with self._recurrence_lock:
+            for event_id in event_ids:
+                # Batch requests may send ids as text
+                for key in self._recurrence_keys.pop(int(event_id), ()):
+                    self._recurrence_cache.pop(key, None)
 
-    def get_calendar_events(self):
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT * FROM calendar_events")
-        return cursor.fetchall()
 
     def update_calendar_event(self, event_id, title, date, time, category, recurring):
-        cursor = self.conn.cursor()
-        cursor.execute("UPDATE calendar_events SET title=?, date=?, time=?, category=?, recurring=? WHERE id=?",
-                       (title, date, time, category, recurring, event_id))
-        self.conn.commit()
+        self.bulk_update_calendar_events([{'id': event_id, 'title': title, 'date': date, 'time': time,
+                                           'category': category, 'recurring': recurring}])
+
+    def bulk_update_calendar_events(self, events):
+        """Update many calendar events and return the ids that exist; the others are skipped"""
+        if not events:
+            return []
+        with self.transaction() as cursor:
+            found = self._found_ids(cursor, 'calendar_events', [e['id'] for e in events])
+            events = [e for e in events if str(e['id']) in found]
+            cursor.executemany("UPDATE calendar_events SET title=?, date=?, time=?, category=?, recurring=? WHERE id=?",
+                               [(e['title'], e['date'], e.get('time'), e.get('category'), e.get('recurring'), e['id']) for e in events])
+            self._record_changes(cursor, 'calendar_events', [e['id'] for e in events], 'upsert')
+        self._invalidate_recurrences([e['id'] for e in events])
+        return [e['id'] for e in events]
 
     def delete_calendar_event(self, event_id):
-        cursor = self.conn.cursor()
-        cursor.execute("DELETE FROM calendar_events WHERE id=?", (event_id,))
-        self.conn.commit()
+        self.bulk_delete_calendar_events([event_id])
+
+    def bulk_delete_calendar_events(self, event_ids):
+        """Delete many calendar events and return the ids that existed"""
+        if not event_ids:
+            return []
+        with self.transaction() as cursor:
+            found = self._found_ids(cursor, 'calendar_events', event_ids)
+            event_ids = [event_id for event_id in event_ids if str(event_id) in found]
+            cursor.executemany("DELETE FROM calendar_events WHERE id=?", [(event_id,) for event_id in event_ids])
+            self._record_changes(cursor, 'calendar_events', event_ids, 'delete')
+        self._invalidate_recurrences(event_ids)
+        return event_ids
+
+    @flushes_note_updates
+    def get_notes(self, limit=None, after=None, category=None, updated_from=None, updated_to=None, tag=None, stream=False):
+        """Notes, most recently updated first; after is the (updatedAt, id) of the last note of the previous page.
+
+        Rows are (id, title, content, tags, category, createdAt, updatedAt) with
+        tags as a JSON array built from note_tags.
+        """
+        clauses, params = [], []
+        if tag is not None:
+            clauses.append("id IN (SELECT note_id FROM note_tags WHERE tag = ?)")
+            params.append(tag)
+        if category is not None:
+            clauses.append("category = ?")
+            params.append(category)
+        if updated_from is not None:
+            clauses.append("updatedAt >= ?")
+            params.append(updated_from)
+        if updated_to is not None:
+            try:
+                # updatedAt is a full timestamp, so a date bound means before the next day
+                params.append((date.fromisoformat(updated_to) + timedelta(days=1)).isoformat())
+                clauses.append("updatedAt < ?")
+            except ValueError:
+                params.append(updated_to)
+                clauses.append("updatedAt <= ?")
+        if after is not None:
+            clauses.append("(updatedAt, id) < (?, ?)")
+            params.extend(after)
+        return self._select(NOTES_SELECT, clauses, params, "updatedAt DESC, id DESC", limit, stream)
 
-    def get_notes(self):
+    def iter_notes(self, **filters):
+        """Like get_notes, but yields rows as they are fetched"""
+        return self.get_notes(stream=True, **filters)
+
+    @flushes_note_updates
+    def get_tag_counts(self):
+        """Every tag in use with the number of notes carrying it, most used first"""
         cursor = self.conn.cursor()
-        cursor.execute("SELECT * FROM notes ORDER BY updatedAt DESC")
-        return cursor.fetchall()
+        cursor.execute("SELECT tag, COUNT(*) AS count FROM note_tags GROUP BY tag ORDER BY count DESC, tag")
+        return [{"tag": tag, "count": count} for tag, count in cursor.fetchall()]
+
 
     def add_note(self, note):
-        cursor = self.conn.cursor()
-        cursor.execute("INSERT INTO notes (id, title, content, tags, category, createdAt, updatedAt) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                       (note['id'], note['title'], note['content'], ','.join(note['tags']), note['category'], note['createdAt'], note['updatedAt']))
-        self.conn.commit()
+        self.bulk_add_notes([note])
+
+    @flushes_note_updates
+    def bulk_add_notes(self, notes):
+        if not notes:
+            return
+        with self.transaction() as cursor:
+            cursor.executemany("INSERT INTO notes (id, title, content, category, createdAt, updatedAt) VALUES (?, ?, ?, ?, ?, ?)",
+                               [(n['id'], n['title'], n['content'], n.get('category'), n['createdAt'], n['updatedAt']) for n in notes])
+            self._set_note_tags(cursor, notes)
+            self._index_notes(cursor, notes)
+            self._record_changes(cursor, 'notes', [n['id'] for n in notes], 'upsert')
+            cursor.executemany("DELETE FROM note_revisions WHERE note_id=?", [(n['id'],) for n in notes])
+            self._record_revisions(cursor, [(None, n) for n in notes])
 
     def update_note(self, note):
-        cursor = self.conn.cursor()
-        cursor.execute("UPDATE notes SET title=?, content=?, tags=?, category=?, updatedAt=? WHERE id=?",
-                       (note['title'], note['content'], ','.join(note['tags']), note['category'], note['updatedAt'], note['id']))
-        self.conn.commit()
+        self.bulk_update_notes([note])
+
+    def queue_note_update(self, note, sanitize=None):
+        """Update a note after a short delay, together with any later updates to it.
+
+        Autosave sends the whole note on every pause in typing; only the last
+        version queued within NOTE_WRITE_DELAY_SECONDS is sanitized and written,
+        in one transaction with the other queued notes. Reads and writes of
+        notes flush the queue first, so callers never see the older version.
+        """
+        for field in ('id', 'title', 'updatedAt'):
+            if note.get(field) is None:
+                raise ValueError(f"Note update is missing {field}")
+        with self._queue_lock:
+            self._queued_notes[note['id']] = (note, sanitize, next(self._note_sequence))
+            self._schedule_flush()
+
+    def _schedule_flush(self):
+        """Have the flusher thread write the queue after the delay; call with _queue_lock held"""
+        if self._flush_due is None:
+            self._flush_due = time.monotonic() + NOTE_WRITE_DELAY_SECONDS
+        if self._flusher is None and not self._closing:
+            self._flusher = threading.Thread(target=self._run_flusher, name='neofocus-note-flush', daemon=True)
+            self._flusher.start()
+        self._queue_lock.notify_all()
+
+    def _run_flusher(self):
+        while True:
+            with self._queue_lock:
+                while not self._closing and (self._flush_due is None or time.monotonic() < self._flush_due):
+                    self._queue_lock.wait(None if self._flush_due is None else self._flush_due - time.monotonic())
+                if self._closing:
+                    return
+            try:
+                self.flush_note_updates()
+            except Exception as e:
+                logger.error(f"Error writing queued note updates: {e}")
+                with self._queue_lock:
+                    # Retry after another delay rather than spinning on the error
+                    if self._queued_notes:
+                        self._flush_due = time.monotonic() + NOTE_WRITE_DELAY_SECONDS
+
+    def flush_note_updates(self, durable=False):
+        """Write every queued note update now and return how many notes were written.
+
+        With durable, everything committed so far, including earlier flushes
+        by the flusher thread, is synced to disk before returning (see checkpoint).
+        """
+        with self._queue_lock:
+            if not getattr(self._local, 'depth', 0):
+                # Let a flush already under way finish, so callers see what it
+                # writes. Inside a transaction this thread holds write_lock,
+                # which that flush needs, so it cannot wait.
+                while self._flushing:
+                    self._queue_lock.wait()
+            queued, self._queued_notes = self._queued_notes, {}
+            self._flush_due = None
+            if queued:
+                self._flushing += 1
+        written = 0
+        if queued:
+            try:
+                written = self._write_queued_notes(queued)
+            finally:
+                with self._queue_lock:
+                    self._flushing -= 1
+                    self._queue_lock.notify_all()
+        if durable and not getattr(self._local, 'depth', 0):
+            self.checkpoint()
+        return written
+
+    def checkpoint(self):
+        """Copy the WAL into the database file, syncing both.
+
+        With synchronous=NORMAL a commit is only synced at the next
+        checkpoint; after this every commit so far survives power loss.
+        """
+        with self.write_lock:
+            self.conn.execute("PRAGMA wal_checkpoint(FULL)").fetchall()
+
+    def _write_queued_notes(self, queued):
+        # Sanitizing is slow, so it happens before write_lock is taken and
+        # never holds up other reads and writes of notes
+        try:
+            sanitized = {note_id: dict(note, content=sanitize(note.get('content') or '')) if sanitize else note
+                         for note_id, (note, sanitize, _) in queued.items()}
+        except Exception:
+            self._requeue_notes(queued)
+            raise
+        with self.write_lock:
+            with self._queue_lock:
+                # Drop versions superseded meanwhile: stored by another write, or queued again
+                queued = {note_id: entry for note_id, entry in queued.items()
+                          if entry[2] > self._stored_sequences.get(note_id, 0) and note_id not in self._queued_notes}
+            try:
+                # Undecorated: flushing again from here could store a newer queued version first
+                self._bulk_update_notes([sanitized[note_id] for note_id in queued],
+                                        {note_id: entry[2] for note_id, entry in queued.items()})
+            except Exception:
+                self._requeue_notes(queued)
+                raise
+            if getattr(self._local, 'depth', 0):
+                # Only committed with the enclosing transaction
+                self._local.flushed_notes.update(queued)
+        return len(queued)
+
+    def _requeue_notes(self, queued):
+        """Put back updates whose write failed or was rolled back, unless newer ones arrived meanwhile"""
+        if not queued:
+            return
+        with self._queue_lock:
+            for note_id, entry in queued.items():
+                if self._stored_sequences.get(note_id) == entry[2]:
+                    # Its write was rolled back
+                    del self._stored_sequences[note_id]
+                self._queued_notes.setdefault(note_id, entry)
+            self._schedule_flush()
+
+    @flushes_note_updates
+    def bulk_update_notes(self, notes):
+        """Update many notes and return the ids that exist; the others are skipped"""
+        return self._bulk_update_notes(notes)
+
+    def _bulk_update_notes(self, notes, sequences=None):
+        """bulk_update_notes without flushing the queue; sequences maps note ids to queued versions"""
+        if not notes:
+            return []
+        with self.transaction() as cursor:
+            # Updating a note that does not exist is a no-op, as a plain UPDATE would be
+            previous = self._current_notes(cursor, [n['id'] for n in notes])
+            notes = [n for n in notes if n['id'] in previous]
+            # A note updated more than once in one call ends up as its last update,
+            # with a revision for each
+            latest = list({n['id']: n for n in notes}.values())
+            cursor.executemany("UPDATE notes SET title=?, content=?, category=?, updatedAt=? WHERE id=?",
+                               [(n['title'], n['content'], n.get('category'), n['updatedAt'], n['id']) for n in latest])
+            self._set_note_tags(cursor, latest)
+            self._unindex_notes(cursor, [n['id'] for n in latest])
+            self._index_notes(cursor, latest)
+            self._record_changes(cursor, 'notes', [n['id'] for n in latest], 'upsert')
+            self._record_revisions(cursor, [(previous[n['id']], n) for n in notes])
+            with self._queue_lock:
+                for n in latest:
+                    # A direct write is newer than anything queued before it
+                    sequence = sequences[n['id']] if sequences else next(self._note_sequence)
+                    self._stored_sequences[n['id']] = max(sequence, self._stored_sequences.get(n['id'], 0))
+        return [n['id'] for n in latest]
 
     def delete_note(self, note_id):
+        self.bulk_delete_notes([note_id])
+
+    @flushes_note_updates
+    def bulk_delete_notes(self, note_ids):
+        """Delete many notes and return the ids that existed"""
+        if not note_ids:
+            return []
+        with self.transaction() as cursor:
+            found = self._found_ids(cursor, 'notes', note_ids)
+            note_ids = [note_id for note_id in note_ids if str(note_id) in found]
+            self._unindex_notes(cursor, note_ids)
+            cursor.executemany("DELETE FROM note_tags WHERE note_id=?", [(note_id,) for note_id in note_ids])
+            cursor.executemany("DELETE FROM notes WHERE id=?", [(note_id,) for note_id in note_ids])
+            cursor.executemany("DELETE FROM note_revisions WHERE note_id=?", [(note_id,) for note_id in note_ids])
+            self._record_changes(cursor, 'notes', note_ids, 'delete')
+
+    def _current_notes(self, cursor, note_ids):
+        """note id -> {'title', 'content', 'updatedAt'} as stored, for the ids that exist"""
+        found = {}
+        for start in range(0, len(note_ids), MAX_QUERY_IDS):
+            chunk = note_ids[start:start + MAX_QUERY_IDS]
+            placeholders = ', '.join('?' * len(chunk))
+            cursor.execute(f"SELECT id, title, content, updatedAt FROM notes WHERE id IN ({placeholders})", chunk)
+            found.update((row[0], {'title': row[1], 'content': row[2] or '', 'updatedAt': row[3]}) for row in cursor.fetchall())
+        return found
+
+    def _record_revisions(self, cursor, changes):
+        """Add a revision for each (previous stored note or None, new note) whose title or content changed.
+
+        A note may appear more than once; each entry is compared with the one before it.
+        """
+        if not changes:
+            return
+        heads = {}
+        ids = [new['id'] for _, new in changes]
+        for start in range(0, len(ids), MAX_QUERY_IDS):
+            chunk = ids[start:start + MAX_QUERY_IDS]
+            placeholders = ', '.join('?' * len(chunk))
+            cursor.execute(f'''
+                SELECT note_id, MAX(revision), MAX(CASE WHEN base IS NULL THEN revision END), COUNT(*)
+                FROM note_revisions WHERE note_id IN ({placeholders}) GROUP BY note_id
+            ''', chunk)
+            heads.update((row[0], row[1:]) for row in cursor.fetchall())
+        now = time.time()
+        rows, compact, current = [], [], {}
+        for old, new in changes:
+            old = current.get(new['id'], old)
+            content = new['content'] or ''
+            if old is not None and (old['title'], old['content']) == (new['title'], content):
+                continue
+            latest, snapshot, count = heads.get(new['id'], (None, None, 0))
+            if latest is None and old is not None:
+                # History starts with the version that was stored before tracking began
+                rows.append((new['id'], 1, None, old['title'], encode_snapshot(old['content']), len(old['content']),
+                             old['updatedAt'], now))
+                latest, snapshot, count = 1, 1, 1
+            revision = (latest or 0) + 1
+            data, base = encode_snapshot(content), None
+            if latest is not None and revision - snapshot < SNAPSHOT_INTERVAL:
+                delta = encode_delta(old['content'], content)
+                if len(delta) < len(data):
+                    data, base = delta, latest
+            rows.append((new['id'], revision, base, new['title'], data, len(content), new['updatedAt'], now))
+            heads[new['id']] = (revision, revision if base is None else snapshot, count + 1)
+            current[new['id']] = {'title': new['title'], 'content': content, 'updatedAt': new['updatedAt']}
+            if (count + 1) % REVISION_COMPACT_EVERY == 0:
+                compact.append(new['id'])
+        cursor.executemany('''
+            INSERT INTO note_revisions (note_id, revision, base, title, data, size, updatedAt, savedAt)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+        for note_id in dict.fromkeys(compact):
+            self._compact_revisions(cursor, note_id, now)
+
+    def _revision_contents(self, cursor, note_id, up_to=None):
+        """Yield (revision row, content) along a note's history, from the snapshot each needs"""
+        params = [note_id]
+        clause = ""
+        if up_to is not None:
+            # Start from the last snapshot at or before the requested revision
+            clause = " AND revision <= ? AND revision >= (SELECT MAX(revision) FROM note_revisions WHERE note_id = ? AND revision <= ? AND base IS NULL)"
+            params += [up_to, note_id, up_to]
+        cursor.execute(f'''
+            SELECT revision, base, title, data, size, updatedAt, savedAt FROM note_revisions
+            WHERE note_id = ?{clause} ORDER BY revision
+        ''', params)
+        content = None
+        for row in cursor.fetchall():
+            content = decode_snapshot(row[3]) if row[1] is None else apply_delta(content, row[3])
+            yield row, content
+
+    def _compact_revisions(self, cursor, note_id, now):
+        history = list(self._revision_contents(cursor, note_id))
+        keep = revisions_to_keep([(row[0], row[6]) for row, _ in history], now)
+        if len(keep) == len(history):
+            return 0
+        cursor.execute("DELETE FROM note_revisions WHERE note_id = ?", (note_id,))
+        rows, previous = [], None
+        for row, content in history:
+            if row[0] not in keep:
+                continue
+            data, base = encode_snapshot(content), None
+            if previous is not None and len(rows) % SNAPSHOT_INTERVAL:
+                delta = encode_delta(previous[1], content)
+                if len(delta) < len(data):
+                    data, base = delta, previous[0]
+            rows.append((note_id, row[0], base, row[2], data, row[4], row[5], row[6]))
+            previous = (row[0], content)
+        cursor.executemany('''
+            INSERT INTO note_revisions (note_id, revision, base, title, data, size, updatedAt, savedAt)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+        return len(history) - len(rows)
+
+    @flushes_note_updates
+    def get_note_revisions(self, note_id):
+        """Metadata of a note's stored revisions, newest first"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT revision, title, size, updatedAt, savedAt, base IS NULL FROM note_revisions
+            WHERE note_id = ? ORDER BY revision DESC
+        ''', (note_id,))
+        return [{'revision': revision, 'title': title, 'size': size, 'updatedAt': updated_at, 'savedAt': saved_at,
+                 'snapshot': bool(snapshot)} for revision, title, size, updated_at, saved_at, snapshot in cursor.fetchall()]
+
+    @flushes_note_updates
+    def get_note_revision(self, note_id, revision):
+        """A note as it was at a revision, or None if that revision is not stored"""
+        if not 0 < revision <= MAX_SQLITE_INTEGER:
+            return None
+        with self.read_snapshot() as cursor:
+            for row, content in self._revision_contents(cursor, note_id, up_to=revision):
+                if row[0] == revision:
+                    return {'id': note_id, 'revision': revision, 'title': row[2], 'content': content,
+                            'updatedAt': row[5], 'savedAt': row[6]}
+        return None
+
+    def compact_note_revisions(self, note_ids=None, now=None):
+        """Apply the retention policy to the history of the given notes (all by default); returns revisions removed"""
+        now = time.time() if now is None else now
+        with self.transaction() as cursor:
+            if note_ids is None:
+                note_ids = [row[0] for row in cursor.execute("SELECT DISTINCT note_id FROM note_revisions").fetchall()]
+            return sum(self._compact_revisions(cursor, note_id, now) for note_id in note_ids)
+
+    def _set_note_tags(self, cursor, notes):
+        cursor.executemany("DELETE FROM note_tags WHERE note_id=?", [(n['id'],) for n in notes])
+        cursor.executemany("INSERT INTO note_tags (note_id, tag) VALUES (?, ?)",
+                           [(n['id'], tag) for n in notes for tag in normalize_tags(n.get('tags'))])
+
+    def _index_notes(self, cursor, notes):
+        cursor.executemany("INSERT INTO notes_fts (rowid, title, body, tags) SELECT rowid, ?, ?, ? FROM notes WHERE id=?",
+                           [(n['title'], strip_html(n['content']), ' '.join(normalize_tags(n.get('tags'))), n['id']) for n in notes])
+
+    def _unindex_notes(self, cursor, note_ids):
+        cursor.executemany("DELETE FROM notes_fts WHERE rowid = (SELECT rowid FROM notes WHERE id=?)",
+                           [(note_id,) for note_id in note_ids])
+
+    def get_meta(self, key, default=None):
         cursor = self.conn.cursor()
-        cursor.execute("DELETE FROM notes WHERE id=?", (note_id,))
-        self.conn.commit()
+        cursor.execute("SELECT value FROM meta WHERE key = ?", (key,))
+        row = cursor.fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        with self.transaction() as cursor:
+            cursor.execute("INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+                           (key, str(value)))
+
+    @flushes_note_updates
+    def get_all_data(self):
+        """Everything the frontend keeps, in the shape of DatabaseData"""
+        with self.read_snapshot() as cursor:
+            data = {}
+            for name, table in COLLECTION_TABLES.items():
+                cursor.execute(f"SELECT data FROM {table} ORDER BY position")
+                data[name] = [json.loads(row[0]) for row in cursor.fetchall()]
+            cursor.execute(NOTES_SELECT + " ORDER BY updatedAt DESC, id DESC")
+            data['notes'] = [note_to_dict(row) for row in cursor.fetchall()]
+            cursor.execute("SELECT key, value FROM store_settings")
+            data['settings'] = dict(DEFAULT_SETTINGS, **{key: json.loads(value) for key, value in cursor.fetchall()})
+        return data
+
+    def save_all_data(self, data):
+        """Make the stored state match a full DatabaseData snapshot from the frontend.
+
+        Only rows that were added, changed or removed are written, so saving
+        after a small edit costs a few row writes rather than a full rewrite.
+        Collections missing from data are left untouched.
+        """
+        with self.transaction():
+            for name in COLLECTION_TABLES:
+                if isinstance(data.get(name), list):
+                    self.replace_collection(name, data[name])
+            if isinstance(data.get('notes'), list):
+                self.replace_notes(data['notes'])
+            if isinstance(data.get('settings'), dict):
+                self.save_settings(data['settings'])
+
+    def replace_collection(self, name, items):
+        """Store items as the full contents of a collection, writing only the differences"""
+        table = COLLECTION_TABLES[name]
+        with self.transaction() as cursor:
+            cursor.execute(f"SELECT id, position, data FROM {table}")
+            existing = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+            incoming = self._collection_rows(items, 0)
+            changed = [row for row in incoming if existing.get(row[0]) != (row[1], row[2])]
+            kept = {row[0] for row in incoming}
+            removed = [(item_id,) for item_id in existing if item_id not in kept]
+            if removed:
+                self._touch(table)
+                self._update_rollups(cursor, table, [existing[item_id][1] for (item_id,) in removed], [])
+            cursor.executemany(f"DELETE FROM {table} WHERE id = ?", removed)
+            self._upsert_collection_rows(cursor, table, changed)
+            return len(changed), len(removed)
+
+    def upsert_collection_items(self, name, items, start_position):
+        """Insert or overwrite items without touching the rest of the collection"""
+        if name == 'notes':
+            self.upsert_notes(items)
+            return
+        table = COLLECTION_TABLES[name]
+        with self.transaction() as cursor:
+            self._upsert_collection_rows(cursor, table, self._collection_rows(items, start_position))
+
+    def _collection_rows(self, items, start_position):
+        rows = []
+        for offset, item in enumerate(items):
+            position = start_position + offset
+            item_id = item.get('id') if isinstance(item, dict) else None
+            # Documents without an id are keyed by their position
+            rows.append((str(item_id) if item_id is not None else f"position-{position}", position, encode_document(item)))
+        return rows
+
+    def _upsert_collection_rows(self, cursor, table, rows):
+        if rows:
+            self._touch(table)
+        if rows and table in ROLLUPS:
+            previous = self._fetch_documents(cursor, table, [row[0] for row in rows])
+            self._update_rollups(cursor, table, previous, [row[2] for row in rows])
+        cursor.executemany(f'''
+            INSERT INTO {table} (id, position, data) VALUES (?, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET position = excluded.position, data = excluded.data
+        ''', rows)
+
+    def _fetch_documents(self, cursor, table, ids):
+        document = ROLLUPS[table][4] if table in ROLLUPS else 'data'
+        documents = []
+        for start in range(0, len(ids), MAX_QUERY_IDS):
+            chunk = ids[start:start + MAX_QUERY_IDS]
+            placeholders = ', '.join('?' * len(chunk))
+            cursor.execute(f"SELECT {document} FROM {table} WHERE id IN ({placeholders})", chunk)
+            documents.extend(row[0] for row in cursor.fetchall())
+        return documents
+
+    def _update_rollups(self, cursor, table, removed, added):
+        """Move a store table's rollup from the removed to the added documents (JSON text)"""
+        rollup_table, keys, columns, contribution, _ = ROLLUPS[table]
+        deltas = {}
+        for documents, sign in ((removed, -1), (added, 1)):
+            for document in documents:
+                item = json.loads(document)
+                entry = contribution(item) if isinstance(item, dict) else None
+                if entry is None:
+                    continue
+                key, values = entry
+                totals = deltas.setdefault(key, [0] * len(columns))
+                for index, value in enumerate(values):
+                    totals[index] += sign * value
+        rows = [key + tuple(totals) for key, totals in deltas.items() if any(totals)]
+        if not rows:
+            return
+        self._touch(rollup_table)
+        cursor.executemany(f'''
+            INSERT INTO {rollup_table} ({', '.join(keys + columns)}) VALUES ({', '.join('?' * len(keys + columns))})
+            ON CONFLICT ({', '.join(keys)}) DO UPDATE SET {', '.join(f'{c} = {c} + excluded.{c}' for c in columns)}
+        ''', rows)
+        # The first summed column counts documents; a day without any is dropped
+        cursor.execute(f"DELETE FROM {rollup_table} WHERE {columns[0]} <= 0")
+
+    def _rebuild_rollups(self, cursor):
+        for rollup_table in {rollup[0] for rollup in ROLLUPS.values()}:
+            cursor.execute(f"DELETE FROM {rollup_table}")
+            self._touch(rollup_table)
+        for table, (*_, document) in ROLLUPS.items():
+            documents = cursor.execute(f"SELECT {document} FROM {table}")
+            while True:
+                batch = [row[0] for row in documents.fetchmany(FETCH_BATCH_ROWS)]
+                if not batch:
+                    break
+                self._update_rollups(self.conn.cursor(), table, [], batch)
+
+    def rebuild_analytics(self):
+        """Recompute every analytics rollup from the stored collections"""
+        with self.transaction() as cursor:
+            self._rebuild_rollups(cursor)
+            cursor.execute("SELECT (SELECT COUNT(*) FROM analytics_task_days) + (SELECT COUNT(*) FROM analytics_focus_days)")
+            return cursor.fetchone()[0]
+
+    def get_analytics(self, date_from=None, date_to=None):
+        """Dashboard figures between two ISO dates (inclusive, either may be None), from the rollups"""
+        clauses, params = [], []
+        if date_from is not None:
+            clauses.append("day >= ?")
+            params.append(date_from)
+        if date_to is not None:
+            clauses.append("day <= ?")
+            params.append(date_to)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self.read_snapshot() as cursor:
+            task_days = cursor.execute(
+                f"SELECT day, SUM(total), SUM(completed) FROM analytics_task_days{where} GROUP BY day ORDER BY day",
+                params).fetchall()
+            task_categories = cursor.execute(
+                f"SELECT category, SUM(total), SUM(completed) FROM analytics_task_days{where} GROUP BY category ORDER BY category",
+                params).fetchall()
+            task_priorities = cursor.execute(
+                f"SELECT priority, SUM(total), SUM(completed) FROM analytics_task_days{where} GROUP BY priority ORDER BY priority",
+                params).fetchall()
+            focus_days = cursor.execute(
+                f"SELECT day, sessions, completed, minutes FROM analytics_focus_days{where} ORDER BY day", params).fetchall()
+            habits = [json.loads(row[0]) for row in cursor.execute("SELECT data FROM store_habits ORDER BY position")]
+
+        def rate(completed, total):
+            return round(completed / total, 4) if total else None
+
+        tasks_total = sum(row[1] for row in task_days)
+        tasks_completed = sum(row[2] for row in task_days)
+        return {
+            'tasks': {
+                'total': tasks_total,
+                'completed': tasks_completed,
+                'completionRate': rate(tasks_completed, tasks_total),
+                'byDay': [{'date': day, 'total': total, 'completed': completed} for day, total, completed in task_days],
+                'byCategory': [{'category': category, 'total': total, 'completed': completed,
+                                'completionRate': rate(completed, total)} for category, total, completed in task_categories],
+                'byPriority': [{'priority': priority, 'total': total, 'completed': completed,
+                                'completionRate': rate(completed, total)} for priority, total, completed in task_priorities],
+            },
+            'focus': {
+                'sessions': sum(row[1] for row in focus_days),
+                'completed': sum(row[2] for row in focus_days),
+                'minutes': sum(row[3] for row in focus_days),
+                'byDay': [{'date': day, 'sessions': sessions, 'completed': completed, 'minutes': minutes}
+                          for day, sessions, completed, minutes in focus_days],
+            },
+            # Streaks are kept on the habit documents themselves
+            'habits': [{'id': habit.get('id'), 'name': habit.get('name'), 'streak': habit.get('streak', 0),
+                        'longestStreak': habit.get('longestStreak', 0)} for habit in habits if isinstance(habit, dict)],
+        }
+
+    @flushes_note_updates
+    def replace_notes(self, notes):
+        """Make the notes table match notes, writing only notes that differ"""
+        with self.transaction() as cursor:
+            cursor.execute(NOTES_SELECT)
+            existing = {row[0]: note_to_dict(row) for row in cursor.fetchall()}
+            incoming = [self._normalize_note(note) for note in notes]
+            new_ids = {note['id'] for note in incoming}
+            added = [note for note in incoming if note['id'] not in existing]
+            # Stored tags come back sorted, so compare tag sets rather than lists
+            changed = [note for note in incoming if note['id'] in existing
+                       and dict(existing[note['id']], tags=set(existing[note['id']]['tags'])) != dict(note, tags=set(note['tags']))]
+            self.bulk_delete_notes([note_id for note_id in existing if note_id not in new_ids])
+            self.bulk_add_notes(added)
+            self.bulk_update_notes(changed)
+
+    @flushes_note_updates
+    def upsert_notes(self, notes):
+        with self.transaction() as cursor:
+            notes = [self._normalize_note(note) for note in notes]
+            existing = self._existing_ids(cursor, 'notes', [note['id'] for note in notes])
+            self.bulk_add_notes([note for note in notes if note['id'] not in existing])
+            self.bulk_update_notes([note for note in notes if note['id'] in existing])
+
+    def _normalize_note(self, note):
+        """A frontend note with every column filled in, as note_to_dict would return it"""
+        # Same format as JavaScript's Date.toISOString()
+        created_at = note.get('createdAt') or datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+        return {
+            'id': str(note['id']),
+            'title': note.get('title') or '',
+            'content': note.get('content') or '',
+            'tags': normalize_tags(note.get('tags')),
+            'category': note.get('category'),
+            'createdAt': created_at,
+            'updatedAt': note.get('updatedAt') or created_at,
+        }
+
+    def save_settings(self, settings):
+        with self.transaction() as cursor:
+            cursor.execute("SELECT key, value FROM store_settings")
+            existing = dict(cursor.fetchall())
+            rows = [(key, encode_document(value)) for key, value in settings.items()]
+            rows = [row for row in rows if existing.get(row[0]) != row[1]]
+            if rows:
+                self._touch('store_settings')
+            cursor.executemany('''
+                INSERT INTO store_settings (key, value) VALUES (?, ?)
+                ON CONFLICT (key) DO UPDATE SET value = excluded.value
+            ''', rows)
+
+    def _rebuild_search_index(self, cursor):
+        cursor.execute("DELETE FROM notes_fts")
+        cursor.execute('''
+            SELECT rowid, title, content,
+                   (SELECT group_concat(tag, ' ') FROM note_tags WHERE note_id = notes.id)
+            FROM notes
+        ''')
+        rows = [(rowid, title, strip_html(content), tags or '')
+                for rowid, title, content, tags in cursor.fetchall()]
+        cursor.executemany("INSERT INTO notes_fts (rowid, title, body, tags) VALUES (?, ?, ?, ?)", rows)
+        cursor.execute("INSERT INTO notes_fts (notes_fts) VALUES ('optimize')")
+        return len(rows)
+
+    @flushes_note_updates
+    def rebuild_search_index(self):
+        """Re-index every note, e.g. for databases created before search existed or after a full VACUUM"""
+        with self.transaction() as cursor:
+            self._touch('notes')
+            return self._rebuild_search_index(cursor)
+
+    def backup(self, path):
+        """Copy the database to path with SQLite's online backup API"""
+        if self._queued_notes:
+            self.flush_note_updates()
+        # The copy is one read transaction on a private connection, which in
+        # WAL mode never blocks writers (a stepped copy would restart on every write)
+        source = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT_MS / 1000)
+        try:
+            target = sqlite3.connect(path)
+            try:
+                source.backup(target)
+            finally:
+                target.close()
+        finally:
+            source.close()
+
+    def page_stats(self):
+        """Page counts and the auto_vacuum mode (0 none, 1 full, 2 incremental)"""
+        conn = self.conn
+        return {
+            'pageSize': conn.execute("PRAGMA page_size").fetchone()[0],
+            'pages': conn.execute("PRAGMA page_count").fetchone()[0],
+            'freePages': conn.execute("PRAGMA freelist_count").fetchone()[0],
+            'autoVacuum': conn.execute("PRAGMA auto_vacuum").fetchone()[0],
+        }
+
+    def incremental_vacuum(self, max_pages=None):
+        """Return free pages to the filesystem; returns how many were freed"""
+        with self.write_lock:
+            conn = self.conn
+            if conn.in_transaction:
+                raise RuntimeError("incremental_vacuum() cannot run inside a transaction")
+            before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            # execute() would step the pragma once, freeing a single page
+            conn.executescript(f"PRAGMA incremental_vacuum({int(max_pages or 0)})")
+            return before - conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+    @flushes_note_updates
+    def vacuum(self):
+        """Rewrite the whole file, switching it to incremental auto_vacuum"""
+        with self.write_lock:
+            conn = self.conn
+            if conn.in_transaction:
+                raise RuntimeError("vacuum() cannot run inside a transaction")
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("VACUUM")
+            # VACUUM may renumber the rowids of notes, which the search index is keyed by
+            with self.transaction() as cursor:
+                self._touch('notes')
+                self._rebuild_search_index(cursor)
+
+    def optimize(self, analyze=False):
+        """Refresh query planner statistics: PRAGMA optimize, or a full ANALYZE first"""
+        with self.write_lock:
+            conn = self.conn
+            if analyze:
+                conn.execute("ANALYZE")
+            conn.execute("PRAGMA optimize")
+            conn.commit()
+
+    @flushes_note_updates
+    def search_notes(self, text, limit=20):
+        """Notes matching text, best match first, with an HTML-safe snippet of the body"""
+        query = build_match_query(text)
+        if query is None:
+            return []
+        cursor = self.conn.cursor()
+        # bm25 weights: title matches count most, then tags, then body
+        cursor.execute('''
+            SELECT n.id, n.title, n.category, n.updatedAt,
+                   snippet(notes_fts, 1, ?, ?, '...', 16),
+                   bm25(notes_fts, 10.0, 1.0, 5.0) AS rank
+            FROM notes_fts JOIN notes n ON n.rowid = notes_fts.rowid
+            WHERE notes_fts MATCH ?
+            ORDER BY rank
+            LIMIT ?
+        ''', (SNIPPET_OPEN, SNIPPET_CLOSE, query, limit))
+        return [
+            {
+                "id": note_id, "title": title, "category": category, "updatedAt": updated_at,
+                "snippet": html.escape(snippet).replace(SNIPPET_OPEN, '<mark>').replace(SNIPPET_CLOSE, '</mark>'),
+                "rank": rank,
+            }
+            for note_id, title, category, updated_at, snippet, rank in cursor.fetchall()
+        ]
+
+# Every public method that runs SQL is timed for /api/metrics; context
+# managers and bookkeeping that never touches SQLite are left alone
+instrument_methods(DatabaseManager, 'neofocus_db_call_duration_seconds', [
+    name for name, value in vars(DatabaseManager).items()
+    if callable(value) and not name.startswith('_') and name not in ('transaction', 'read_snapshot', 'close', 'get_etag',
+                                                                    'add_commit_listener', 'remove_commit_listener',
+                                                                    'queue_note_update')
+])
+
+
+class DatabaseService:
+    """Owns the one DatabaseManager of a process and opens it on first use.
+
+    get() opens the database (running on_open on it first, e.g. to import
+    legacy data) or blocks while another thread is doing so. importing is
+    True while on_open runs. ready is set once an attempt has finished;
+    error holds the exception if it failed.
+    """
+
+    def __init__(self, db_path, on_open=None):
+        self.db_path = db_path
+        self.on_open = on_open
+        self._manager = None
+        self._lock = threading.Lock()
+        self.ready = threading.Event()
+        self.importing = False
+        self.error = None
+
+    def get(self):
+        manager = self._manager
+        if manager is None:
+            with self._lock:
+                if self._manager is None:
+                    try:
+                        manager = DatabaseManager(self.db_path)
+                        if self.on_open:
+                            self.importing = True
+                            try:
+                                self.on_open(manager)
+                            finally:
+                                self.importing = False
+                        self._manager = manager
+                        self.error = None
+                    except Exception as e:
+                        self.error = e
+                        raise
+                    finally:
+                        self.ready.set()
+                manager = self._manager
+        return manager
+
+    @property
+    def is_open(self):
+        return self._manager is not None
+
+    def close(self):
+        with self._lock:
+            if self._manager is not None:
+                self._manager.close()
+                self._manager = None
+            self.ready.clear()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NEO FOCUS database maintenance")
+    # The app's database next to this module, whatever the working directory
+    default_db = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'neofocus.db')
+    parser.add_argument('--db', default=default_db, help='path to the SQLite database (default: %(default)s)')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('rebuild-search-index', help='re-index all notes for full-text search')
+    commands.add_parser('compact-revisions', help='apply the note history retention policy to every note')
+    backup = commands.add_parser('backup', help='write an online backup to the backups directory next to the database')
+    backup.add_argument('--dir', help='backup directory (default: backups next to the database)')
+    commands.add_parser('vacuum', help='rewrite the database file and refresh its statistics')
+    restore = commands.add_parser('restore', help='replace the database with a backup (stop the app first)')
+    restore.add_argument('path', help='backup file to restore')
+    commands.add_parser('rebuild-analytics', help='recompute the daily analytics rollups from the stored collections')
+    import_json = commands.add_parser('import-json', help='import a neofocus-data.json file without loading it into memory')
+    import_json.add_argument('path', help='JSON data file written by the Next.js /api/save route')
+    args = parser.parse_args()
+
+    if args.command == 'restore':
+        from maintenance import restore_backup
+        saved = restore_backup(args.path, args.db)
+        print(f"Restored {args.path}" + (f"; the replaced database was saved as {saved}" if saved else ""))
+        return
+    db_manager = DatabaseManager(args.db)
+    try:
+        if args.command == 'rebuild-search-index':
+            count = db_manager.rebuild_search_index()
+            print(f"Indexed {count} notes")
+        elif args.command == 'compact-revisions':
+            print(f"Removed {db_manager.compact_note_revisions()} note revisions")
+        elif args.command == 'backup':
+            from maintenance import backup_database
+            print(f"Wrote {backup_database(db_manager, args.dir)}")
+        elif args.command == 'vacuum':
+            db_manager.vacuum()
+            db_manager.optimize(analyze=True)
+            print(f"Database is {db_manager.page_stats()['pages']} pages")
+        elif args.command == 'rebuild-analytics':
+            count = db_manager.rebuild_analytics()
+            print(f"Rebuilt {count} daily rollup rows")
+        elif args.command == 'import-json':
+            from json_importer import import_json_file
+            from sanitizer import NoteSanitizer
+            counts = import_json_file(db_manager, args.path, sanitize=NoteSanitizer().clean)
+            print(', '.join(f"{name}: {count}" for name, count in counts.items()) or "Nothing to import")
+    finally:
+        db_manager.close()
+
+if __name__ == '__main__':
+    main()
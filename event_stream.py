@@ -0,0 +1,188 @@
+import json
+import logging
+import socket
+import threading
+import time
+
+from database_manager import SYNC_TABLES
+
+logger = logging.getLogger(__name__)
+
+# Seconds between comment lines sent to idle streams, which keep proxies from
+# timing them out and reveal clients that went away
+HEARTBEAT_SECONDS = 15
+# How long one client may block a write before it is dropped
+SEND_TIMEOUT_SECONDS = 2
+# Most changes replayed to a reconnecting client; beyond that it is told to reload
+MAX_REPLAY_CHANGES = 1000
+# Milliseconds clients wait before reconnecting (the SSE retry field)
+RETRY_MS = 3000
+
+
+def format_event(event, data, event_id=None):
+    """One server-sent event as bytes"""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, separators=(',', ':'))}")
+    return ('\n'.join(lines) + '\n\n').encode('utf-8')
+
+
+def format_change(entity, entity_id, op, version):
+    # Ids are stored as text in the changes table; tasks and events use integer ids
+    entity_id = entity_id if entity == 'notes' else int(entity_id)
+    return format_event('change', {'entity': entity, 'id': entity_id, 'op': op, 'version': version}, version)
+
+
+class _Client:
+    def __init__(self, sock, version):
+        self.sock = sock
+        self.version = version
+
+
+class EventBroker:
+    """Pushes committed changes to every /api/events stream from one thread.
+
+    A request handler writes the response headers, then hands its socket to
+    attach() and returns, so open streams never hold an HTTP worker. Changes
+    are read from the changes table, whose versions double as event ids: a
+    client reconnecting with Last-Event-ID gets whatever it missed.
+    """
+
+    def __init__(self, database, heartbeat=HEARTBEAT_SECONDS):
+        self.database = database
+        self.heartbeat = heartbeat
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pending = []
+        self._clients = []
+        self._listening_to = None
+        self._thread = None
+        self._closed = False
+        self.version = None
+
+    def attach(self, sock, last_event_id=None):
+        """Take over an open socket whose event-stream headers have been sent"""
+        with self._lock:
+            if self._closed:
+                sock.close()
+                return
+            self._pending.append((sock, last_event_id))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='neofocus-events', daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def notify(self, tables):
+        """Commit listener: wake the broker if a synced table was written"""
+        if not tables.isdisjoint(SYNC_TABLES):
+            self._wake.set()
+
+    @property
+    def client_count(self):
+        with self._lock:
+            return len(self._clients) + len(self._pending)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            thread = self._thread
+        self._wake.set()
+        if thread is not None:
+            thread.join(5)
+        with self._lock:
+            sockets = [client.sock for client in self._clients] + [sock for sock, _ in self._pending]
+            self._clients, self._pending = [], []
+        for sock in sockets:
+            self._close_socket(sock)
+        if self._listening_to is not None:
+            self._listening_to.remove_commit_listener(self.notify)
+            self._listening_to = None
+
+    def _run(self):
+        last_heartbeat = time.monotonic()
+        while True:
+            self._wake.wait(self.heartbeat)
+            self._wake.clear()
+            if self._closed:
+                return
+            try:
+                db_manager = self._db_manager()
+                with self._lock:
+                    pending, self._pending = self._pending, []
+                for sock, last_event_id in pending:
+                    self._add_client(db_manager, sock, last_event_id)
+                self._dispatch(db_manager)
+            except Exception as e:
+                logger.error(f"Error sending change events: {e}")
+            if time.monotonic() - last_heartbeat >= self.heartbeat:
+                self._broadcast(b': heartbeat\n\n')
+                last_heartbeat = time.monotonic()
+
+    def _db_manager(self):
+        db_manager = self.database.get()
+        if db_manager is not self._listening_to:
+            db_manager.add_commit_listener(self.notify)
+            self._listening_to = db_manager
+            self.version = db_manager.get_version()
+        return db_manager
+
+    def _add_client(self, db_manager, sock, last_event_id):
+        sock.settimeout(SEND_TIMEOUT_SECONDS)
+        client = _Client(sock, self.version)
+        chunks = [f"retry: {RETRY_MS}\n\n".encode()]
+        if last_event_id is not None:
+            changes = self._changes(db_manager, last_event_id, MAX_REPLAY_CHANGES + 1)
+            if last_event_id > self.version or len(changes) > MAX_REPLAY_CHANGES:
+                # Too far behind (or from another database): start over from a full fetch
+                chunks.append(format_event('reset', {'version': self.version}, self.version))
+            else:
+                chunks += [format_change(*change) for change in changes if change[3] <= self.version]
+        if self._send(client, b''.join(chunks)):
+            with self._lock:
+                self._clients.append(client)
+
+    def _dispatch(self, db_manager):
+        changes = self._changes(db_manager, self.version)
+        if not changes:
+            return
+        self.version = changes[-1][3]
+        with self._lock:
+            clients = list(self._clients)
+        for client in clients:
+            data = b''.join(format_change(*change) for change in changes if change[3] > client.version)
+            client.version = self.version
+            if data:
+                self._send(client, data)
+
+    def _changes(self, db_manager, since, limit=-1):
+        cursor = db_manager.conn.cursor()
+        cursor.execute("SELECT entity, entity_id, op, version FROM changes WHERE version > ? ORDER BY version LIMIT ?",
+                       (since, limit))
+        return cursor.fetchall()
+
+    def _broadcast(self, data):
+        with self._lock:
+            clients = list(self._clients)
+        for client in clients:
+            self._send(client, data)
+
+    def _send(self, client, data):
+        try:
+            client.sock.sendall(data)
+            return True
+        except OSError:
+            with self._lock:
+                if client in self._clients:
+                    self._clients.remove(client)
+            self._close_socket(client.sock)
+            return False
+
+    @staticmethod
+    def _close_socket(sock):
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        sock.close()
@@ -0,0 +1,158 @@
+import json
+import logging
+import os
+
+from database_manager import COLLECTION_TABLES
+
+logger = logging.getLogger(__name__)
+
+# Bytes read from the file per refill, and documents written per transaction
+READ_CHUNK_SIZE = 64 * 1024
+IMPORT_BATCH_SIZE = 500
+
+# Set in the meta table once the data file next to the database has been imported
+IMPORTED_META_KEY = 'json_store_imported'
+
+
+class _JsonStream:
+    """Incremental reader over a text file for one top-level JSON object.
+
+    Only the current array element (or non-array value) is decoded at a
+    time, so memory use depends on the largest single document rather than
+    on the file size.
+    """
+
+    def __init__(self, fp, chunk_size=READ_CHUNK_SIZE):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self, size=None):
+        if self.eof:
+            return False
+        chunk = self.fp.read(size or self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Next non-whitespace character, without consuming it ('' at end of file)"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} at offset {self.pos} of the buffered input")
+        self.pos += 1
+
+    def value(self):
+        """Decode the next complete JSON value"""
+        self.peek()
+        size = self.chunk_size
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # A number or literal at the very end of the buffer may be cut short
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill(size)
+            size *= 2
+
+
+def iter_json_collections(fp, chunk_size=READ_CHUNK_SIZE):
+    """Yield (key, item) for every element of each top-level array, and
+    (key, value) for top-level values that are not arrays, reading fp lazily."""
+    stream = _JsonStream(fp, chunk_size)
+    stream.expect('{')
+    if stream.peek() == '}':
+        return
+    while True:
+        key = stream.value()
+        stream.expect(':')
+        if stream.peek() == '[':
+            stream.expect('[')
+            if stream.peek() == ']':
+                stream.expect(']')
+            else:
+                while True:
+                    yield key, stream.value()
+                    if stream.peek() == ',':
+                        stream.expect(',')
+                        continue
+                    stream.expect(']')
+                    break
+        else:
+            yield key, stream.value()
+        if stream.peek() == ',':
+            stream.expect(',')
+            continue
+        stream.expect('}')
+        return
+
+
+def import_json_file(db_manager, path, sanitize=None, batch_size=IMPORT_BATCH_SIZE):
+    """Stream a neofocus-data.json file into the database in batches.
+
+    Items are upserted by id, so importing the same file twice is harmless.
+    sanitize, if given, is applied to note content before it is stored.
+    Returns the number of documents imported per collection.
+    """
+    counts = {}
+    batch_name, batch = None, []
+
+    def flush():
+        if batch:
+            start = counts.get(batch_name, 0)
+            db_manager.upsert_collection_items(batch_name, batch, start)
+            counts[batch_name] = start + len(batch)
+            batch.clear()
+
+    with open(path, 'r', encoding='utf-8') as fp:
+        for key, item in iter_json_collections(fp):
+            if key == 'settings':
+                if isinstance(item, dict):
+                    db_manager.save_settings(item)
+                continue
+            if key not in COLLECTION_TABLES and key != 'notes':
+                logger.warning(f"Skipping unknown collection {key!r} in {path}")
+                continue
+            if key == 'notes':
+                if not (isinstance(item, dict) and item.get('id') is not None):
+                    logger.warning(f"Skipping note without an id in {path}")
+                    continue
+                if sanitize:
+                    item['content'] = sanitize(item.get('content') or '')
+            if key != batch_name:
+                flush()
+                batch_name = key
+            batch.append(item)
+            if len(batch) >= batch_size:
+                flush()
+        flush()
+    return counts
+
+
+def migrate_json_store(db_manager, path, sanitize=None):
+    """Import the legacy JSON data file once, the first time the database sees it"""
+    if not os.path.exists(path) or db_manager.get_meta(IMPORTED_META_KEY):
+        return None
+    logger.info(f"Importing {path} into the database")
+    counts = import_json_file(db_manager, path, sanitize=sanitize)
+    db_manager.set_meta(IMPORTED_META_KEY, os.path.abspath(path))
+    logger.info(f"Imported {sum(counts.values())} documents from {path}")
+    return counts
@@ -0,0 +1,190 @@
+import glob
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks for due work
+CHECK_SECONDS = 60
+# Jobs wait until nothing has been committed for IDLE_SECONDS, unless they
+# are already MAX_DEFER_SECONDS past due
+IDLE_SECONDS = 30
+MAX_DEFER_SECONDS = 3600
+BACKUP_INTERVAL_SECONDS = 6 * 3600
+OPTIMIZE_INTERVAL_SECONDS = 3600
+ANALYZE_INTERVAL_SECONDS = 24 * 3600
+# Backups kept in the backup directory; older ones are deleted
+BACKUP_COUNT = 10
+# Free pages tolerated in the file before an incremental vacuum returns them
+VACUUM_MIN_FREE_PAGES = 256
+BACKUP_PREFIX = 'neofocus-'
+
+
+def default_backup_dir(db_path):
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), 'backups')
+
+
+def list_backups(backup_dir):
+    """Backup files in backup_dir, oldest first"""
+    return sorted(glob.glob(os.path.join(glob.escape(backup_dir), BACKUP_PREFIX + '*.db')))
+
+
+def _backup_path(backup_dir):
+    os.makedirs(backup_dir, exist_ok=True)
+    return os.path.join(backup_dir, f"{BACKUP_PREFIX}{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}.db")
+
+
+def backup_database(db_manager, backup_dir=None, keep=BACKUP_COUNT):
+    """Write a timestamped online backup, delete all but the newest keep; returns its path"""
+    backup_dir = backup_dir or default_backup_dir(db_manager.db_path)
+    path = _backup_path(backup_dir)
+    # Written under another name first, so a backup that fails halfway is never listed
+    partial = path + '.partial'
+    db_manager.backup(partial)
+    os.replace(partial, path)
+    for old in list_backups(backup_dir)[:-keep]:
+        os.remove(old)
+    return path
+
+
+def restore_backup(backup_path, db_path, backup_dir=None):
+    """Replace the database at db_path with a backup. Run it while the app is stopped.
+
+    The database being replaced is backed up first; returns that backup's
+    path, or None if there was no database.
+    """
+    if not os.path.isfile(backup_path):
+        raise FileNotFoundError(backup_path)
+    source = sqlite3.connect(backup_path)
+    try:
+        try:
+            check = source.execute("PRAGMA quick_check").fetchone()[0]
+        except sqlite3.DatabaseError as e:
+            check = str(e)
+        if check != 'ok':
+            raise ValueError(f"{backup_path} is not a usable backup: {check}")
+        saved = None
+        if os.path.exists(db_path):
+            current = sqlite3.connect(db_path)
+            try:
+                saved = _backup_path(backup_dir or default_backup_dir(db_path))
+                target = sqlite3.connect(saved)
+                try:
+                    current.backup(target)
+                finally:
+                    target.close()
+            finally:
+                current.close()
+        target = sqlite3.connect(db_path)
+        try:
+            # A WAL-mode destination would require matching page sizes; the
+            # restored header brings WAL mode back
+            target.execute("PRAGMA journal_mode=DELETE")
+            source.backup(target)
+        finally:
+            target.close()
+        return saved
+    finally:
+        source.close()
+
+
+class MaintenanceService:
+    """Backs up and tidies the database from one background thread.
+
+    Backups, PRAGMA optimize with an incremental vacuum, and a daily ANALYZE
+    with note history compaction each run once their interval has passed,
+    when nothing has been committed for IDLE_SECONDS or once they are
+    MAX_DEFER_SECONDS late. The full VACUUM that converts a database created
+    without incremental auto_vacuum blocks writers, so it waits for idle.
+    """
+
+    def __init__(self, database, backup_dir=None, check_interval=CHECK_SECONDS):
+        self.database = database
+        self.backup_dir = backup_dir or default_backup_dir(database.db_path)
+        self.check_interval = check_interval
+        self.started = time.time()
+        self.last_run = {}
+        self.last_write = time.monotonic()
+        self._stop = threading.Event()
+        self._thread = None
+        self._listening_to = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='neofocus-maintenance', daemon=True)
+            self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(5)
+            self._thread = None
+        if self._listening_to is not None:
+            self._listening_to.remove_commit_listener(self.notify)
+            self._listening_to = None
+
+    def notify(self, tables):
+        """Commit listener: push idle-only work back"""
+        self.last_write = time.monotonic()
+
+    def _run(self):
+        while not self._stop.wait(self.check_interval):
+            if not self.database.is_open:
+                continue
+            try:
+                self.run_pending()
+            except Exception as e:
+                logger.error(f"Error running database maintenance: {e}")
+
+    def _db_manager(self):
+        db_manager = self.database.get()
+        if db_manager is not self._listening_to:
+            db_manager.add_commit_listener(self.notify)
+            self._listening_to = db_manager
+        return db_manager
+
+    def _last_run(self, job, interval):
+        if job in self.last_run:
+            return self.last_run[job]
+        if job == 'backup':
+            backups = list_backups(self.backup_dir)
+            if backups:
+                return os.path.getmtime(backups[-1])
+        # Never run in this process: due now, but deferred while the app is busy
+        return self.started - interval
+
+    def run_pending(self, now=None, idle=None):
+        """Run every job that is due; returns the names of those that ran"""
+        db_manager = self._db_manager()
+        now = time.time() if now is None else now
+        if idle is None:
+            idle = time.monotonic() - self.last_write >= IDLE_SECONDS
+        ran = []
+        if idle and db_manager.page_stats()['autoVacuum'] == 0:
+            db_manager.vacuum()
+            logger.info("Converted the database to incremental auto_vacuum")
+            ran.append('vacuum')
+        for job, interval in (('backup', BACKUP_INTERVAL_SECONDS), ('optimize', OPTIMIZE_INTERVAL_SECONDS),
+                              ('analyze', ANALYZE_INTERVAL_SECONDS)):
+            late = now - self._last_run(job, interval) - interval
+            if late >= 0 and (idle or late >= MAX_DEFER_SECONDS):
+                getattr(self, '_' + job)(db_manager)
+                self.last_run[job] = now
+                ran.append(job)
+        return ran
+
+    def _backup(self, db_manager):
+        logger.info(f"Backed up the database to {backup_database(db_manager, self.backup_dir)}")
+
+    def _optimize(self, db_manager):
+        if db_manager.page_stats()['freePages'] >= VACUUM_MIN_FREE_PAGES:
+            db_manager.incremental_vacuum()
+        db_manager.optimize()
+
+    def _analyze(self, db_manager):
+        db_manager.optimize(analyze=True)
+        db_manager.compact_note_revisions()
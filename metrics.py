@@ -0,0 +1,166 @@
+import functools
+import json
+import threading
+import time
+
+# Upper bounds in seconds of the latency histogram buckets (+Inf is implicit)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+HISTOGRAMS = {
+    'neofocus_http_request_duration_seconds': 'Time from reading the request line to the last byte written',
+    'neofocus_db_call_duration_seconds': 'Time spent in each DatabaseManager method, including nested calls',
+    'neofocus_sanitize_duration_seconds': 'Time spent sanitizing note HTML, cache hits included',
+    'neofocus_serialize_duration_seconds': 'Time spent encoding JSON response bodies',
+    'neofocus_compress_duration_seconds': 'Time spent compressing response bodies',
+}
+COUNTERS = {
+    'neofocus_http_requests_total': 'Requests handled, by route, method and status code',
+    'neofocus_http_response_bytes_total': 'Bytes written to clients, headers included',
+}
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            index = len(self.buckets)
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for count in self.counts:
+            total += count
+            yield total
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+class Metrics:
+    """Thread-safe registry of latency histograms and counters.
+
+    Series are keyed by metric name and a sorted tuple of label pairs; they
+    are created on first use, so nothing has to be declared per route.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self.started = time.time()
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def increment(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe_request(self, route, method, status, seconds, bytes_sent):
+        self.observe('neofocus_http_request_duration_seconds', seconds, route=route, method=method)
+        self.increment('neofocus_http_requests_total', route=route, method=method, status=str(status))
+        self.increment('neofocus_http_response_bytes_total', bytes_sent, route=route)
+
+    def time(self, name, **labels):
+        return _Timer(self, name, labels)
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def render_prometheus(self):
+        """All series in the Prometheus text exposition format (version 0.0.4)"""
+        with self._lock:
+            histograms = sorted((key, (list(h.cumulative()), h.sum, h.count)) for key, h in self._histograms.items())
+            counters = sorted(self._counters.items())
+        lines = []
+        for name, help_text in HISTOGRAMS.items():
+            series = [(labels, data) for (series_name, labels), data in histograms if series_name == name]
+            if not series:
+                continue
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+            for labels, (cumulative, total, count) in series:
+                for bound, value in zip(LATENCY_BUCKETS + ('+Inf',), cumulative):
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', bound),))} {value}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+                lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        for name, help_text in COUNTERS.items():
+            series = [(labels, value) for (series_name, labels), value in counters if series_name == name]
+            if not series:
+                continue
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+            lines += [f"{name}{_format_labels(labels)} {value}" for labels, value in series]
+        return '\n'.join(lines) + '\n'
+
+    def to_dict(self):
+        """Summary of every series, for logging"""
+        with self._lock:
+            histograms = [
+                {'name': name, 'labels': dict(labels), 'count': h.count, 'sum': h.sum,
+                 'buckets': dict(zip([str(bound) for bound in LATENCY_BUCKETS] + ['+Inf'], h.cumulative()))}
+                for (name, labels), h in sorted(self._histograms.items())
+            ]
+            counters = [{'name': name, 'labels': dict(labels), 'value': value}
+                        for (name, labels), value in sorted(self._counters.items())]
+        return {'started': self.started, 'dumped': time.time(), 'histograms': histograms, 'counters': counters}
+
+    def dump_json(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+
+class _Timer:
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.name, time.perf_counter() - self.start, **self.labels)
+
+
+def _timed(method, name, label, registry):
+    @functools.wraps(method)
+    def timed(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            (registry or metrics).observe(name, time.perf_counter() - start, method=label)
+    return timed
+
+
+def instrument_methods(cls, name, methods, registry=None):
+    """Wrap the named methods of cls so each call is observed in histogram name"""
+    for method_name in methods:
+        setattr(cls, method_name, _timed(getattr(cls, method_name), name, method_name, registry))
+    return cls
+
+
+# Process-wide registry shared by the server and DatabaseManager
+metrics = Metrics()
@@ -0,0 +1,66 @@
+import json
+import zlib
+
+# Every SNAPSHOT_INTERVAL-th stored revision of a note holds its full content;
+# the ones in between hold a delta from the revision before them, so
+# rebuilding any revision applies at most SNAPSHOT_INTERVAL - 1 deltas
+SNAPSHOT_INTERVAL = 20
+COMPRESSION_LEVEL = 6
+
+# Retention: every revision younger than KEEP_ALL_SECONDS is kept, then the
+# last one per hour up to KEEP_HOURLY_SECONDS, then the last one per day. The
+# newest revision is always kept, and no note keeps more than MAX_REVISIONS.
+KEEP_ALL_SECONDS = 24 * 3600
+KEEP_HOURLY_SECONDS = 30 * 24 * 3600
+MAX_REVISIONS = 500
+
+
+def encode_snapshot(content):
+    return zlib.compress(content.encode('utf-8'), COMPRESSION_LEVEL)
+
+
+def encode_delta(old, new):
+    """Compressed delta turning old into new.
+
+    Autosave revisions usually differ by one edited region, so the delta is
+    the lengths of the shared prefix and suffix plus the text between them.
+    """
+    limit = min(len(old), len(new))
+    prefix = 0
+    while prefix < limit and old[prefix] == new[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < limit - prefix and old[-1 - suffix] == new[-1 - suffix]:
+        suffix += 1
+    middle = new[prefix:len(new) - suffix]
+    return zlib.compress(json.dumps([prefix, suffix, middle], ensure_ascii=False).encode('utf-8'), COMPRESSION_LEVEL)
+
+
+def apply_delta(old, delta):
+    prefix, suffix, middle = json.loads(zlib.decompress(delta).decode('utf-8'))
+    return old[:prefix] + middle + old[len(old) - suffix:]
+
+
+def decode_snapshot(data):
+    return zlib.decompress(data).decode('utf-8')
+
+
+def revisions_to_keep(revisions, now):
+    """Revision numbers to keep from (revision, saved_at) pairs in ascending order"""
+    if not revisions:
+        return set()
+    kept = {}
+    for revision, saved_at in revisions:
+        age = now - saved_at
+        if age < KEEP_ALL_SECONDS:
+            bucket = ('all', revision)
+        elif age < KEEP_HOURLY_SECONDS:
+            bucket = ('hour', int(saved_at // 3600))
+        else:
+            bucket = ('day', int(saved_at // 86400))
+        # Later revisions overwrite earlier ones, keeping the last of each bucket
+        kept[bucket] = revision
+    kept = sorted(kept.values())
+    kept = set(kept[-MAX_REVISIONS:])
+    kept.add(revisions[-1][0])
+    return kept
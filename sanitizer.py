@@ -0,0 +1,92 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import bleach
+
+from metrics import instrument_methods
+
+# Markup the notebook editor produces; everything else is escaped
+NOTE_ALLOWED_TAGS = frozenset(bleach.sanitizer.ALLOWED_TAGS) | {
+    'p', 'h1', 'h2', 'h3', 'strong', 'em', 'u', 's', 'ul', 'ol', 'li', 'blockquote', 'pre', 'a', 'br',
+}
+NOTE_ALLOWED_ATTRIBUTES = {'a': ['href']}
+
+# Bounds for the sanitized-content cache
+SANITIZE_CACHE_ENTRIES = 256
+SANITIZE_CACHE_BYTES = 32 * 1024 * 1024
+
+
+class NoteSanitizer:
+    """Sanitizes note HTML with one policy, caching results by content hash.
+
+    Autosave resends the same body many times while a note is open, so an
+    unchanged body is looked up instead of being parsed by bleach again.
+    bleach.Cleaner keeps parser state and is not thread-safe, so each server
+    thread builds its own Cleaner once and reuses it.
+    """
+
+    def __init__(self, max_entries=SANITIZE_CACHE_ENTRIES, max_bytes=SANITIZE_CACHE_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # digest -> (sanitized content, seconds it took to sanitize)
+        self._cache = OrderedDict()
+        self._cache_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.time_spent = 0.0
+        self.time_saved = 0.0
+
+    def _cleaner(self):
+        cleaner = getattr(self._local, 'cleaner', None)
+        if cleaner is None:
+            cleaner = bleach.Cleaner(tags=NOTE_ALLOWED_TAGS, attributes=NOTE_ALLOWED_ATTRIBUTES)
+            self._local.cleaner = cleaner
+        return cleaner
+
+    def clean(self, content):
+        if not content:
+            return ''
+        key = hashlib.blake2b(content.encode('utf-8'), digest_size=16).digest()
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                self.time_saved += entry[1]
+                return entry[0]
+
+        start = time.perf_counter()
+        cleaned = self._cleaner().clean(content)
+        elapsed = time.perf_counter() - start
+
+        size = len(cleaned)
+        with self._lock:
+            self.misses += 1
+            self.time_spent += elapsed
+            if size <= self.max_bytes and key not in self._cache:
+                self._cache[key] = (cleaned, elapsed)
+                self._cache_bytes += size
+                while len(self._cache) > self.max_entries or self._cache_bytes > self.max_bytes:
+                    _, (evicted, _) = self._cache.popitem(last=False)
+                    self._cache_bytes -= len(evicted)
+        return cleaned
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hitRate': self.hits / lookups if lookups else 0.0,
+                'entries': len(self._cache),
+                'bytes': self._cache_bytes,
+                'timeSpentMs': round(self.time_spent * 1000, 3),
+                'timeSavedMs': round(self.time_saved * 1000, 3),
+            }
+
+
+instrument_methods(NoteSanitizer, 'neofocus_sanitize_duration_seconds', ['clean'])
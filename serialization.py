@@ -0,0 +1,74 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Rows encoded per dumps call when streaming a JSON array
+STREAM_BATCH_ROWS = 200
+
+
+def dumps(data):
+    """Encode data as compact UTF-8 JSON bytes, with orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class RowMapper:
+    """Turns positional rows from a fixed column list into dicts.
+
+    Columns listed in json_columns hold JSON text (e.g. aggregated tags) and
+    are decoded; bool_columns are SQLite 0/1 integers returned as booleans.
+    """
+
+    def __init__(self, columns, json_columns=(), bool_columns=()):
+        self.columns = tuple(columns)
+        self.json_indexes = [self.columns.index(column) for column in json_columns]
+        self.bool_indexes = [self.columns.index(column) for column in bool_columns]
+
+    def __call__(self, row):
+        if self.json_indexes or self.bool_indexes:
+            row = list(row)
+            for index in self.json_indexes:
+                row[index] = json.loads(row[index]) if row[index] is not None else None
+            for index in self.bool_indexes:
+                row[index] = bool(row[index]) if row[index] is not None else None
+        return dict(zip(self.columns, row))
+
+    @property
+    def select_list(self):
+        return ', '.join(self.columns)
+
+
+def iter_json_array(items, batch_rows=STREAM_BATCH_ROWS):
+    """Encode an iterable as a JSON array piece by piece.
+
+    Each yielded chunk holds up to batch_rows elements, so only one batch is
+    held in memory at a time and the encoder runs once per batch, not per row.
+    """
+    yield b'['
+    first = True
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_rows:
+            yield (b'' if first else b',') + dumps(batch)[1:-1]
+            first = False
+            batch = []
+    if batch:
+        yield (b'' if first else b',') + dumps(batch)[1:-1]
+    yield b']'
+
+
+def iter_ndjson(items, batch_rows=STREAM_BATCH_ROWS):
+    """Encode an iterable as newline-delimited JSON, one element per line"""
+    batch = []
+    for item in items:
+        batch.append(dumps(item))
+        if len(batch) >= batch_rows:
+            yield b'\n'.join(batch) + b'\n'
+            batch = []
+    if batch:
+        yield b'\n'.join(batch) + b'\n'
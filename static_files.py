@@ -0,0 +1,185 @@
+import gzip
+import os
+import threading
+import zlib
+from collections import OrderedDict
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Content-Encoding -> suffix of the precompressed sibling, in server preference order
+ENCODING_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+# Text assets worth compressing; images and fonts are already compressed
+PRECOMPRESS_EXTENSIONS = {'.html', '.js', '.css', '.json', '.txt', '.svg', '.map', '.xml', '.ico', '.webmanifest'}
+MIN_PRECOMPRESS_BYTES = 1024
+
+# Bounds for the in-memory copy of frequently served files
+STATIC_CACHE_BYTES = 32 * 1024 * 1024
+STATIC_CACHE_FILE_BYTES = 1024 * 1024
+
+
+def accepted_encodings(accept_encoding):
+    """Encodings from an Accept-Encoding header the client accepts (q > 0)"""
+    accepted = set()
+    for part in (accept_encoding or '').split(','):
+        name, _, params = part.strip().partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name and quality > 0:
+            accepted.add(name.strip().lower())
+    if '*' in accepted:
+        accepted.update(ENCODING_SUFFIXES)
+    return accepted
+
+
+def find_precompressed(path, stat, accept_encoding):
+    """Return (encoding, path, stat) of the best sibling the client accepts, or
+    (None, path, stat) when it should get the file as is.
+
+    Siblings older than the file are ignored so a stale build never wins.
+    """
+    accepted = accepted_encodings(accept_encoding)
+    for encoding, suffix in ENCODING_SUFFIXES.items():
+        if encoding not in accepted:
+            continue
+        try:
+            sibling_stat = os.stat(path + suffix)
+        except OSError:
+            continue
+        if sibling_stat.st_mtime_ns >= stat.st_mtime_ns:
+            return encoding, path + suffix, sibling_stat
+    return None, path, stat
+
+
+def compress(data, encoding, level=None):
+    """Compress data for a Content-Encoding; level defaults to the smallest output"""
+    if encoding == 'br':
+        return brotli.compress(data, quality=11 if level is None else level)
+    return gzip.compress(data, compresslevel=9 if level is None else level, mtime=0)
+
+
+class StreamCompressor:
+    """Incremental compressor for a response body sent in chunks"""
+
+    def __init__(self, encoding, level=None):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._compressor = brotli.Compressor(quality=11 if level is None else level)
+        else:
+            # wbits=31 writes a gzip header and trailer around the deflate stream
+            self._compressor = zlib.compressobj(9 if level is None else level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        if self.encoding == 'br':
+            return self._compressor.process(data)
+        return self._compressor.compress(data)
+
+    def flush(self):
+        if self.encoding == 'br':
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+
+def encoded_etag(etag, encoding):
+    """Strong ETag of the encoding's representation of a resource"""
+    return f'{etag[:-1]}-{encoding}"' if encoding else etag
+
+
+def precompress_directory(root, min_size=MIN_PRECOMPRESS_BYTES):
+    """Write .br and .gz siblings next to each compressible file under root.
+
+    Up-to-date siblings are left alone, and a sibling is only kept when it is
+    meaningfully smaller than the original. Brotli output is skipped if the
+    brotli package is not installed. Returns the number of files written.
+    """
+    encodings = [encoding for encoding in ENCODING_SUFFIXES if encoding != 'br' or brotli is not None]
+    written = 0
+    for directory, _, files in os.walk(root):
+        for name in files:
+            if os.path.splitext(name)[1].lower() not in PRECOMPRESS_EXTENSIONS:
+                continue
+            path = os.path.join(directory, name)
+            stat = os.stat(path)
+            if stat.st_size < min_size:
+                continue
+            data = None
+            for encoding in encodings:
+                target = path + ENCODING_SUFFIXES[encoding]
+                if os.path.exists(target) and os.stat(target).st_mtime_ns >= stat.st_mtime_ns:
+                    continue
+                if data is None:
+                    with open(path, 'rb') as f:
+                        data = f.read()
+                compressed = compress(data, encoding)
+                if len(compressed) > len(data) * 0.9:
+                    continue
+                with open(target, 'wb') as f:
+                    f.write(compressed)
+                written += 1
+    return written
+
+
+class StaticFileCache:
+    """LRU cache of hot static files' bytes, keyed by path and validated by stat.
+
+    A file is only read into memory the second time it is requested; one-off
+    requests are streamed from disk instead. Entries are checked against the
+    file's mtime and size on every lookup, so a rebuilt export is picked up
+    without restarting the server.
+    """
+
+    def __init__(self, max_bytes=STATIC_CACHE_BYTES, max_file_bytes=STATIC_CACHE_FILE_BYTES, max_tracked=1024):
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self.max_tracked = max_tracked
+        self._lock = threading.Lock()
+        # path -> ((mtime_ns, size), bytes)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        # path -> (mtime_ns, size) of files requested once but not cached yet
+        self._seen = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path, stat):
+        """Return (cached bytes or None, whether the file is hot enough to cache)"""
+        key = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == key:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry[1], False
+            self.misses += 1
+            hot = self._seen.pop(path, None) == key
+            if not hot:
+                self._seen[path] = key
+                if len(self._seen) > self.max_tracked:
+                    self._seen.popitem(last=False)
+            return None, hot and stat.st_size <= self.max_file_bytes
+
+    def put(self, path, stat, data):
+        if len(data) > self.max_file_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(path, None)
+            if previous is not None:
+                self._bytes -= len(previous[1])
+            self._entries[path] = ((stat.st_mtime_ns, stat.st_size), data)
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries), 'bytes': self._bytes}
@@ -6,6 +6,7 @@ Simple test script to verify the application loads correctly
 import webview
 import os
 import sys
+import tempfile
 import time
 from database_manager import DatabaseManager
 
@@ -18,7 +19,7 @@ def test_application():
     try:
         # Test database manager
         print("📊 Testing database manager...")
-        db_manager = DatabaseManager()
+        db_manager = DatabaseManager(os.path.join(tempfile.mkdtemp(), 'neofocus.db'))
         data = db_manager.get_all_data()
         print(f"✅ Database loaded successfully with {len(data.get('events', []))} events")
         
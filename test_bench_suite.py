@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+"""
+Smoke test for the benchmark harness at a tiny size
+"""
+
+import json
+
+import bench_suite
+
+
+def test_bench_suite_writes_comparable_results(tmp_path):
+    output = tmp_path / 'bench.json'
+    args = ['--sizes', '30', '--requests', '4', '--concurrency', '2', '--single-inserts', '2',
+            '--sanitize-notes', '1', '--output', str(output)]
+    assert bench_suite.main(args) == 0
+
+    report = json.loads(output.read_text())
+    groups = {entry['group'] for entry in report['results']}
+    assert groups == {'sanitize', 'bulk_insert', 'route', 'single_insert'}
+    routes = [entry for entry in report['results'] if entry['group'] == 'route']
+    assert all(entry['errors'] == 0 and entry['rps'] > 0 for entry in routes)
+    assert 'GET /api/notes/search?q=quarterly%20plan' in {entry['name'] for entry in routes}
+
+    # A baseline that was ten times faster flags every route as a regression
+    faster = dict(report, results=[dict(entry, value=entry['value'] / 10) for entry in routes])
+    assert len(bench_suite.compare(faster, report, threshold=1.25)) == len(routes)
+    assert bench_suite.compare(report, report, threshold=1.25) == []
@@ -0,0 +1,654 @@
+#!/usr/bin/env python3
+"""
+Tests for DatabaseManager against a scratch SQLite database
+"""
+
+import os
+import shutil
+import sqlite3
+import threading
+
+import pytest
+
+from database_manager import DatabaseManager, DatabaseService
+
+
+def make_note(note_id, title='Note', updated_at='2025-01-01T00:00:00.000Z', **extra):
+    note = {
+        'id': note_id, 'title': title, 'content': '<p>body</p>', 'tags': ['work'],
+        'category': 'general', 'createdAt': updated_at, 'updatedAt': updated_at,
+    }
+    note.update(extra)
+    return note
+
+
+@pytest.fixture
+def db(tmp_path):
+    manager = DatabaseManager(str(tmp_path / 'neofocus.db'))
+    yield manager
+    manager.close()
+
+
+def test_uses_wal_journal(db):
+    assert db.conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+
+
+def test_each_thread_gets_its_own_connection(db):
+    seen = []
+    thread = threading.Thread(target=lambda: seen.append(db.conn))
+    thread.start()
+    thread.join()
+    assert seen[0] is not db.conn
+
+
+def test_readers_do_not_wait_for_writer(db):
+    db.add_note(make_note('existing'))
+    writer_started = threading.Event()
+    release_writer = threading.Event()
+
+    def slow_writer():
+        with db.transaction() as cursor:
+            cursor.execute("UPDATE notes SET title='changed' WHERE id='existing'")
+            writer_started.set()
+            release_writer.wait(5)
+
+    writer = threading.Thread(target=slow_writer)
+    writer.start()
+    try:
+        assert writer_started.wait(5)
+        # The write transaction is still open; a reader sees the last commit
+        assert [row[1] for row in db.get_notes()] == ['Note']
+    finally:
+        release_writer.set()
+        writer.join()
+    assert [row[1] for row in db.get_notes()] == ['changed']
+
+
+def test_failed_write_rolls_back(db):
+    db.add_note(make_note('dup'))
+    with pytest.raises(Exception):
+        db.add_note(make_note('dup'))
+    # The connection is usable again and no transaction is left open
+    db.add_note(make_note('other'))
+    assert not db.conn.in_transaction
+
+
+def test_concurrent_writes_all_land(db):
+    def add_tasks(n):
+        for i in range(20):
+            db.add_task(f"task {n}-{i}", 'work', None, None)
+
+    threads = [threading.Thread(target=add_tasks, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(db.get_tasks()) == 160
+
+
+def test_task_filters_and_keyset(db):
+    first = db.add_task('write report', 'work', None, None)
+    db.add_task('buy milk', 'home', None, None)
+    third = db.add_task('review PR', 'work', None, None)
+    db.update_task(third, 'review PR', True, 'work', None, None)
+
+    assert [t[0] for t in db.get_tasks(category='work')] == [first, third]
+    assert [t[0] for t in db.get_tasks(category='work', completed=True)] == [third]
+    assert [t[0] for t in db.get_tasks(category='work', after=first)] == [third]
+    assert len(db.get_tasks(limit=2)) == 2
+
+
+def test_calendar_events_date_range(db):
+    db.add_calendar_event('standup', '2025-03-01', '09:00', 'work', None)
+    march = db.add_calendar_event('retro', '2025-03-15', '15:00', 'work', None)
+    db.add_calendar_event('holiday', '2025-04-01', None, 'personal', None)
+
+    in_march = db.get_calendar_events(date_from='2025-03-01', date_to='2025-03-31')
+    assert [e[1] for e in in_march] == ['standup', 'retro']
+    assert [e[0] for e in db.get_calendar_events(after=('2025-03-01', 1), date_to='2025-03-31')] == [march]
+
+
+def test_search_notes_strips_html_and_ranks_titles_first(db):
+    db.add_note(make_note('body-hit', title='Groceries', content='<p>remember the <strong>quarterly</strong> report</p>'))
+    db.add_note(make_note('title-hit', title='Quarterly planning', content='<p>goals</p>'))
+    db.add_note(make_note('miss', title='Unrelated', content='<p>nothing here</p>'))
+
+    results = db.search_notes('quarterly')
+    assert [r['id'] for r in results] == ['title-hit', 'body-hit']
+    assert '<strong>' not in results[1]['snippet']
+    assert '<mark>quarterly</mark>' in results[1]['snippet']
+    # Prefix match on the last word
+    assert [r['id'] for r in db.search_notes('plan')] == ['title-hit']
+
+
+def test_search_index_follows_updates_and_deletes(db):
+    db.add_note(make_note('n1', content='<p>alpha</p>'))
+    db.update_note(make_note('n1', content='<p>beta &amp; gamma</p>'))
+    assert db.search_notes('alpha') == []
+    assert [r['id'] for r in db.search_notes('gamma')] == ['n1']
+    db.delete_note('n1')
+    assert db.search_notes('gamma') == []
+
+
+def test_search_index_rebuild(db):
+    db.add_note(make_note('n1', content='<p>delta</p>'))
+    with db.transaction() as cursor:
+        cursor.execute("DELETE FROM notes_fts")
+    assert db.search_notes('delta') == []
+    assert db.rebuild_search_index() == 1
+    assert [r['id'] for r in db.search_notes('delta')] == ['n1']
+
+
+def test_tags_are_normalized_and_filterable(db):
+    db.add_note(make_note('a', tags=['work', ' urgent ', 'work', '']))
+    db.add_note(make_note('b', tags=['work']))
+    db.update_note(make_note('b', tags=['home']))
+
+    assert [row[0] for row in db.get_notes(tag='work')] == ['a']
+    assert db.get_tag_counts() == [{'tag': 'home', 'count': 1}, {'tag': 'urgent', 'count': 1}, {'tag': 'work', 'count': 1}]
+    db.delete_note('a')
+    assert db.get_tag_counts() == [{'tag': 'home', 'count': 1}]
+
+
+def test_opens_the_shipped_legacy_database(tmp_path):
+    path = str(tmp_path / 'neofocus.db')
+    shutil.copy(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'neofocus.db'), path)
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT INTO notes (title, content, tags, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                 ('Old', '<p>kept</p>', '["a", "b"]', '2024-05-01 10:00:00', '2024-05-02 11:00:00'))
+    conn.execute("INSERT INTO tasks (title, status, category) VALUES ('Done', 'completed', 'work')")
+    conn.commit()
+    conn.close()
+
+    db = DatabaseManager(path)
+    try:
+        assert db.get_notes() == [('1', 'Old', '<p>kept</p>', '["a","b"]', None,
+                                   '2024-05-01T10:00:00.000Z', '2024-05-02T11:00:00.000Z')]
+        assert db.get_tasks() == [(1, 'Done', 1, 'work', None, None)]
+        assert [r['id'] for r in db.search_notes('kept')] == ['1']
+        tables = {row[0] for row in db.conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        assert 'legacy_notes' not in tables and 'legacy_tasks' not in tables
+    finally:
+        db.close()
+
+
+def test_interrupted_legacy_upgrade_leaves_the_old_tables_to_retry(tmp_path, monkeypatch):
+    path = str(tmp_path / 'neofocus.db')
+    shutil.copy(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'neofocus.db'), path)
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT INTO notes (title, content, created_at, updated_at) VALUES ('Old', 'kept', "
+                 "'2024-05-01 10:00:00', '2024-05-01 10:00:00')")
+    conn.commit()
+    conn.close()
+
+    def fail(value):
+        raise RuntimeError('copy failed')
+    monkeypatch.setattr('database_manager.legacy_timestamp', fail)
+    with pytest.raises(RuntimeError):
+        DatabaseManager(path)
+    monkeypatch.undo()
+
+    conn = sqlite3.connect(path)
+    assert conn.execute("SELECT title FROM notes").fetchall() == [('Old',)]
+    # An older build could stop halfway with the legacy tables already renamed
+    conn.execute("ALTER TABLE notes RENAME TO legacy_notes")
+    conn.commit()
+    conn.close()
+
+    db = DatabaseManager(path)
+    try:
+        assert [(n[0], n[1], n[2]) for n in db.get_notes()] == [('1', 'Old', 'kept')]
+        tables = {row[0] for row in db.conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        assert 'legacy_notes' not in tables and 'legacy_tasks' not in tables
+    finally:
+        db.close()
+
+
+def test_migrates_comma_joined_tags(tmp_path):
+    path = str(tmp_path / 'legacy.db')
+    conn = sqlite3.connect(path)
+    conn.execute('''
+        CREATE TABLE notes (id TEXT PRIMARY KEY, title TEXT NOT NULL, content TEXT, tags TEXT,
+                            category TEXT, createdAt TEXT NOT NULL, updatedAt TEXT NOT NULL)
+    ''')
+    conn.execute("INSERT INTO notes VALUES ('old', 'Old note', '<p>text</p>', 'ideas,work', NULL, 'x', 'x')")
+    conn.commit()
+    conn.close()
+
+    manager = DatabaseManager(path)
+    try:
+        assert [row[3] for row in manager.get_notes()] == ['["ideas","work"]']
+        assert [row[0] for row in manager.get_notes(tag='ideas')] == ['old']
+        assert manager.conn.execute("SELECT tags FROM notes").fetchone()[0] is None
+        assert [r['id'] for r in manager.search_notes('ideas')] == ['old']
+    finally:
+        manager.close()
+
+
+
+def test_calendar_occurrences_expand_repeating_events(db):
+    once = db.add_calendar_event('dentist', '2025-03-10', '10:00', 'personal', None)
+    before = db.add_calendar_event('old', '2025-02-10', None, 'personal', None)
+    weekly = db.add_calendar_event('standup', '2025-02-24', '09:00', 'work', 'Weekly')
+    monthly = db.add_calendar_event('rent', '2025-01-31', None, 'home', 'monthly')
+    db.add_calendar_event('later', '2025-04-01', None, 'work', 'daily')
+
+    march = db.get_calendar_occurrences('2025-03-01', '2025-03-31')
+    assert [(e['id'], e['date']) for e in march] == [
+        (weekly, '2025-03-03'), (weekly, '2025-03-10'), (once, '2025-03-10'), (weekly, '2025-03-17'),
+        (weekly, '2025-03-24'), (monthly, '2025-03-31'), (weekly, '2025-03-31'),
+    ]
+    assert march[0]['seriesDate'] == '2025-02-24'
+    assert before not in {e['id'] for e in march}
+    # February has no 31st, so the monthly event skips it
+    assert [e['id'] for e in db.get_calendar_occurrences('2025-02-01', '2025-02-28', category='home')] == []
+
+
+def test_calendar_occurrence_cache_follows_updates_and_deletes(db):
+    event_id = db.add_calendar_event('gym', '2025-03-03', '07:00', 'health', 'weekly')
+    assert len(db.get_calendar_occurrences('2025-03-01', '2025-03-31')) == 5
+    db.update_calendar_event(event_id, 'gym', '2025-03-03', '07:00', 'health', 'daily')
+    assert len(db.get_calendar_occurrences('2025-03-01', '2025-03-31')) == 29
+    db.delete_calendar_event(event_id)
+    assert db.get_calendar_occurrences('2025-03-01', '2025-03-31') == []
+    assert db._recurrence_cache == {}
+
+def test_changes_since_version(db):
+    db.add_note(make_note('n1'))
+    task_id = db.add_task('task', None, None, None)
+    version, _ = db.get_changes(0)
+
+    db.update_note(make_note('n1', title='edited'))
+    db.update_note(make_note('n1', title='edited again'))
+    db.delete_task(task_id)
+    event_id = db.add_calendar_event('event', '2025-05-01', None, None, None)
+
+    new_version, changes = db.get_changes(version)
+    assert new_version == version + 4
+    assert [row[1] for row in changes['notes']['upserted']] == ['edited again']
+    assert changes['tasks'] == {'upserted': [], 'deleted': [task_id]}
+    assert [row[0] for row in changes['calendar_events']['upserted']] == [event_id]
+    assert db.get_changes(new_version)[1]['notes'] == {'upserted': [], 'deleted': []}
+
+
+def test_existing_rows_are_seeded_into_change_log(tmp_path):
+    path = str(tmp_path / 'legacy.db')
+    conn = sqlite3.connect(path)
+    conn.execute('''
+        CREATE TABLE tasks (id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT NOT NULL, completed BOOLEAN NOT NULL,
+                            category TEXT, startTime TEXT, endTime TEXT)
+    ''')
+    conn.execute("INSERT INTO tasks (title, completed) VALUES ('old task', 0)")
+    conn.commit()
+    conn.close()
+
+    manager = DatabaseManager(path)
+    try:
+        version, changes = manager.get_changes(0)
+        assert version == 1
+        assert [row[1] for row in changes['tasks']['upserted']] == ['old task']
+    finally:
+        manager.close()
+
+
+def test_bulk_inserts_return_ids_in_order(db):
+    ids = db.bulk_add_tasks([{'title': f"task {i}"} for i in range(50)])
+    assert [t[0] for t in db.get_tasks()] == ids
+    assert [t[1] for t in db.get_tasks()][:2] == ['task 0', 'task 1']
+    event_ids = db.bulk_add_calendar_events([{'title': 'a', 'date': '2025-06-01'}, {'title': 'b', 'date': '2025-06-02'}])
+    assert [e[0] for e in db.get_calendar_events()] == event_ids
+
+
+def test_nested_transaction_rolls_back_everything(db):
+    with pytest.raises(sqlite3.IntegrityError):
+        with db.transaction():
+            db.add_task('kept?', None, None, None)
+            db.bulk_add_notes([make_note('same'), make_note('same')])
+    assert db.get_tasks() == []
+    assert db.get_notes() == []
+
+
+def test_save_all_data_rewrites_only_changed_rows(db):
+    data = {
+        'notes': [make_note('n1'), make_note('n2')],
+        'tasks': [{'id': 't1', 'title': 'one'}, {'id': 't2', 'title': 'two'}],
+        'settings': {'theme': 'light'},
+    }
+    db.save_all_data(data)
+    before = db.get_version()
+
+    data['tasks'][1]['title'] = 'two, edited'
+    data['notes'] = [make_note('n1')]
+    db.save_all_data(data)
+
+    version, changes = db.get_changes(before)
+    assert version == before + 1
+    assert changes['notes'] == {'upserted': [], 'deleted': ['n2']}
+    stored = db.get_all_data()
+    assert [t['title'] for t in stored['tasks']] == ['one', 'two, edited']
+    assert [n['id'] for n in stored['notes']] == ['n1']
+    assert stored['settings']['theme'] == 'light'
+    assert db.conn.execute("SELECT COUNT(*) FROM store_tasks").fetchone()[0] == 2
+
+
+def test_etag_changes_only_after_committed_writes(db):
+    notes_etag, tasks_etag = db.get_etag(['notes']), db.get_etag(['tasks'])
+    db.add_note(make_note('n1'))
+    assert db.get_etag(['notes']) != notes_etag
+    assert db.get_etag(['tasks']) == tasks_etag
+
+    notes_etag = db.get_etag(['notes'])
+    with pytest.raises(sqlite3.IntegrityError):
+        db.add_note(make_note('n1'))
+    assert db.get_etag(['notes']) == notes_etag
+
+    # Saving an unchanged snapshot writes nothing, so cached responses stay valid
+    db.save_all_data({'notes': [make_note('n1')], 'goals': [{'id': 1}], 'settings': {'theme': 'dark'}})
+    snapshot_etag = db.get_etag(['notes', 'store_goals', 'store_settings'])
+    db.save_all_data({'notes': [make_note('n1')], 'goals': [{'id': 1}], 'settings': {'theme': 'dark'}})
+    assert db.get_etag(['notes', 'store_goals', 'store_settings']) == snapshot_etag
+
+
+def test_iter_methods_stream_the_same_rows(db):
+    db.bulk_add_notes([make_note(f"n{i:04d}", updated_at=f"2025-01-01T00:{i // 60:02d}:{i % 60:02d}.000Z") for i in range(600)])
+    db.bulk_add_tasks([{'title': f"task {i}", 'category': 'even' if i % 2 else 'odd'} for i in range(10)])
+
+    rows = db.iter_notes(category='general')
+    assert not isinstance(rows, list)
+    assert list(rows) == db.get_notes(category='general')
+    assert list(db.iter_tasks(category='even')) == db.get_tasks(category='even')
+    assert list(db.iter_calendar_events()) == []
+
+
+def test_database_service_opens_once_across_threads(tmp_path):
+    opened = []
+    service = DatabaseService(str(tmp_path / 'neofocus.db'), on_open=opened.append)
+    managers = []
+    threads = [threading.Thread(target=lambda: managers.append(service.get())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    try:
+        assert len(opened) == 1
+        assert all(manager is opened[0] for manager in managers)
+        assert service.ready.is_set()
+    finally:
+        service.close()
+    assert not service.is_open
+
+
+def test_database_service_records_open_errors(tmp_path):
+    (tmp_path / 'missing').write_text('not a directory')
+    service = DatabaseService(str(tmp_path / 'missing' / 'neofocus.db'))
+    with pytest.raises(sqlite3.Error):
+        service.get()
+    assert service.ready.is_set()
+    assert service.error is not None and not service.is_open
+
+
+def test_analytics_rollups_follow_collection_writes(db):
+    tasks = [
+        {'id': 't1', 'title': 'a', 'completed': True, 'priority': 'high', 'dueDate': '2025-05-01', 'createdAt': '2025-04-30T10:00:00.000Z'},
+        {'id': 't2', 'title': 'b', 'completed': False, 'priority': 'high', 'dueDate': '2025-05-01', 'createdAt': '2025-04-30T10:00:00.000Z'},
+        {'id': 't3', 'title': 'c', 'completed': False, 'priority': 'low', 'dueDate': '', 'createdAt': '2025-05-02T08:00:00.000Z'},
+    ]
+    sessions = [
+        {'id': 'f1', 'title': 'deep work', 'duration': 25, 'status': 'completed', 'startTime': '2025-05-01T09:00:00.000Z', 'createdAt': '2025-05-01T09:00:00.000Z'},
+        {'id': 'f2', 'title': 'deep work', 'duration': 10, 'status': 'interrupted', 'createdAt': '2025-05-01T11:00:00.000Z'},
+    ]
+    db.save_all_data({'tasks': tasks, 'focusSessions': sessions,
+                      'habits': [{'id': 'h1', 'name': 'read', 'streak': 3, 'longestStreak': 7}]})
+    analytics = db.get_analytics('2025-05-01', '2025-05-31')
+    assert (analytics['tasks']['total'], analytics['tasks']['completed']) == (3, 1)
+    # Frontend tasks carry a priority but no category
+    assert analytics['tasks']['byCategory'] == [{'category': '', 'total': 3, 'completed': 1, 'completionRate': 0.3333}]
+    assert analytics['tasks']['byPriority'] == [
+        {'priority': 'high', 'total': 2, 'completed': 1, 'completionRate': 0.5},
+        {'priority': 'low', 'total': 1, 'completed': 0, 'completionRate': 0.0},
+    ]
+    assert analytics['focus']['byDay'] == [{'date': '2025-05-01', 'sessions': 2, 'completed': 1, 'minutes': 35}]
+    assert analytics['habits'] == [{'id': 'h1', 'name': 'read', 'streak': 3, 'longestStreak': 7}]
+
+    # Completing a task, moving one to another day and dropping a session adjust the rollups in place
+    tasks[1] = dict(tasks[1], completed=True)
+    tasks[2] = dict(tasks[2], dueDate='2025-06-01')
+    db.save_all_data({'tasks': tasks, 'focusSessions': sessions[:1]})
+    analytics = db.get_analytics('2025-05-01', '2025-05-31')
+    assert analytics['tasks']['byDay'] == [{'date': '2025-05-01', 'total': 2, 'completed': 2}]
+    assert (analytics['focus']['sessions'], analytics['focus']['minutes']) == (1, 25)
+
+    rows = lambda: db.conn.execute("SELECT * FROM analytics_task_days ORDER BY day, category, priority").fetchall()
+    incremental = rows()
+    assert db.rebuild_analytics() == 3
+    assert rows() == incremental
+
+
+def test_analytics_count_tasks_from_the_tasks_table(db):
+    db.upsert_collection_items('tasks', [{'id': 't1', 'completed': True, 'priority': 'high', 'dueDate': '2025-05-01'}], 0)
+    first, second = db.bulk_add_tasks([
+        {'title': 'gym', 'category': 'health', 'startTime': '2025-05-01T07:00'},
+        {'title': 'report', 'category': 'work', 'startTime': '2025-05-02T09:00'},
+    ])
+    db.update_task(first, 'gym', True, 'health', '2025-05-01T07:00', None)
+    analytics = db.get_analytics('2025-05-01', '2025-05-31')
+    assert analytics['tasks']['byDay'] == [{'date': '2025-05-01', 'total': 2, 'completed': 2},
+                                           {'date': '2025-05-02', 'total': 1, 'completed': 0}]
+    assert [c['category'] for c in analytics['tasks']['byCategory']] == ['', 'health', 'work']
+    assert [p['priority'] for p in analytics['tasks']['byPriority']] == ['', 'high']
+
+    db.delete_task(second)
+    rows = lambda: db.conn.execute("SELECT * FROM analytics_task_days ORDER BY day, category, priority").fetchall()
+    incremental = rows()
+    assert incremental == [('2025-05-01', '', 'high', 1, 1), ('2025-05-01', 'health', '', 1, 1)]
+    db.rebuild_analytics()
+    assert rows() == incremental
+
+
+def test_existing_collections_are_backfilled_into_rollups(tmp_path):
+    path = str(tmp_path / 'neofocus.db')
+    db = DatabaseManager(path)
+    db.upsert_collection_items('tasks', [{'id': 't1', 'completed': True, 'priority': 'low', 'dueDate': '2025-05-01'}], 0)
+    # The task rollup table as it was before the priority key
+    db.conn.execute("DROP TABLE analytics_task_days")
+    db.conn.execute("CREATE TABLE analytics_task_days (day TEXT NOT NULL, category TEXT NOT NULL, total INTEGER NOT NULL, "
+                    "completed INTEGER NOT NULL, PRIMARY KEY (day, category)) WITHOUT ROWID")
+    db.conn.execute("INSERT INTO analytics_task_days VALUES ('2025-05-01', 'low', 1, 1)")
+    db.conn.execute("PRAGMA user_version = 3")
+    db.conn.commit()
+    db.close()
+
+    db = DatabaseManager(path)
+    try:
+        analytics = db.get_analytics()
+        assert analytics['tasks']['byDay'] == [{'date': '2025-05-01', 'total': 1, 'completed': 1}]
+        assert [(c['category'], p['priority']) for c, p in zip(analytics['tasks']['byCategory'], analytics['tasks']['byPriority'])] == [('', 'low')]
+    finally:
+        db.close()
+
+
+def test_queued_note_updates_are_coalesced(db, monkeypatch):
+    db.add_note(make_note('draft', title='Draft'))
+    commits, cleaned = [], []
+    db.add_commit_listener(commits.append)
+    monkeypatch.setattr('database_manager.NOTE_WRITE_DELAY_SECONDS', 60)
+
+    for i in range(5):
+        db.queue_note_update(make_note('draft', title='Draft', content=f"<p>v{i}</p>"),
+                             sanitize=lambda html: cleaned.append(html) or html)
+    assert commits == []
+    # Reading notes writes the queue first, once, with only the last version
+    assert [n[2] for n in db.get_notes()] == ['<p>v4</p>']
+    assert cleaned == ['<p>v4</p>'] and len(commits) == 1
+    assert db.flush_note_updates() == 0
+
+    with pytest.raises(ValueError):
+        db.queue_note_update({'id': 'draft', 'content': 'no title'})
+
+
+def test_slow_sanitizing_never_overwrites_a_newer_autosave(db, monkeypatch):
+    monkeypatch.setattr('database_manager.NOTE_WRITE_DELAY_SECONDS', 60)
+    db.add_note(make_note('draft', content='<p>v0</p>'))
+    started, release = threading.Event(), threading.Event()
+
+    def slow_sanitize(html):
+        started.set()
+        release.wait(5)
+        return html
+
+    db.queue_note_update(make_note('draft', content='<p>v1</p>'), sanitize=slow_sanitize)
+    flusher = threading.Thread(target=db.flush_note_updates)
+    flusher.start()
+    assert started.wait(5)
+    db.queue_note_update(make_note('draft', content='<p>v2</p>'))
+    # Other writes are not held up while v1 is sanitized
+    db.add_task('unrelated', None, None, None)
+    reads = []
+    reader = threading.Thread(target=lambda: reads.append(db.get_notes()[0][2]))
+    reader.start()
+    release.set()
+    flusher.join(5)
+    reader.join(5)
+    assert reads == ['<p>v2</p>']
+    assert [n[2] for n in db.get_notes()] == ['<p>v2</p>']
+
+
+def test_durable_flush_syncs_updates_the_flusher_already_wrote(db, tmp_path, monkeypatch):
+    monkeypatch.setattr('database_manager.NOTE_WRITE_DELAY_SECONDS', 0.01)
+    db.add_note(make_note('draft', content='<p>old</p>'))
+    written = threading.Event()
+    db.add_commit_listener(lambda tables: written.set())
+    db.queue_note_update(make_note('draft', content='<p>typed</p>'))
+    assert written.wait(5)
+    assert db.flush_note_updates(durable=True) == 0
+    # The database file alone, without its WAL, already holds the update
+    copy = str(tmp_path / 'copy.db')
+    shutil.copy(db.db_path, copy)
+    conn = sqlite3.connect(copy)
+    try:
+        assert conn.execute("SELECT content FROM notes WHERE id = 'draft'").fetchone() == ('<p>typed</p>',)
+    finally:
+        conn.close()
+
+
+def test_queued_note_updates_survive_a_rolled_back_transaction(db, monkeypatch):
+    monkeypatch.setattr('database_manager.NOTE_WRITE_DELAY_SECONDS', 60)
+    db.add_note(make_note('draft', content='<p>old</p>'))
+    db.queue_note_update(make_note('draft', content='<p>typed</p>'))
+    with pytest.raises(sqlite3.IntegrityError):
+        with db.transaction():
+            # Flushes the queue into this transaction, then fails
+            db.bulk_add_notes([make_note('draft')])
+    assert db._queued_notes
+    assert [n[2] for n in db.get_notes()] == ['<p>typed</p>']
+
+
+def test_queued_note_updates_flush_on_timer_and_close(tmp_path, monkeypatch):
+    monkeypatch.setattr('database_manager.NOTE_WRITE_DELAY_SECONDS', 0.05)
+    path = str(tmp_path / 'neofocus.db')
+    db = DatabaseManager(path)
+    db.add_note(make_note('a'))
+    db.add_note(make_note('b'))
+    written = threading.Event()
+    db.add_commit_listener(lambda tables: written.set())
+    db.queue_note_update(make_note('a', content='<p>timer</p>'))
+    assert written.wait(5)
+    monkeypatch.setattr('database_manager.NOTE_WRITE_DELAY_SECONDS', 60)
+    db.queue_note_update(make_note('b', content='<p>shutdown</p>'))
+    db.close()
+
+    db = DatabaseManager(path)
+    try:
+        assert {n[0]: n[2] for n in db.get_notes()} == {'a': '<p>timer</p>', 'b': '<p>shutdown</p>'}
+    finally:
+        db.close()
+
+
+def test_autosave_bursts_share_one_flusher_connection(db, monkeypatch):
+    monkeypatch.setattr('database_manager.NOTE_WRITE_DELAY_SECONDS', 0.01)
+    db.add_note(make_note('typing'))
+    written = threading.Event()
+    db.add_commit_listener(lambda tables: written.set())
+    for i in range(20):
+        written.clear()
+        db.queue_note_update(make_note('typing', content=f"<p>{i}</p>"))
+        assert written.wait(5)
+    # This thread's connection and the flusher's
+    assert len(db._connections) == 2
+
+
+def test_note_revisions_rebuild_every_version(db, monkeypatch):
+    monkeypatch.setattr('database_manager.SNAPSHOT_INTERVAL', 4)
+    versions = ['<p>' + ' '.join(f"w{j * 7919 % 10007}" for j in range(50 * i)) + '</p>' for i in range(1, 11)]
+    db.add_note(make_note('essay', content=versions[0]))
+    for i, content in enumerate(versions[1:], 2):
+        db.update_note(make_note('essay', content=content, updated_at=f"2025-01-{i:02d}T00:00:00.000Z"))
+    # Saving identical content adds no revision
+    db.update_note(make_note('essay', content=versions[-1], updated_at='2025-02-01T00:00:00.000Z'))
+
+    history = db.get_note_revisions('essay')
+    assert [r['revision'] for r in history] == list(range(10, 0, -1))
+    assert [r['revision'] for r in history if r['snapshot']] == [9, 5, 1]
+    for revision, content in enumerate(versions, 1):
+        assert db.get_note_revision('essay', revision)['content'] == content
+    assert db.get_note_revision('essay', 11) is None
+
+    db.delete_note('essay')
+    assert db.get_note_revisions('essay') == []
+
+
+def test_repeated_updates_in_one_call_each_add_a_revision(db):
+    db.add_note(make_note('twice', content='<p>a</p>'))
+    db.bulk_update_notes([make_note('twice', content='<p>ab</p>'), make_note('twice', content='<p>ab</p>'),
+                          make_note('twice', content='<p>abc</p>')])
+    assert [r['revision'] for r in db.get_note_revisions('twice')] == [3, 2, 1]
+    assert [db.get_note_revision('twice', n)['content'] for n in (1, 2, 3)] == ['<p>a</p>', '<p>ab</p>', '<p>abc</p>']
+    assert db.get_note_revision('twice', 10 ** 30) is None
+
+
+def test_note_history_starts_from_existing_content(db):
+    db.add_note(make_note('old', content='<p>before</p>'))
+    with db.transaction() as cursor:
+        cursor.execute("DELETE FROM note_revisions")
+    db.update_note(make_note('old', content='<p>after</p>'))
+    assert [db.get_note_revision('old', n)['content'] for n in (1, 2)] == ['<p>before</p>', '<p>after</p>']
+
+
+def test_compaction_applies_retention_and_keeps_versions_readable(db, monkeypatch):
+    monkeypatch.setattr('database_manager.time.time', lambda: 1000.0)
+    db.add_note(make_note('log', content='<p>0</p>'))
+    for i in range(1, 30):
+        db.update_note(make_note('log', content=f"<p>{i} " + 'y' * i + '</p>'))
+    # A week later the whole burst falls in one hourly bucket
+    assert db.compact_note_revisions(now=1000.0 + 7 * 86400) == 29
+    assert [r['revision'] for r in db.get_note_revisions('log')] == [30]
+    assert db.get_note_revision('log', 30)['content'] == '<p>29 ' + 'y' * 29 + '</p>'
+
+    db.update_note(make_note('log', content='<p>next</p>'))
+    assert db.get_note_revision('log', 31)['content'] == '<p>next</p>'
+
+
+def test_incremental_vacuum_returns_free_pages(db):
+    db.bulk_add_notes([make_note(f"big-{i}", content='<p>' + os.urandom(2000).hex() + '</p>') for i in range(200)])
+    db.bulk_delete_notes([f"big-{i}" for i in range(200)])
+    stats = db.page_stats()
+    assert stats['autoVacuum'] == 2 and stats['freePages'] > 100
+    assert db.incremental_vacuum() == stats['freePages']
+    assert db.page_stats()['freePages'] == 0
+
+
+def test_vacuum_converts_old_files_and_keeps_search_working(tmp_path):
+    path = str(tmp_path / 'old.db')
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE legacy (x)")
+    conn.close()
+    db = DatabaseManager(path)
+    try:
+        db.bulk_add_notes([make_note(f"n{i}", title=f"Note {i}") for i in range(20)])
+        db.bulk_delete_notes([f"n{i}" for i in range(0, 20, 2)])
+        assert db.page_stats()['autoVacuum'] == 0
+        db.vacuum()
+        assert db.page_stats()['autoVacuum'] == 2
+        assert [r['id'] for r in db.search_notes('Note 7')] == ['n7']
+    finally:
+        db.close()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Tests for streaming the legacy JSON data file into SQLite
+"""
+
+import io
+import json
+
+import pytest
+
+from database_manager import DatabaseManager
+from json_importer import import_json_file, iter_json_collections, migrate_json_store
+
+
+@pytest.fixture
+def db(tmp_path):
+    manager = DatabaseManager(str(tmp_path / 'neofocus.db'))
+    yield manager
+    manager.close()
+
+
+def test_stream_yields_items_across_small_chunks():
+    document = {'tasks': [{'id': 1, 'title': 'a "quoted", [title]'}, {'id': 2, 'n': 12345}], 'empty': [],
+                'settings': {'theme': 'dark'}}
+    fp = io.StringIO(json.dumps(document, indent=2))
+    assert list(iter_json_collections(fp, chunk_size=3)) == [
+        ('tasks', {'id': 1, 'title': 'a "quoted", [title]'}),
+        ('tasks', {'id': 2, 'n': 12345}),
+        ('settings', {'theme': 'dark'}),
+    ]
+
+
+def test_import_json_file_in_batches(db, tmp_path):
+    path = tmp_path / 'neofocus-data.json'
+    path.write_text(json.dumps({
+        'notes': [{'id': 'n1', 'title': 'Imported', 'content': '<p>hi</p><script>x</script>', 'tags': ['a'],
+                   'createdAt': '2025-01-01T00:00:00.000Z', 'updatedAt': '2025-01-01T00:00:00.000Z'}],
+        'habits': [{'id': i, 'name': f"habit {i}"} for i in range(7)],
+        'settings': {'theme': 'light'},
+    }))
+
+    counts = import_json_file(db, str(path), sanitize=lambda html: html.replace('<script>x</script>', ''), batch_size=3)
+    assert counts == {'notes': 1, 'habits': 7}
+    data = db.get_all_data()
+    assert [h['name'] for h in data['habits']] == [f"habit {i}" for i in range(7)]
+    assert data['notes'][0]['content'] == '<p>hi</p>'
+    assert data['settings']['theme'] == 'light'
+
+    # Re-importing upserts by id instead of duplicating
+    import_json_file(db, str(path), batch_size=3)
+    assert len(db.get_all_data()['habits']) == 7
+
+
+def test_migrate_json_store_runs_once(db, tmp_path):
+    path = tmp_path / 'neofocus-data.json'
+    path.write_text(json.dumps({'goals': [{'id': 'g1', 'title': 'Ship it'}]}))
+    assert migrate_json_store(db, str(path)) == {'goals': 1}
+    assert migrate_json_store(db, str(path)) is None
+    assert migrate_json_store(db, str(tmp_path / 'missing.json')) is None
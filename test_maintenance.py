@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Tests for database backups, restore and the maintenance schedule
+"""
+
+import os
+import sqlite3
+
+import pytest
+
+import maintenance
+from database_manager import DatabaseService
+from maintenance import MaintenanceService, backup_database, list_backups, restore_backup
+
+
+def make_note(note_id, content='<p>body</p>'):
+    return {'id': note_id, 'title': note_id, 'content': content, 'tags': [], 'category': None,
+            'createdAt': '2025-01-01T00:00:00.000Z', 'updatedAt': '2025-01-01T00:00:00.000Z'}
+
+
+@pytest.fixture
+def database(tmp_path):
+    service = DatabaseService(str(tmp_path / 'neofocus.db'))
+    yield service
+    service.close()
+
+
+def test_backups_are_rotated(database, tmp_path):
+    db = database.get()
+    db.add_note(make_note('a'))
+    paths = [backup_database(db, keep=3) for _ in range(5)]
+    assert list_backups(str(tmp_path / 'backups')) == paths[-3:]
+    copy = sqlite3.connect(paths[-1])
+    try:
+        assert copy.execute("SELECT id FROM notes").fetchall() == [('a',)]
+    finally:
+        copy.close()
+
+
+def test_restore_replaces_the_database_and_keeps_the_old_one(database, tmp_path):
+    db = database.get()
+    db.add_note(make_note('kept'))
+    backup = backup_database(db)
+    db.add_note(make_note('later'))
+    database.close()
+
+    saved = restore_backup(backup, database.db_path)
+    assert [n[0] for n in database.get().get_notes()] == ['kept']
+    assert saved in list_backups(str(tmp_path / 'backups'))
+
+    (tmp_path / 'junk.db').write_bytes(b'not a database' * 100)
+    with pytest.raises(ValueError):
+        restore_backup(str(tmp_path / 'junk.db'), database.db_path)
+    with pytest.raises(FileNotFoundError):
+        restore_backup(str(tmp_path / 'missing.db'), database.db_path)
+
+
+def test_jobs_wait_for_idle_unless_long_overdue(database, tmp_path):
+    database.get().add_note(make_note('a'))
+    service = MaintenanceService(database)
+    now = service.started
+    assert service.run_pending(now=now, idle=False) == []
+    assert service.run_pending(now=now, idle=True) == ['backup', 'optimize', 'analyze']
+    assert service.run_pending(now=now + 60, idle=True) == []
+    # An hour later only optimize is due; while busy it is deferred up to MAX_DEFER_SECONDS
+    later = now + maintenance.OPTIMIZE_INTERVAL_SECONDS
+    assert service.run_pending(now=later, idle=False) == []
+    assert service.run_pending(now=later + maintenance.MAX_DEFER_SECONDS, idle=False) == ['optimize']
+
+    # A new process picks the backup schedule up from the newest backup file
+    restarted = MaintenanceService(database)
+    assert restarted.run_pending(now=now + 60, idle=True) == ['optimize', 'analyze']
+    assert len(list_backups(str(tmp_path / 'backups'))) == 1
+
+
+def test_commits_reset_the_idle_clock(database):
+    service = MaintenanceService(database)
+    service.last_write = 0
+    db = database.get()
+    service.run_pending(idle=False)
+    db.add_note(make_note('a'))
+    assert service.last_write > 0
+    service.close()
+    assert db._commit_listeners == []
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Tests for the metrics registry and its Prometheus rendering
+"""
+
+import json
+
+from metrics import Metrics, instrument_methods
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Metrics()
+    for seconds in (0.0001, 0.003, 0.003, 10):
+        registry.observe('neofocus_http_request_duration_seconds', seconds, route='/api/notes', method='GET')
+    registry.observe_request('/api/notes', 'GET', 200, 0.002, 512)
+
+    text = registry.render_prometheus()
+    assert '# TYPE neofocus_http_request_duration_seconds histogram' in text
+    assert 'neofocus_http_request_duration_seconds_bucket{method="GET",route="/api/notes",le="0.0005"} 1' in text
+    assert 'neofocus_http_request_duration_seconds_bucket{method="GET",route="/api/notes",le="0.005"} 4' in text
+    assert 'neofocus_http_request_duration_seconds_bucket{method="GET",route="/api/notes",le="+Inf"} 5' in text
+    assert 'neofocus_http_request_duration_seconds_count{method="GET",route="/api/notes"} 5' in text
+    assert 'neofocus_http_requests_total{method="GET",route="/api/notes",status="200"} 1' in text
+    assert 'neofocus_http_response_bytes_total{route="/api/notes"} 512' in text
+
+
+def test_label_values_are_escaped():
+    registry = Metrics()
+    registry.increment('neofocus_http_requests_total', route='say "hi"\n', method='GET', status='404')
+    assert 'route="say \\"hi\\"\\n"' in registry.render_prometheus()
+
+
+def test_instrumented_methods_are_timed(tmp_path):
+    registry = Metrics()
+
+    class Service:
+        def work(self, value):
+            return value * 2
+
+    instrument_methods(Service, 'neofocus_db_call_duration_seconds', ['work'], registry=registry)
+    assert Service().work(21) == 42
+    assert Service.work.__name__ == 'work'
+
+    path = tmp_path / 'metrics.json'
+    registry.dump_json(str(path))
+    histograms = json.loads(path.read_text())['histograms']
+    assert [(h['name'], h['labels'], h['count']) for h in histograms] == [
+        ('neofocus_db_call_duration_seconds', {'method': 'work'}, 1)]
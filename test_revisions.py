@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+Tests for note revision encoding and retention
+"""
+
+from revisions import (KEEP_ALL_SECONDS, MAX_REVISIONS, apply_delta, decode_snapshot, encode_delta, encode_snapshot,
+                       revisions_to_keep)
+
+
+def test_deltas_round_trip():
+    pairs = [('', '<p>new</p>'), ('<p>abc</p>', '<p>abXc</p>'), ('<p>same</p>', '<p>same</p>'),
+             ('<p>héllo wörld</p>', '<p>héllo</p>'), ('aaaa', 'aa'), ('<p>x</p>', '')]
+    for old, new in pairs:
+        assert apply_delta(old, encode_delta(old, new)) == new
+    assert decode_snapshot(encode_snapshot('<p>ünïcode</p>')) == '<p>ünïcode</p>'
+
+
+def test_small_edits_make_small_deltas():
+    old = '<p>' + ' '.join(f"word{i * 7919 % 10007}" for i in range(1000)) + '</p>'
+    new = old[:2000] + 'typed' + old[2000:]
+    assert len(encode_delta(old, new)) < len(encode_snapshot(new)) / 10
+
+
+def test_retention_thins_old_revisions():
+    now = 100 * 86400
+    recent = [(i, now - 60 * i) for i in range(10, 0, -1)]
+    # Four saves in each of two hours a week ago, and three saves on one day two months ago
+    week_old = [(20 + i, now - 7 * 86400 + 600 * i) for i in range(4)] + \
+               [(30 + i, now - 7 * 86400 + 3600 + 600 * i) for i in range(4)]
+    month_old = [(40 + i, now - 60 * 86400 + 3600 * i) for i in range(3)]
+    revisions = sorted(month_old + week_old) + recent
+    assert revisions_to_keep(revisions, now) == {42, 23, 33} | {rev for rev, _ in recent}
+
+
+def test_retention_caps_revisions_and_keeps_the_newest():
+    now = 10 * KEEP_ALL_SECONDS
+    revisions = [(i, now - 1000 + i) for i in range(1, MAX_REVISIONS + 50)]
+    kept = revisions_to_keep(revisions, now)
+    assert len(kept) == MAX_REVISIONS and revisions[-1][0] in kept and 1 not in kept
+    assert revisions_to_keep([], now) == set()
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+"""
+Tests for the cached note HTML sanitizer
+"""
+
+from sanitizer import NoteSanitizer
+
+
+def test_strips_disallowed_markup():
+    sanitizer = NoteSanitizer()
+    cleaned = sanitizer.clean('<h1>Title</h1><script>alert(1)</script><a href="https://x" onclick="y">link</a>')
+    assert '<h1>Title</h1>' in cleaned
+    assert '<script>' not in cleaned
+    assert 'onclick' not in cleaned
+
+
+def test_repeated_content_hits_cache():
+    sanitizer = NoteSanitizer()
+    body = '<p>' + 'autosave ' * 200 + '</p>'
+    first = sanitizer.clean(body)
+    assert sanitizer.clean(body) == first
+    stats = sanitizer.stats()
+    assert (stats['hits'], stats['misses']) == (1, 1)
+    assert stats['hitRate'] == 0.5
+    assert stats['timeSavedMs'] > 0
+
+
+def test_cache_is_bounded():
+    sanitizer = NoteSanitizer(max_entries=2)
+    for i in range(5):
+        sanitizer.clean(f"<p>note {i}</p>")
+    assert sanitizer.stats()['entries'] == 2
+    sanitizer.clean('<p>note 0</p>')
+    assert sanitizer.stats()['hits'] == 0
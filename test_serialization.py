@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""
+Tests for JSON encoding of API rows
+"""
+
+import json
+
+import pytest
+
+import serialization
+from serialization import RowMapper, iter_json_array
+
+
+@pytest.fixture(params=['orjson', 'stdlib'])
+def encoder(request, monkeypatch):
+    if request.param == 'stdlib':
+        monkeypatch.setattr(serialization, 'orjson', None)
+    elif serialization.orjson is None:
+        pytest.skip('orjson is not installed')
+    return request.param
+
+
+def test_dumps_is_compact_utf8(encoder):
+    assert serialization.dumps({'title': 'Café', 'tags': []}) == '{"title":"Café","tags":[]}'.encode('utf-8')
+
+
+def test_row_mapper_decodes_json_and_boolean_columns():
+    mapper = RowMapper(('id', 'done', 'tags'), json_columns=('tags',), bool_columns=('done',))
+    assert mapper((1, 0, '["a","b"]')) == {'id': 1, 'done': False, 'tags': ['a', 'b']}
+    assert mapper((2, None, None)) == {'id': 2, 'done': None, 'tags': None}
+    assert mapper.select_list == 'id, done, tags'
+
+
+@pytest.mark.parametrize('count', [0, 1, 5, 7])
+def test_iter_json_array_matches_full_encoding(encoder, count):
+    items = [{'id': i, 'title': f"row {i}"} for i in range(count)]
+    chunks = list(iter_json_array(iter(items), batch_rows=3))
+    assert json.loads(b''.join(chunks)) == items
+    assert len(chunks) == 2 + (count + 2) // 3
@@ -0,0 +1,668 @@
+#!/usr/bin/env python3
+"""
+Tests for the local HTTP server that serves the Next.js export and the API
+"""
+
+import functools
+import gzip
+import http.client
+import importlib
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from static_files import precompress_directory
+
+REPO_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.fixture(scope='module')
+def app_module(tmp_path_factory):
+    """Import app.py and give its request handler a database in a scratch directory"""
+    sys.path.insert(0, REPO_ROOT)
+    app = importlib.import_module('app')
+    database = app.DatabaseService(str(tmp_path_factory.mktemp('neofocus') / 'neofocus.db'))
+    app.ApiRequestHandler.database = database
+    app.ApiRequestHandler.event_broker = app.EventBroker(database, heartbeat=0.2)
+    yield app
+    app.ApiRequestHandler.event_broker.close()
+    app.ApiRequestHandler.database = app.ApiRequestHandler.event_broker = None
+    database.close()
+
+
+@pytest.fixture
+def static_dir(tmp_path):
+    (tmp_path / 'index.html').write_text('<html>NEO FOCUS</html>')
+    return tmp_path
+
+
+def start_server(app_module, handler_class, static_dir, workers=4):
+    handler = functools.partial(handler_class, directory=str(static_dir))
+    server = app_module.ThreadPoolHTTPServer(('127.0.0.1', 0), handler, max_workers=workers)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def stop_server(server):
+    server.shutdown()
+    server.server_close()
+
+
+def test_serves_static_and_api(app_module, static_dir):
+    server, base_url = start_server(app_module, app_module.ApiRequestHandler, static_dir)
+    try:
+        with urllib.request.urlopen(base_url + '/index.html') as response:
+            assert b'NEO FOCUS' in response.read()
+        with urllib.request.urlopen(base_url + '/api/notes') as response:
+            assert response.status == 200
+            assert isinstance(json.loads(response.read()), list)
+    finally:
+        stop_server(server)
+
+
+def test_slow_request_does_not_block_others(app_module, static_dir):
+    release = threading.Event()
+
+    class SlowHandler(app_module.ApiRequestHandler):
+        def do_GET(self):
+            if self.path == '/slow':
+                release.wait(5)
+                self._send_response(200, {'status': 'slow'})
+            else:
+                super().do_GET()
+
+    server, base_url = start_server(app_module, SlowHandler, static_dir)
+    try:
+        slow = threading.Thread(target=lambda: urllib.request.urlopen(base_url + '/slow').read())
+        slow.start()
+        start = time.perf_counter()
+        with urllib.request.urlopen(base_url + '/index.html', timeout=3) as response:
+            response.read()
+        assert time.perf_counter() - start < 1
+        release.set()
+        slow.join()
+    finally:
+        release.set()
+        stop_server(server)
+
+
+def test_server_workers_from_environment(app_module, monkeypatch):
+    monkeypatch.setenv('NEOFOCUS_SERVER_WORKERS', '3')
+    assert app_module.get_server_workers() == 3
+    monkeypatch.setenv('NEOFOCUS_SERVER_WORKERS', 'many')
+    assert app_module.get_server_workers() == app_module.DEFAULT_SERVER_WORKERS
+
+
+def get_json(url):
+    with urllib.request.urlopen(url) as response:
+        return json.loads(response.read()), response.headers
+
+
+def test_notes_keyset_pagination(app_module, static_dir):
+    db = app_module.ApiRequestHandler.database.get()
+    for i in range(5):
+        timestamp = f"2025-02-0{i + 1}T00:00:00.000Z"
+        db.add_note({'id': f"page-{i}", 'title': f"Page {i}", 'content': '', 'tags': [],
+                     'category': 'paging', 'createdAt': timestamp, 'updatedAt': timestamp})
+
+    server, base_url = start_server(app_module, app_module.ApiRequestHandler, static_dir)
+    try:
+        seen = []
+        url = base_url + '/api/notes?category=paging&limit=2'
+        while url:
+            notes, headers = get_json(url)
+            assert len(notes) <= 2
+            seen.extend(note['id'] for note in notes)
+            cursor = headers.get('X-Next-Cursor')
+            url = f"{base_url}/api/notes?category=paging&limit=2&cursor={cursor}" if cursor else None
+        assert seen == [f"page-{i}" for i in reversed(range(5))]
+
+        # Both bounds are inclusive days, as for calendar events
+        notes, _ = get_json(base_url + '/api/notes?category=paging&from=2025-02-02&to=2025-02-04')
+        assert [note['id'] for note in notes] == ['page-3', 'page-2', 'page-1']
+    finally:
+        stop_server(server)
+
+
+def test_list_endpoints_reject_bad_parameters(app_module, static_dir):
+    server, base_url = start_server(app_module, app_module.ApiRequestHandler, static_dir)
+    try:
+        for path in ('/api/notes?limit=abc', '/api/tasks?cursor=not-a-cursor', '/api/tasks?completed=maybe'):
+            with pytest.raises(urllib.error.HTTPError) as excinfo:
+                urllib.request.urlopen(base_url + path)
+            assert excinfo.value.code == 400
+    finally:
+        stop_server(server)
+
+
+def test_notes_search_endpoint(app_module, static_dir):
+    db = app_module.ApiRequestHandler.database.get()
+    db.add_note({'id': 'search-1', 'title': 'Trip checklist', 'content': '<p>passport &amp; tickets</p>', 'tags': ['travel'],
+                 'category': 'search', 'createdAt': '2025-03-01T00:00:00.000Z', 'updatedAt': '2025-03-01T00:00:00.000Z'})
+
+    server, base_url = start_server(app_module, app_module.ApiRequestHandler, static_dir)
+    try:
+        results, _ = get_json(base_url + '/api/notes/search?q=passport')
+        assert [r['id'] for r in results] == ['search-1']
+        assert '<mark>passport</mark> &amp; tickets' in results[0]['snippet']
+        results, _ = get_json(base_url + '/api/notes/search?q=%22%29%28')
+        assert results == []
+    finally:
+        stop_server(server)
+
+
+def send_json(method, url, payload):
+    request = urllib.request.Request(url, data=json.dumps(payload).encode(), method=method,
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request) as response:
+        return response.status, json.loads(response.read())
+
+
+def test_note_content_is_sanitized(app_module, static_dir):
+    server, base_url = start_server(app_module, app_module.ApiRequestHandler, static_dir)
+    try:
+        note = {'id': 'sanitize-1', 'title': 'XSS', 'content': '<p>ok</p><script>alert(1)</script>', 'tags': [],
+                'category': 'sanitize', 'createdAt': '2025-04-01T00:00:00.000Z', 'updatedAt': '2025-04-01T00:00:00.000Z'}
+        assert send_json('POST', base_url + '/api/notes', note)[0] == 201
+        assert send_json('PUT', base_url + '/api/notes/sanitize-1', note)[0] == 200
+        notes, _ = get_json(base_url + '/api/notes?category=sanitize')
+        assert '<script>' not in notes[0]['content']
+        stats, _ = get_json(base_url + '/api/stats')
+        assert stats['sanitizer']['hits'] >= 1
+    finally:
+        stop_server(server)
+
+
+
+def test_autosave_updates_are_coalesced_until_flushed(app_module, static_dir, monkeypatch):
+    monkeypatch.setattr('database_manager.NOTE_WRITE_DELAY_SECONDS', 60)
+    server, base_url = start_server(app_module, app_module.ApiRequestHandler, static_dir)
+    try:
+        note = {'id': 'autosave-1', 'title': 'Typing', 'content': '', 'tags': [], 'category': 'autosave',
+                'createdAt': '2025-04-02T00:00:00.000Z', 'updatedAt': '2025-04-02T00:00:00.000Z'}
+        assert send_json('POST', base_url + '/api/notes', note)[0] == 201
+        for text in ('T', 'Ty', 'Typ'):
+            assert send_json('PUT', base_url + '/api/notes/autosave-1', dict(note, content=f"<p>{text}</p>"))[0] == 200
+        assert send_json('POST', base_url + '/api/flush', {}) == (200, {'flushed': 1})
+        notes, _ = get_json(base_url + '/api/notes?category=autosave')
+        assert notes[0]['content'] == '<p>Typ</p>'
+        with pytest.raises(urllib.error.HTTPError) as error:
+            send_json('PUT', base_url + '/api/notes/autosave-1', {'content': 'no title'})
+        assert error.value.code == 400
+    finally:
+        stop_server(server)
+
+def test_note_revisions_can_be_listed_and_rebuilt(app_module, static_dir):
+    server, base_url = start_server(app_module, app_module.ApiRequestHandler, static_dir)
+    try:
+        note = {'id': 'history-1', 'title': 'Draft', 'content': '<p>one</p>', 'tags': [], 'category': None,
+                'createdAt': '2025-04-02T00:00:00.000Z', 'updatedAt': '2025-04-02T00:00:00.000Z'}
+        assert send_json('POST', base_url + '/api/notes', note)[0] == 201
+        assert send_json('PUT', base_url + '/api/notes/history-1', dict(note, title='Final', content='<p>two</p>'))[0] == 200
+        assert send_json('POST', base_url + '/api/flush', {})[0] == 200
+
+        history, _ = get_json(base_url + '/api/notes/history-1/revisions')
+        assert [(r['revision'], r['title']) for r in history] == [(2, 'Final'), (1, 'Draft')]
+        first, _ = get_json(base_url + '/api/notes/history-1/revisions/1')
+        assert (first['title'], first['content']) == ('Draft', '<p>one</p>')
+        for revision in ('9', '9' * 30):
+            with pytest.raises(urllib.error.HTTPError) as error:
+                get_json(base_url + f"/api/notes/history-1/revisions/{revision}")
+            assert error.value.code == 404
+
+        # Two updates of one note in a batch are two revisions
+        updates = [{'op': 'update', 'entity': 'notes', 'id': 'history-1', 'data': dict(note, content=f"<p>{text}</p>")}
+                   for text in ('three', 'four')]
+        assert send_json('POST', base_url + '/api/batch', updates)[0] == 200
+        history, _ = get_json(base_url + '/api/notes/history-1/revisions')
+        assert [r['revision'] for r in history] == [4, 3, 2, 1]
+    finally:
+        stop_server(server)
+
+def test_sync_returns_only_changes(app_module, static_dir):
+    server, base_url = start_server(app_module, app_module.ApiRequestHandler, static_dir)
+    try:
+        before, _ = get_json(base_url + '/api/sync?since=0')
+        note = {'id': 'sync-1', 'title': 'Synced', 'content': '', 'tags': ['s'], 'category': 'sync',
+                'createdAt': '2025-05-01T00:00:00.000Z', 'updatedAt': '2025-05-01T00:00:00.000Z'}
+        send_json('POST', base_url + '/api/notes', note)
+        request = urllib.request.Request(base_url + '/api/notes/sync-1', method='DELETE')
+        urllib.request.urlopen(request).read()
+
+        delta, _ = get_json(f"{base_url}/api/sync?since={before['version']}")
+        assert delta['version'] > before['version']
+        assert delta['notes'] == {'upserted': [], 'deleted': ['sync-1']}
+        assert delta['tasks'] == {'upserted': [], 'deleted': []}
+    finally:
+        stop_server(server)
+
+
+def test_batch_applies_operations_atomically(app_module, static_dir):
+    server, base_url = start_server(app_module, app_module.ApiRequestHandler, static_dir)
+    try:
+        operations = [
+            {'op': 'create', 'entity': 'tasks', 'data': {'title': 'batch task', 'category': 'batch'}},
+            {'op': 'create', 'entity': 'tasks', 'data': {'title': 'batch task 2', 'category': 'batch'}},
+            {'op': 'create', 'entity': 'notes', 'data': {'id': 'batch-1', 'title': 'Batch', 'content': '<script>x</script>',
+                                                         'tags': ['b'], 'createdAt': 'x', 'updatedAt': 'x'}},
+        ]
+        status, body = send_json('POST', base_url + '/api/batch', operations)
+        assert status == 200
+        assert [r['status'] for r in body['results']] == ['ok', 'ok', 'ok']
+        task_ids = [r['id'] for r in body['results'][:2]]
+        assert task_ids[1] == task_ids[0] + 1
+
+        failing = [
+            {'op': 'delete', 'entity': 'tasks', 'id': task_ids[0]},
+            {'op': 'create', 'entity': 'notes', 'data': {'id': 'batch-1', 'title': 'Duplicate', 'createdAt': 'x', 'updatedAt': 'x'}},
+        ]
+        with pytest.raises(urllib.error.HTTPError) as excinfo:
+            send_json('POST', base_url + '/api/batch', failing)
+        assert excinfo.value.code == 400
+        assert json.loads(excinfo.value.read())['index'] == 1
+        tasks, _ = get_json(base_url + '/api/tasks?category=batch')
+        assert [t['id'] for t in tasks] == task_ids
+
+        # Missing rows are reported per item and leave nothing in the change log
+        before, _ = get_json(base_url + '/api/sync?since=0')
+        missing = [
+            {'op': 'update', 'entity': 'tasks', 'id': str(task_ids[0]), 'data': {'title': 'renamed'}},
+            {'op': 'update', 'entity': 'tasks', 'id': 999999, 'data': {'title': 'ghost'}},
+            {'op': 'delete', 'entity': 'calendar-events', 'id': 999999},
+            {'op': 'delete', 'entity': 'notes', 'id': 'no-such-note'},
+        ]
+        status, body = send_json('POST', base_url + '/api/batch', missing)
+        assert [r['status'] for r in body['results']] == ['ok', 'not_found', 'not_found', 'not_found']
+        delta, _ = get_json(f"{base_url}/api/sync?since={before['version']}")
+        assert [t['id'] for t in delta['tasks']['upserted']] == [task_ids[0]]
+        assert delta['tasks']['deleted'] == [] and delta['calendarEvents']['deleted'] == []
+        assert delta['notes']['deleted'] == []
+    finally:
+        stop_server(server)
+
+
+def test_data_snapshot_round_trip(app_module, static_dir):
+    server, base_url = start_server(app_module, app_module.ApiRequestHandler, static_dir)
+    try:
+        data, _ = get_json(base_url + '/api/data')
+        data['goals'] = [{'id': 'goal-1', 'title': 'Read more'}]
+        data['notes'].append({'id': 'data-1', 'title': 'Saved', 'content': '<p>a</p><script>b</script>', 'tags': [],
+                              'createdAt': '2025-06-01T00:00:00.000Z', 'updatedAt': '2025-06-01T00:00:00.000Z'})
+        assert send_json('POST', base_url + '/api/save', data) == (200, {'success': True})
+
+        saved, _ = get_json(base_url + '/api/data')
+        assert saved['goals'] == [{'id': 'goal-1', 'title': 'Read more'}]
+        note = next(n for n in saved['notes'] if n['id'] == 'data-1')
+        assert '<script>' not in note['content']
+    finally:
+        stop_server(server)
+
+
+def test_conditional_get_returns_not_modified(app_module, static_dir):
+    chunk_dir = static_dir / '_next' / 'static' / 'chunks'
+    chunk_dir.mkdir(parents=True)
+    (chunk_dir / 'main-abc123.js').write_text('console.log(1)')
+    server, base_url = start_server(app_module, app_module.ApiRequestHandler, static_dir)
+
+    def fetch(path, etag=None):
+        request = urllib.request.Request(base_url + path, headers={'If-None-Match': etag} if etag else {})
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, response.headers, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.headers, e.read()
+
+    try:
+        status, headers, _ = fetch('/api/tasks')
+        etag = headers['ETag']
+        assert status == 200 and headers['Cache-Control'] == 'no-cache'
+        status, headers, body = fetch('/api/tasks', etag)
+        assert (status, body, headers['ETag']) == (304, b'', etag)
+        # Writes to other tables keep the validator
+        send_json('POST', base_url + '/api/notes', {'id': 'etag-1', 'title': 'E', 'content': '', 'tags': [],
+                                                    'createdAt': 'x', 'updatedAt': 'x'})
+        assert fetch('/api/tasks', etag)[0] == 304
+        send_json('POST', base_url + '/api/tasks', {'title': 'new task'})
+        status, headers, _ = fetch('/api/tasks', etag)
+        assert status == 200 and headers['ETag'] != etag
+
+        status, headers, _ = fetch('/_next/static/chunks/main-abc123.js')
+        assert status == 200 and 'immutable' in headers['Cache-Control']
+        assert fetch('/_next/static/chunks/main-abc123.js', 'W/' + headers['ETag'])[0] == 304
+        assert fetch('/index.html')[1]['Cache-Control'] == 'no-cache'
+    finally:
+        stop_server(server)
+
+
+def test_static_files_are_served_precompressed(app_module, static_dir):
+    script = static_dir / 'vendors.js'
+    script.write_text('export const value = "neo focus";\n' * 500)
+    precompress_directory(str(static_dir))
+    server, base_url = start_server(app_module, app_module.ApiRequestHandler, static_dir)
+
+    def fetch(accept_encoding):
+        request = urllib.request.Request(base_url + '/vendors.js', headers={'Accept-Encoding': accept_encoding})
+        with urllib.request.urlopen(request) as response:
+            return response.headers, response.read()
+
+    try:
+        headers, body = fetch('gzip')
+        assert headers['Content-Encoding'] == 'gzip' and headers['Vary'] == 'Accept-Encoding'
+        assert int(headers['Content-Length']) == len(body) < script.stat().st_size
+        # Uncached and cached reads of the plain file return the same bytes
+        for _ in range(3):
+            headers, body = fetch('identity')
+            assert headers['Content-Encoding'] is None and body == script.read_bytes()
+        assert app_module.static_cache.stats()['hits'] >= 1
+        with urllib.request.urlopen(base_url + '/') as response:
+            assert b'NEO FOCUS' in response.read()
+    finally:
+        stop_server(server)
+
+
+def test_large_json_is_compressed_over_one_connection(app_module, static_dir):
+    db = app_module.ApiRequestHandler.database.get()
+    db.bulk_add_notes([{'id': f"gzip-{i}", 'title': f"Compressed {i}", 'content': '<p>' + 'lorem ipsum ' * 50 + '</p>',
+                        'tags': [], 'category': 'gzip', 'createdAt': 'x', 'updatedAt': 'x'} for i in range(20)])
+    server, base_url = start_server(app_module, app_module.ApiRequestHandler, static_dir)
+    connection = http.client.HTTPConnection('127.0.0.1', server.server_address[1], timeout=5)
+    try:
+        connection.request('GET', '/api/notes?category=gzip', headers={'Accept-Encoding': 'gzip'})
+        response = connection.getresponse()
+        body = response.read()
+        assert response.getheader('Content-Encoding') == 'gzip'
+        assert int(response.getheader('Content-Length')) == len(body)
+        notes = json.loads(gzip.decompress(body))
+        assert len(notes) == 20
+        etag = response.getheader('ETag')
+        assert etag.endswith('-gzip"')
+
+        # Same socket: a small response goes out as is, and the gzip validator revalidates
+        sock = connection.sock
+        connection.request('GET', '/api/notes/tags')
+        response = connection.getresponse()
+        assert response.getheader('Content-Encoding') is None
+        json.loads(response.read())
+        connection.request('GET', '/api/notes?category=gzip', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+        response = connection.getresponse()
+        response.read()
+        assert (response.status, response.getheader('ETag')) == (304, etag)
+        assert connection.sock is sock
+    finally:
+        connection.close()
+        stop_server(server)
+
+
+def test_rejected_requests_leave_keep_alive_connections_usable(app_module, static_dir):
+    server, base_url = start_server(app_module, app_module.ApiRequestHandler, static_dir)
+    connection = http.client.HTTPConnection('127.0.0.1', server.server_address[1], timeout=5)
+    try:
+        for method, path, body, status in [('PUT', '/api/tasks/1', b'{"title": "x"}', 404),
+                                           ('DELETE', '/api/tasks/1', b'{"id": 1}', 404),
+                                           ('POST', '/api/tasks', b'{not json', 400),
+                                           ('PUT', '/api/notes/n1', b'\xff', 400)]:
+            connection.request(method, path, body=body, headers={'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            response.read()
+            assert response.status == status
+            connection.request('GET', '/api/health')
+            response = connection.getresponse()
+            response.read()
+            assert response.status == 200
+    finally:
+        connection.close()
+        stop_server(server)
+
+def test_large_lists_are_streamed_as_objects(app_module, static_dir):
+    db = app_module.ApiRequestHandler.database.get()
+    task_ids = db.bulk_add_tasks([{'title': f"stream {i}", 'category': 'stream'} for i in range(app_module.STREAM_MIN_ROWS + 5)])
+    server, base_url = start_server(app_module, app_module.ApiRequestHandler, static_dir)
+    connection = http.client.HTTPConnection('127.0.0.1', server.server_address[1], timeout=5)
+    try:
+        for accept_encoding in ('identity', 'gzip'):
+            connection.request('GET', '/api/tasks?category=stream', headers={'Accept-Encoding': accept_encoding})
+            response = connection.getresponse()
+            assert response.getheader('Transfer-Encoding') == 'chunked'
+            body = response.read()
+            tasks = json.loads(gzip.decompress(body) if accept_encoding == 'gzip' else body)
+            assert [t['id'] for t in tasks] == task_ids
+            assert tasks[0] == {'id': task_ids[0], 'title': 'stream 0', 'completed': False, 'category': 'stream',
+                                'startTime': None, 'endTime': None}
+    finally:
+        connection.close()
+        stop_server(server)
+
+
+def test_lists_can_be_requested_as_ndjson(app_module, static_dir):
+    db = app_module.ApiRequestHandler.database.get()
+    db.bulk_add_calendar_events([{'title': f"ndjson {i}", 'date': '2026-01-01', 'category': 'ndjson'}
+                                 for i in range(app_module.STREAM_MIN_ROWS * 2)])
+    server, base_url = start_server(app_module, app_module.ApiRequestHandler, static_dir)
+    try:
+        with urllib.request.urlopen(base_url + '/api/calendar-events?category=ndjson&format=ndjson') as response:
+            assert response.headers['Content-Type'] == 'application/x-ndjson'
+            assert response.headers['Transfer-Encoding'] == 'chunked'
+            lines = response.read().splitlines()
+        assert len(lines) == app_module.STREAM_MIN_ROWS * 2
+        assert json.loads(lines[0])['title'] == 'ndjson 0'
+
+        request = urllib.request.Request(base_url + '/api/calendar-events?category=ndjson&limit=3',
+                                         headers={'Accept': 'application/x-ndjson'})
+        with urllib.request.urlopen(request) as response:
+            assert response.headers['Content-Length'] is not None
+            assert [json.loads(line)['title'] for line in response.read().splitlines()] == ['ndjson 0', 'ndjson 1', 'ndjson 2']
+            assert response.headers['X-Next-Cursor']
+    finally:
+        stop_server(server)
+
+
+
+def test_calendar_window_returns_occurrences(app_module, static_dir):
+    db = app_module.ApiRequestHandler.database.get()
+    db.add_calendar_event('review', '2027-01-04', '11:00', 'window', 'weekly')
+    server, base_url = start_server(app_module, app_module.ApiRequestHandler, static_dir)
+    try:
+        events, _ = get_json(base_url + '/api/calendar-events?category=window&from=2027-02-01&to=2027-02-28')
+        assert [e['date'] for e in events] == ['2027-02-01', '2027-02-08', '2027-02-15', '2027-02-22']
+        assert {e['seriesDate'] for e in events} == {'2027-01-04'}
+        for query in ('from=2027-02-01&to=2026-02-01', 'from=2027-02-01&to=2029-01-01', 'from=feb&to=mar'):
+            with pytest.raises(urllib.error.HTTPError) as error:
+                urllib.request.urlopen(base_url + '/api/calendar-events?' + query)
+            assert error.value.code == 400
+    finally:
+        stop_server(server)
+
+
+def test_analytics_answers_from_rollups(app_module, static_dir):
+    db = app_module.ApiRequestHandler.database.get()
+    today = app_module.date.today().isoformat()
+    db.upsert_collection_items('focusSessions', [
+        {'id': 'analytics-1', 'duration': 50, 'status': 'completed', 'createdAt': today + 'T08:00:00.000Z'},
+    ], 0)
+    server, base_url = start_server(app_module, app_module.ApiRequestHandler, static_dir)
+    try:
+        analytics, _ = get_json(base_url + '/api/analytics?range=7d')
+        assert analytics['range']['to'] == today
+        assert analytics['focus']['byDay'] == [{'date': today, 'sessions': 1, 'completed': 1, 'minutes': 50}]
+        assert get_json(base_url + '/api/analytics?range=all')[0]['range'] == {'from': None, 'to': None}
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(base_url + '/api/analytics?range=forever')
+        assert error.value.code == 400
+    finally:
+        stop_server(server)
+
+
+def open_event_stream(base_url, last_event_id=None):
+    connection = http.client.HTTPConnection(base_url.split('//')[1], timeout=5)
+    connection.request('GET', '/api/events', headers={'Last-Event-ID': str(last_event_id)} if last_event_id else {})
+    response = connection.getresponse()
+    assert response.status == 200
+    assert response.headers['Content-Type'] == 'text/event-stream'
+    return connection, response
+
+
+def read_event(response, kind):
+    """Fields of the next event of the given kind, skipping heartbeats and other events"""
+    while True:
+        lines = []
+        while True:
+            line = response.fp.readline().decode().rstrip('\n')
+            if not line:
+                break
+            lines.append(line)
+        fields = dict(line.split(': ', 1) for line in lines if not line.startswith(':') and ': ' in line)
+        if fields.get('event') == kind:
+            return fields
+
+
+def test_event_stream_pushes_changes_without_holding_workers(app_module, static_dir):
+    db = app_module.ApiRequestHandler.database.get()
+    server, base_url = start_server(app_module, app_module.ApiRequestHandler, static_dir, workers=1)
+    streams = []
+    try:
+        # Both streams are open at once on a single worker, and the API still answers
+        streams = [open_event_stream(base_url) for _ in range(2)]
+        assert get_json(base_url + '/api/tasks?limit=1')[0] is not None
+
+        task_id = db.add_task('pushed', 'events', None, None)
+        for _, response in streams:
+            change = read_event(response, 'change')
+            assert json.loads(change['data'])['entity'] == 'tasks'
+            assert json.loads(change['data'])['id'] == task_id
+        # Idle streams get heartbeat comments
+        assert streams[0][1].fp.readline().startswith(b': heartbeat')
+        missed_from = int(change['id'])
+
+        for connection, _ in streams:
+            connection.close()
+        db.delete_task(task_id)
+        # Reconnecting with Last-Event-ID replays what happened in between
+        streams = [open_event_stream(base_url, last_event_id=missed_from)]
+        replayed = json.loads(read_event(streams[0][1], 'change')['data'])
+        assert (replayed['id'], replayed['op']) == (task_id, 'delete')
+    finally:
+        for connection, _ in streams:
+            connection.close()
+        stop_server(server)
+
+def test_metrics_endpoint_reports_routes_and_db_calls(app_module, static_dir):
+    server, base_url = start_server(app_module, app_module.ApiRequestHandler, static_dir)
+    try:
+        for path in ('/api/notes', '/api/notes', '/index.html'):
+            urllib.request.urlopen(base_url + path).read()
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(base_url + '/api/notes?limit=0')
+        expected = ('neofocus_http_requests_total{method="GET",route="/api/notes",status="400"}',
+                    'neofocus_http_request_duration_seconds_count{method="GET",route="static"}',
+                    'neofocus_db_call_duration_seconds_count{method="get_notes"}')
+        # A request is recorded just after its response is written, so allow the last one a moment
+        deadline = time.monotonic() + 2
+        while True:
+            with urllib.request.urlopen(base_url + '/api/metrics') as response:
+                assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+                text = response.read().decode()
+            if all(series in text for series in expected) or time.monotonic() > deadline:
+                break
+            time.sleep(0.05)
+        assert all(series in text for series in expected)
+        assert 'neofocus_http_response_bytes_total{route="static"}' in text
+    finally:
+        stop_server(server)
+
+
+def test_health_reports_readiness_while_database_opens(app_module, static_dir, tmp_path):
+    importing = threading.Event()
+    release = threading.Event()
+
+    def on_open(db):
+        importing.set()
+        release.wait(10)
+    database = app_module.DatabaseService(str(tmp_path / 'health.db'), on_open=on_open)
+    handler = app_module.make_handler(database, str(static_dir), app_module.StartupTimer())
+    server = app_module.ThreadPoolHTTPServer(('127.0.0.1', 0), handler, max_workers=4)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    opener = threading.Thread(target=database.get)
+    try:
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(base_url + '/api/health')
+        assert error.value.code == 503
+        assert json.loads(error.value.read())['status'] == 'starting'
+        opener.start()
+        assert importing.wait(10)
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(base_url + '/api/health')
+        assert error.value.code == 503
+        assert json.loads(error.value.read())['status'] == 'importing'
+
+        # API requests made before the database is open wait for it instead of failing
+        notes = []
+        waiting = threading.Thread(target=lambda: notes.append(get_json(base_url + '/api/notes')[0]))
+        waiting.start()
+        release.set()
+        waiting.join(10)
+        assert notes == [[]]
+        health, _ = get_json(base_url + '/api/health')
+        assert health['status'] == 'ready'
+        assert 'startup' in health
+    finally:
+        release.set()
+        if opener.is_alive():
+            opener.join()
+        stop_server(server)
+        database.close()
+
+
+def test_database_open_failures_are_503(app_module, static_dir, tmp_path):
+    database = app_module.DatabaseService(str(tmp_path / 'missing' / 'neofocus.db'))
+    handler = app_module.make_handler(database, str(static_dir))
+    server = app_module.ThreadPoolHTTPServer(('127.0.0.1', 0), handler, max_workers=4)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        for path in ('/api/notes', '/api/tasks', '/api/health'):
+            with pytest.raises(urllib.error.HTTPError) as error:
+                urllib.request.urlopen(base_url + path)
+            assert error.value.code == 503
+            assert 'unable to open database file' in json.loads(error.value.read())['error']
+    finally:
+        stop_server(server)
+
+
+def test_headless_serve_runs_without_webview_and_stops_on_sigterm(tmp_path):
+    check = subprocess.run([sys.executable, '-c', "import sys, app; print('webview' in sys.modules, app.DEFAULT_DB_PATH)"],
+                           cwd=tmp_path, env=dict(os.environ, PYTHONPATH=REPO_ROOT), capture_output=True, text=True)
+    loaded_webview, default_db_path = check.stdout.split()
+    assert loaded_webview == 'False'
+    # The data path does not depend on the working directory, and importing opens nothing
+    assert default_db_path == os.path.join(REPO_ROOT, 'data', 'neofocus.db')
+    assert os.listdir(tmp_path) == []
+
+    process = subprocess.Popen([sys.executable, os.path.join(REPO_ROOT, 'app.py'), 'serve', '--port', '0',
+                                '--db', str(tmp_path / 'headless.db')],
+                               cwd=tmp_path, stderr=subprocess.PIPE, text=True)
+    killer = threading.Timer(20, process.kill)
+    killer.start()
+    try:
+        for line in process.stderr:
+            if 'Serving on http://' in line:
+                base_url = line.split('Serving on ')[1].split()[0]
+            if 'Startup complete' in line:
+                break
+        notes, _ = get_json(base_url + '/api/notes')
+        assert notes == []
+        process.send_signal(signal.SIGTERM)
+        assert process.wait(10) == 0
+        assert os.path.exists(tmp_path / 'headless.db')
+    finally:
+        killer.cancel()
+        process.kill()
+        process.stderr.close()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Tests for precompressed static files and the hot-file cache
+"""
+
+import gzip
+import os
+
+from static_files import StaticFileCache, accepted_encodings, find_precompressed, precompress_directory
+
+
+def test_accepted_encodings_honours_quality():
+    assert accepted_encodings('gzip, deflate, br') == {'gzip', 'deflate', 'br'}
+    assert accepted_encodings('br;q=0, gzip;q=0.5') == {'gzip'}
+    assert accepted_encodings('*') >= {'br', 'gzip'}
+    assert accepted_encodings(None) == set()
+
+
+def test_precompress_writes_fresh_siblings_only(tmp_path):
+    script = tmp_path / 'app.js'
+    script.write_text('console.log("neo focus");\n' * 200)
+    (tmp_path / 'tiny.js').write_text('1')
+    (tmp_path / 'photo.jpg').write_bytes(os.urandom(4096))
+
+    assert precompress_directory(str(tmp_path)) >= 1
+    assert gzip.decompress((tmp_path / 'app.js.gz').read_bytes()) == script.read_bytes()
+    assert not (tmp_path / 'tiny.js.gz').exists()
+    assert not (tmp_path / 'photo.jpg.gz').exists()
+    assert precompress_directory(str(tmp_path)) == 0
+
+    stat = os.stat(script)
+    encoding, path, _ = find_precompressed(str(script), stat, 'gzip')
+    assert (encoding, path) == ('gzip', str(script) + '.gz')
+    assert find_precompressed(str(script), stat, 'identity')[0] is None
+    # A sibling older than the file it was built from is ignored
+    os.utime(script, ns=(stat.st_atime_ns, os.stat(str(script) + '.gz').st_mtime_ns + 10**9))
+    assert find_precompressed(str(script), os.stat(script), 'gzip')[0] is None
+
+
+def test_cache_admits_files_on_second_request(tmp_path):
+    path = tmp_path / 'page.html'
+    path.write_text('<html></html>')
+    cache = StaticFileCache(max_bytes=100, max_file_bytes=50)
+    stat = os.stat(path)
+
+    assert cache.get(str(path), stat) == (None, False)
+    assert cache.get(str(path), stat) == (None, True)
+    cache.put(str(path), stat, path.read_bytes())
+    assert cache.get(str(path), stat) == (b'<html></html>', False)
+
+    path.write_text('<html>changed</html>')
+    assert cache.get(str(path), os.stat(path))[0] is None